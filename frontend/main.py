@@ -13,12 +13,17 @@ from frontend.utils import (
     update_config_file_with_chunk_size_chunk_overlap,
     get_project_filepath,
     from_dict_to_string_for_frontend_output,
+    read_analysis_events,
     delete_file
 
 )
-from src.agent import ragrunner
 
 # non-frontend helpers
+def _run_rag(csv_folderpath,query):
+    # the agent graph and its langchain imports load on the first run, not at startup
+    from src.agent import ragrunner
+    ragrunner(csv_folderpath=csv_folderpath,query=query)
+
 def _update_get_vector_store_document_count(state):
     count = get_vector_store_document_count()
     state['text_input_docs_in_vector_store'] = count
@@ -31,13 +36,21 @@ def handle_input_folder(state,payload):
     state["textarea_list_csvs"] = get_list_of_files(path=payload)
 
 def handle_timer_display_analysis_tick(state:StreamsyncState):
-    # handle analysis
+    # handle analysis: only the events appended since the last tick are read
+    text,offset,reset = read_analysis_events(offset=state["_analysis_events_offset"])
+    state["_analysis_events_offset"] = offset
+    # a new run truncated the log, its text replaces the previous one
+    state["_analysis_text"] = text if reset else f'{state["_analysis_text"]}{text}'
     if state["SHOULD_SHOW_ANALYSIS"] == True:
-        savepath = f'{get_project_filepath()}/data/output/analysis_node_output.json'
-        text = load_json_filedata(filepath=savepath)
-        #cleaned_text = from_agent_message_string_to_human_readable_string(txt=text)
-        cleaned_text = from_dict_to_string_for_frontend_output(txt=text)
-        state["textarea_show_analysis"] = cleaned_text
+        if state["_analysis_text"]:
+            state["textarea_show_analysis"] = state["_analysis_text"]
+        else:
+            # no event log yet (e.g. an analysis from an older run), show the saved output
+            savepath = f'{get_project_filepath()}/data/output/analysis_node_output.json'
+            text = load_json_filedata(filepath=savepath)
+            #cleaned_text = from_agent_message_string_to_human_readable_string(txt=text)
+            cleaned_text = from_dict_to_string_for_frontend_output(txt=text)
+            state["textarea_show_analysis"] = cleaned_text
     else:
         state["textarea_show_analysis"] = f"No analysis to show right now (@ {datetime.now().__str__()})"
 
@@ -61,11 +74,13 @@ def handle_button_rag_runner(state):
             if 'Sorry there was an error' not in bullet_list_of_files:
                 start = datetime.now()
                 # set status update
-                state["SHOULD_SHOW_ANALYSIS"] = False
+                # the analysis shows up as it is generated
+                state["checkbox_analysis_display_options"] = ['show_analysis']
+                state["SHOULD_SHOW_ANALYSIS"] = True
                 state['text_input_runner_status'] = f"Started running at {start.__str__()}"
                 logger.warning(f'AGENTIC RAG STARTED')
                 # start the rag
-                ragrunner(csv_folderpath=csv_folderpath,query=user_query)
+                _run_rag(csv_folderpath=csv_folderpath,query=user_query)
                 end = datetime.now()
                 timetaken = round((end - start).total_seconds()/60,1)
                 # set status updated
@@ -83,15 +98,20 @@ def handle_button_run_query(state):
         # debounce button 
         if 'running' not in state['text_input_runner_status'].lower() :
             user_query = state['text_input_query']
+            # the count starts at 0 until the first timer tick loads it
+            if not state['text_input_docs_in_vector_store']:
+                _update_get_vector_store_document_count(state)
             documents_in_vector_store = state['text_input_docs_in_vector_store']
             if documents_in_vector_store > 0:
                 start = datetime.now()
                 # set status update
-                state["SHOULD_SHOW_ANALYSIS"] = False
+                # the analysis shows up as it is generated
+                state["checkbox_analysis_display_options"] = ['show_analysis']
+                state["SHOULD_SHOW_ANALYSIS"] = True
                 state['text_input_runner_status'] = f"Started running at {start.__str__()}"
                 logger.warning(f'AGENTIC RAG STARTED')
                 # start the rag
-                ragrunner(csv_folderpath=None,query=user_query)
+                _run_rag(csv_folderpath=None,query=user_query)
                 end = datetime.now()
                 timetaken = round((end - start).total_seconds()/60,1)
                 # set status updated
@@ -124,6 +144,7 @@ def handle_number_input_chunk_overlap(state,payload):
 def handle_button_clear_analysis(state):
     delete_file(file_path=f'{get_project_filepath()}/data/output/analysis_node_output.json')
     state["textarea_show_analysis"] = "Nothing to show now"
+    state["_analysis_text"] = ""
     state["SHOULD_SHOW_ANALYSIS"] = False
 
 # -------------------------- end handlers ---------------------
@@ -139,10 +160,14 @@ initial_state = ss.init_state({
     "csv_folderpath":input_folder,
     "textarea_show_analysis":"Nothing to show now",
     "SHOULD_SHOW_ANALYSIS":False,
+    # text of the analysis events read so far and where the next read starts (private, not sent to the browser)
+    "_analysis_text":"",
+    "_analysis_events_offset":0,
     "text_input_runner_status":"Ready!",
     "number_input_chunk_size":1000,
     "number_input_chunk_overlap":10,
     "text_input_query":"Perform in-depth analysis on the data in the vector store collection",
-    "text_input_docs_in_vector_store":get_vector_store_document_count()
+    # loaded by the first timer tick, startup doesn't wait for the database
+    "text_input_docs_in_vector_store":0
 })
 
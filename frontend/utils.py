@@ -4,7 +4,8 @@ import re
 import json
 
 # local imports
-from src.agents.vector_store import VectorStore
+from src.utils.store_registry import get_vector_store
+from src.utils.event_log import get_event_log
 from src.utils.utils import load_config_params_for_node, get_project_filepath
 
 
@@ -109,15 +110,34 @@ def from_dict_to_string_for_frontend_output(txt:dict) -> str:
         cleaned_data: cleaned string of output fit for human consumption
     """
     string = ''
-    for key in range(1,10):
-        text = txt.get(str(key))
-        text = clean_string(text)
+    # keys are the message numbers, from 0, as strings once read back from json
+    for key in sorted((txt or {}).keys(),key=int):
+        text = clean_string(txt[key])
+        if not text:
+            continue
         logger.info(f'text={text}')
-        string = f'{string}{text}'
-
-        break
+        string = f'{string}{text}\n\n'
     return string
 
+def read_analysis_events(offset:int=0) -> tuple:
+    """
+    Text of the analysis events appended since offset, only the new bytes of the
+    event log are read
+
+    Args:
+        offset: where the previous read stopped, 0 at first
+
+    Returns:
+        (text, offset, reset): new text, offset of the next read and whether a new run
+        started since the previous read (the text then replaces the displayed one)
+    """
+    events,offset,reset = get_event_log().read(offset=offset)
+    starts = [i for i,event in enumerate(events) if event.get("type") == "run_start"]
+    if starts:
+        events,reset = events[starts[-1]:],True
+    text = "".join(event.get("text") or "" for event in events)
+    return text,offset,reset
+
 def clean_string(txt:str) -> str:
     """
     Replace non-human readable snippets in string
@@ -144,7 +164,7 @@ def clear_vector_store() -> str:
     Returns:
         vector store status update
     """
-    vs = VectorStore()
+    vs = get_vector_store()
     vs.clear_store()
     return 'Vector store emptied'
 
@@ -155,7 +175,7 @@ def get_vector_store_document_count() -> int:
     Returns:
         # of docs in vector store
     """
-    vs = VectorStore()
+    vs = get_vector_store()
     return vs.get_document_count()
 
 def update_config_file_with_chunk_size_chunk_overlap(chunk_size:int,chunk_overlap:int) -> None:
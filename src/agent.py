@@ -1,63 +1,58 @@
-from langchain_core.messages import HumanMessage, SystemMessage, ToolMessage, RemoveMessage, BaseMessage
+from langchain_core.messages import HumanMessage
 from langgraph.graph import StateGraph, START, END
-from langgraph.prebuilt import create_react_agent
-from langchain_anthropic import ChatAnthropic
-from langgraph.graph import MessagesState, END
-from langgraph.types import Command
-from typing import Literal,Any
-from langchain_community.agent_toolkits.load_tools import load_tools
-from langchain_core.tools import tool
-from langchain.tools import Tool
 from loguru import logger
-import json
-import ast
-from langchain_core.messages.base import message_to_dict, messages_to_dict
-from langchain.output_parsers import PydanticOutputParser, JsonOutputToolsParser
-from langchain.output_parsers.json import SimpleJsonOutputParser
-from langchain.prompts import PromptTemplate
-from langgraph.prebuilt import create_react_agent
-from langchain.schema import messages_to_dict, message_to_dict
+import threading
 import argparse
 
-# agents
-from src.agents.document_processor import DocumentProcessor
-from src.agents.supervisor import Supervisor
-from src.agents.vector_store import VectorStore
-from src.agents.insurance_analysis import InsuranceAnalysisAgent
-
 # helpers
-from src.utils.utils import get_project_filepath, save_dict_to_json_file, load_config_params_for_node
-from src.agents.supervisor import supervisor_node, Supervisor
+from src.agents.supervisor import supervisor_node, get_supervisor, get_routing_stats
 from src.utils.agent_state import AgentState
 from src.utils.prompt import Prompt
 from src.utils.create_nodes import CreateNode
 
-    
+# the compiled graph is built on the first run and reused by the next ones
+_graph_lock = threading.Lock()
+_graph = None
+
+
 # ------------- create nodes ---------------------------
-supervisor = Supervisor()
-document_processor_node = CreateNode(
-    name="document_processor",
-    description="load and split documents",
-    llm=supervisor.llm,
-    tool_function=DocumentProcessor,
-    prompt=Prompt
-)
-
-vector_store_node = CreateNode(
-    name="vector_store",
-    description="store documents in postgres database",
-    llm=supervisor.llm,
-    tool_function=VectorStore,
-    prompt=Prompt
-)
-
-analysis_node = CreateNode(
-    name="analysis",
-    description="Analyze documents in postgres database",
-    llm=supervisor.llm,
-    tool_function=InsuranceAnalysisAgent,
-    prompt=Prompt
-)
+def create_nodes() -> dict:
+    """
+    Worker nodes of the graph. The agent modules (langchain chains, pandas, the
+    vector store) are imported here rather than at module load, and each worker is
+    only constructed on its first tool call (see CreateNode)
+
+    returns:
+        - nodes keyed by name
+    """
+    from src.agents.document_processor import DocumentProcessor
+    from src.agents.insurance_analysis import InsuranceAnalysisAgent
+    from src.utils.store_registry import get_vector_store
+
+    llm = get_supervisor().llm
+    return {
+        "document_processor":CreateNode(
+            name="document_processor",
+            description="load and split documents",
+            llm=llm,
+            tool_function=DocumentProcessor,
+            prompt=Prompt
+        ),
+        "vector_store":CreateNode(
+            name="vector_store",
+            description="store documents in postgres database",
+            llm=llm,
+            tool_function=get_vector_store,
+            prompt=Prompt
+        ),
+        "analysis":CreateNode(
+            name="analysis",
+            description="Analyze documents in postgres database",
+            llm=llm,
+            tool_function=InsuranceAnalysisAgent,
+            prompt=Prompt
+        ),
+    }
 
 def create_agent_graph():
     """
@@ -66,17 +61,30 @@ def create_agent_graph():
     returns:
         - Graph
     """
+    nodes = create_nodes()
     builder = StateGraph(AgentState)
     builder.add_node("supervisor", supervisor_node)
-    builder.add_node("document_processor", document_processor_node.node)
-    builder.add_node("vector_store", vector_store_node.node)
-    builder.add_node("analysis", analysis_node.node)
+    for name,node in nodes.items():
+        builder.add_node(name, node.node)
 
     builder.add_edge(START, "supervisor")
 
     graph = builder.compile()
     return graph
 
+def get_agent_graph():
+    """
+    Compiled graph shared by every run, created on first use
+
+    returns:
+        - Graph
+    """
+    global _graph
+    with _graph_lock:
+        if _graph is None:
+            _graph = create_agent_graph()
+        return _graph
+
 
 def ragrunner(csv_folderpath:str=None,query:str=None) -> None: 
     """
@@ -98,20 +106,24 @@ def ragrunner(csv_folderpath:str=None,query:str=None) -> None:
     logger.info(f'{query=}')
 
     # initialize the graph
-    graph = create_agent_graph()
+    graph = get_agent_graph()
     # Initialize the state
     initial_state = AgentState(
         messages=[HumanMessage(content=query)] if query else [],
+        dir_path=csv_folderpath,
+        query=query,
         next="supervisor"
     )
 
     # Run the graph
+    error = None
     for output in graph.stream(initial_state,{"recursion_limit": 50}):
         if "__end__" not in output:
             logger.info(f"{type(output)}....Intermediate output: {output}")
+            error = next((update["error"] for update in output.values() if isinstance(update,dict) and update.get("error")),error)
 
-    status_update = "Analysis complete!"
-    logger.info(f'{status_update=}')
+    status_update = f"Analysis failed: {error}" if error else "Analysis complete!"
+    logger.info(f'{status_update=} routing={get_routing_stats()}')
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Insurance Data Analysis Pipeline')
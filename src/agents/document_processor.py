@@ -1,10 +1,6 @@
-from typing import List, Dict, Any
-from langchain_community.document_loaders import UnstructuredCSVLoader
+from typing import List, Dict, Any, Iterable, Iterator
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
-from langchain.agents import AgentExecutor, create_openai_tools_agent
-
-from langgraph.prebuilt import create_react_agent
 from loguru import logger
 import logging
 from pydantic import BaseModel
@@ -14,12 +10,21 @@ import pandas as pd
 from datetime import time
 import json
 import sys
+import itertools
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 
 
 
 # ---- project imports
 from src.utils.utils import get_project_filepath, get_list_of_files_in_directory, load_config_params_for_node
-from src.agents.vector_store import VectorStore
+from src.utils.csv_loaders import load_csv_file
+from src.agents.vector_store import VectorStore, get_manifest_path
+from src.utils.store_registry import get_vector_store
+from src.utils.manifest import IngestManifest, get_ingest_manifest, hash_file, hash_text
+from src.utils.dedup import deduplicate_documents
+from src.utils.metadata_filters import add_filter_metadata
+from src.utils.streaming_pipeline import StreamingIngestionPipeline
+from src.utils.artifact_store import get_artifact_store
 
 
 # setup loggers
@@ -31,6 +36,42 @@ logger.add(
     level="DEBUG"
     )
 
+def load_and_split_file(
+        file_path:str, 
+        chunk_size:int=None, 
+        chunk_overlap:int=None, 
+        engine:str="unstructured", 
+        rows_per_document:int=1,
+        normalize:bool=False
+    ) -> dict:
+    """
+    Load a single csv file and split it with the text splitter. Lives at module level
+    so that it can be pickled and run inside a worker process
+
+    Args:
+        file_path: Path to the file
+        chunk_size: Size of token chunks, no splitting if None
+        chunk_overlap: Overlap of token chunks
+        engine: csv loader engine (see src.utils.csv_loaders)
+        rows_per_document: rows per document for the native engines
+        normalize: normalize rows so duplicates across files compare equal
+
+    Returns:
+        result(dict): keys 'file_path','documents','error'
+    """
+    try:
+        docs = load_csv_file(file_path,engine=engine,rows_per_document=rows_per_document,normalize=normalize)
+        if chunk_size:
+            text_splitter = RecursiveCharacterTextSplitter(
+                chunk_size=chunk_size,
+                chunk_overlap=chunk_overlap
+            )
+            docs = text_splitter.split_documents(docs)
+        return {"file_path":file_path,"documents":add_filter_metadata(docs),"error":None}
+    except Exception as e:
+        return {"file_path":file_path,"documents":[],"error":f'{type(e).__name__}: {e}'}
+
+
 class DocumentProcessor(BaseModel):
     name:str = "document_processor"
     role:str = "Document processor"
@@ -40,6 +81,7 @@ class DocumentProcessor(BaseModel):
     text_splitter:RecursiveCharacterTextSplitter = None
     dir_path:str = f'{get_project_filepath()}/data'
     content_loaded_tracker:list = []
+    failed_files:dict = {}
     vector_store:VectorStore = None
     
     class Config:
@@ -84,8 +126,12 @@ class DocumentProcessor(BaseModel):
         """
         try:
             #logger.info(f"Loading Excel file: {file_path}")
-            loader = UnstructuredCSVLoader(file_path)
-            docs = loader.load()
+            docs = load_csv_file(
+                file_path,
+                engine=self.configs.get("loader_engine","unstructured"),
+                rows_per_document=self.configs.get("rows_per_document",1),
+                normalize=self.configs.get("normalize_rows",False)
+            )
             logger.info(f"Loaded: Excel file {file_path}={docs}")
         except FileNotFoundError:
             logger.error(f'Could not find {file_path}')
@@ -95,30 +141,151 @@ class DocumentProcessor(BaseModel):
             docs = []
         return docs
     
-    def load_all_files(self,dir_path:str) -> list[str]:
+    def load_all_files(self,dir_path:str,split:bool=False) -> list[Document]:
         """
-        Load all files in director
+        Load all files in director. Uses a process pool when more than one worker is configured
 
         Args:
             dir_path: location of docments
+            split: split the documents with the text splitter while loading
               
         Returns:
-            documents(list): loaded files split by textsplitter
+            documents(list): loaded files (split by textsplitter if split=True), in file order
         """
-        files_to_load = get_list_of_files_in_directory(dir_path=dir_path)
+        files_to_load = self.get_filenames_from_folder(dir_path=dir_path)
         documents = []
         if files_to_load:
             logger.warning(f'files to load:{files_to_load}')
-            for file_path in files_to_load:
-                try:
-                    # load and process files
-                    file_path = f'{dir_path}/{file_path}'
-                    documents += self.load_csv(file_path=file_path)
-                except Exception as e:
-                    logger.error(f'DocumentProcessor Error:{e}')
+            file_paths = [f'{dir_path}/{file_path}' for file_path in files_to_load]
+            documents = self.load_files(file_paths=file_paths,split=split)
         logger.info(f'{len(files_to_load)}   ....  {len(documents)}')          
         return documents
-            
+
+    def load_files(self,file_paths:list[str],split:bool=False) -> list[Document]:
+        """
+        Load a list of files. Uses a process pool when more than one worker is configured
+
+        Args:
+            file_paths: paths of the files to load
+            split: split the documents with the text splitter while loading
+
+        Returns:
+            documents(list): loaded files (split by textsplitter if split=True), in file order
+        """
+        documents = []
+        self.failed_files = {}
+        workers = self.configs.get("workers",1)
+        if workers > 1 and len(file_paths) > 1:
+            return self.load_files_in_parallel(file_paths=file_paths,workers=workers,split=split)
+        for file_path in file_paths:
+            documents += self.load_file(file_path=file_path,split=split)["documents"]
+        return documents
+
+    def get_loader_arguments(self,split:bool=False) -> tuple:
+        """
+        Arguments of load_and_split_file after the file path, from the config
+
+        Args:
+            split: split the documents with the text splitter while loading
+
+        Returns:
+            (chunk_size, chunk_overlap, engine, rows_per_document, normalize)
+        """
+        return (
+            self.configs.get("chunk_size") if split else None,
+            self.configs.get("chunk_overlap"),
+            self.configs.get("loader_engine","unstructured"),
+            self.configs.get("rows_per_document",1),
+            self.configs.get("normalize_rows",False),
+        )
+
+    def load_file(self,file_path:str,split:bool=False) -> dict:
+        """
+        Load (and split) one file in this process. A file that fails to load is recorded
+        in failed_files, so callers don't mistake it for an empty file
+
+        Args:
+            file_path: path of the file
+            split: split the documents with the text splitter while loading
+
+        Returns:
+            result(dict): keys 'file_path','documents','error' (see load_and_split_file)
+        """
+        result = load_and_split_file(file_path,*self.get_loader_arguments(split=split))
+        if result["error"]:
+            self.failed_files[file_path] = result["error"]
+            logger.error(f'DocumentProcessor Error: {file_path}: {result["error"]}')
+        else:
+            logger.info(f'Loaded: {file_path} ({len(result["documents"])} documents)')
+        return result
+
+    def load_files_in_parallel(self,file_paths:list[str],workers:int,split:bool=False) -> list[Document]:
+        """
+        Load (and split) files across a process pool. At most 'max_files_in_flight' files
+        are submitted at any time so memory stays bounded on large folders
+
+        Args:
+            file_paths: paths of the files to load
+            workers: number of worker processes
+            split: split the documents with the text splitter inside the workers
+
+        Returns:
+            documents(list): documents in the same order as file_paths
+        """
+        documents = []
+        for result in self.iter_loaded_files(file_paths=file_paths,workers=workers,split=split):
+            documents += result["documents"]
+        return documents
+
+    def iter_loaded_files(self,file_paths:Iterable[str],workers:int,split:bool=False) -> Iterator[dict]:
+        """
+        Lazily load (and split) files across a process pool, yielding one result per file
+        in input order. At most 'max_files_in_flight' files are loaded or waiting to be
+        consumed at any time, so a slow consumer holds back the pool
+
+        Args:
+            file_paths: paths of the files to load, can be a lazy iterator
+            workers: number of worker processes
+            split: split the documents with the text splitter inside the workers
+
+        Yields:
+            result(dict): keys 'file_path','documents','error' (see load_and_split_file)
+        """
+        max_in_flight = max(self.configs.get("max_files_in_flight",workers*2),1)
+        arguments = self.get_loader_arguments(split=split)
+        results = {}
+        files_iter = enumerate(file_paths)
+        next_idx = 0
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = {}
+
+            def submit(n:int) -> None:
+                for idx,file_path in itertools.islice(files_iter,n):
+                    future = executor.submit(load_and_split_file,file_path,*arguments)
+                    pending[future] = (idx,file_path)
+
+            submit(max_in_flight)
+            while pending:
+                done,_ = wait(pending,return_when=FIRST_COMPLETED)
+                for future in done:
+                    idx,file_path = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        result = {"file_path":file_path,"documents":[],"error":f'{type(e).__name__}: {e}'}
+                    if result["error"]:
+                        self.failed_files[file_path] = result["error"]
+                        logger.error(f'DocumentProcessor Error: {file_path}: {result["error"]}')
+                    else:
+                        logger.info(f'Loaded: {file_path} ({len(result["documents"])} documents)')
+                    results[idx] = result
+                # hand out finished files in order
+                while next_idx in results:
+                    yield results.pop(next_idx)
+                    next_idx += 1
+                # refill the pool as slots free up, counting results not consumed yet
+                submit(max_in_flight - len(pending) - len(results))
+
     def load_df(self, df: pd.DataFrame) -> List[Document]:
         """
         Load dataframe
@@ -142,20 +309,23 @@ class DocumentProcessor(BaseModel):
             docs = []
         return docs
     
-    def process_documents(self, documents: List[Document]) -> List[Document]:
+    def process_documents(self, documents: List[Document], split:bool=True) -> List[Document]:
         """
         Process documents by splitting and extracting metadata
 
         Args:
             documents(list): raw documents
+            split: set to False if the documents were already split while loading
 
         Returns:
             docs(list): content with metadata
         """
         split_documents = []
         if documents:
-            self.setup()
-            docs = self.text_splitter.split_documents(documents)
+            docs = documents
+            if split:
+                self.setup()
+                docs = self.text_splitter.split_documents(documents)
             for doc in docs:
                 if not isinstance(doc,str):
                     split_documents.append({"content":doc.page_content,"metadata":doc.metadata})
@@ -165,7 +335,8 @@ class DocumentProcessor(BaseModel):
     
     def process_and_save_documents(self, documents: List[Document]) -> None:
         """
-        Process documents by splitting and extracting metadata, then save to pgstore
+        Process documents by splitting and extracting metadata, then save to pgstore.
+        Only chunks missing from the ingestion manifest are embedded
 
         Args:
             documents(list): raw documents
@@ -175,22 +346,200 @@ class DocumentProcessor(BaseModel):
         """
         
         # -- process
-        documents = self.process_documents(documents)
-        if isinstance(documents[0],list):
+        documents = self.process_documents(deduplicate_documents(documents))
+        if documents and isinstance(documents[0],list):
             documents = documents[0]
         logger.info(f'documents:{documents}')
         # -- save
         try:
             if documents:
-                if not self.vector_store:
-                    self.vector_store = VectorStore()
-                # delete all records
-                self.vector_store.clear_store()
-                self.vector_store.add_documents(documents=documents)
-                return 'Documents successfully added'
+                chunks_by_file = {}
+                for doc in documents:
+                    chunk = Document(page_content=doc["content"],metadata=doc["metadata"])
+                    # a deduplicated chunk belongs to every file it was found in
+                    for source in doc["metadata"].get("sources") or [doc["metadata"].get("source","")]:
+                        chunks_by_file.setdefault(source,[]).append(chunk)
+                file_hashes = {
+                    source:hash_file(source) if os.path.isfile(source) 
+                    else hash_text(''.join(doc.page_content for doc in chunks))
+                    for source,chunks in chunks_by_file.items()
+                }
+                stats = self.save_chunks(chunks_by_file=chunks_by_file,file_hashes=file_hashes)
+                return f'Documents successfully added: {stats}'
         except Exception as e:
             logger.error(f'error saving documents:{e}')
 
+    def get_manifest(self) -> IngestManifest:
+        """
+        Ingestion manifest, shared by every caller in the process
+        """
+        return get_ingest_manifest(get_manifest_path())
+
+    def save_chunks(self, chunks_by_file: Dict[str,List[Document]], file_hashes: Dict[str,str], removed_files: List[str] = None) -> dict:
+        """
+        Upsert new chunks and delete stale ones, file by file, using the manifest to
+        skip chunks that are already stored. The manifest entry of a file is only
+        written after its vectors were saved, so a failed run is retried next time
+
+        Args:
+            chunks_by_file: split documents keyed by source file
+            file_hashes: content hash of each source file
+            removed_files: files that no longer exist and whose vectors must go
+
+        Returns:
+            stats(dict): number of added and deleted chunks
+        """
+        if not self.vector_store:
+            self.vector_store = get_vector_store()
+        manifest = self.get_manifest()
+        stats = {"added":0,"deleted":0}
+        for file_path in removed_files or []:
+            _,to_delete = manifest.plan_file(file_path=file_path,chunk_hashes=set())
+            self.vector_store.delete_documents(ids=[self.vector_store.make_document_id(h) for h in to_delete])
+            manifest.remove_file(file_path)
+            stats["deleted"] += len(to_delete)
+
+        for file_path,chunks in chunks_by_file.items():
+            chunks_by_hash = {hash_text(chunk.page_content):chunk for chunk in chunks}
+            previous = manifest.get_chunks(file_path)
+            to_add,to_delete = manifest.plan_file(file_path=file_path,chunk_hashes=set(chunks_by_hash))
+            if to_add:
+                self.vector_store.add_documents(
+                    documents=[chunks_by_hash[h] for h in to_add],
+                    ids=[self.vector_store.make_document_id(h) for h in to_add]
+                )
+            # chunks another file stored first, possibly in an earlier run
+            shared = set(chunks_by_hash) - to_add - previous
+            self.vector_store.add_sources({self.vector_store.make_document_id(h):[file_path] for h in shared})
+            self.vector_store.delete_documents(ids=[self.vector_store.make_document_id(h) for h in to_delete])
+            manifest.update_file(file_path=file_path,content_hash=file_hashes[file_path],chunk_hashes=set(chunks_by_hash))
+            stats["added"] += len(to_add)
+            stats["deleted"] += len(to_delete)
+        logger.info(f'saved chunks:{stats}')
+        return stats
+
+    def sync_directory(self, dir_path: str) -> dict:
+        """
+        Bring the vector store in line with a folder: unchanged files (same content hash)
+        are not even loaded, changed files only embed their new chunks and the vectors
+        of deleted files are removed
+
+        Args:
+            dir_path: location of the csv files
+
+        Returns:
+            stats(dict): counts of changed, unchanged and removed files, added and deleted chunks
+        """
+        manifest = self.get_manifest()
+        file_paths = [f'{dir_path}/{file}' for file in self.get_filenames_from_folder(dir_path=dir_path)]
+        file_hashes = {file_path:hash_file(file_path) for file_path in file_paths}
+        changed = [f for f in file_paths if manifest.get_file_hash(f) != file_hashes[f]]
+        removed = [f for f in manifest.get_files(dir_path=dir_path) if f not in file_hashes]
+        logger.info(f'sync {dir_path}: {len(changed)} changed, {len(file_paths)-len(changed)} unchanged, {len(removed)} removed')
+
+        chunks_by_file = {file_path:[] for file_path in changed}
+        for doc in deduplicate_documents(self.load_files(file_paths=changed,split=True)):
+            for source in doc.metadata["sources"]:
+                chunks_by_file.setdefault(source,[]).append(doc)
+        # don't record files that failed to load, so they are retried on the next run
+        for file_path in self.failed_files:
+            chunks_by_file.pop(file_path,None)
+        stats = self.save_chunks(chunks_by_file=chunks_by_file,file_hashes=file_hashes,removed_files=removed)
+        stats.update({"changed_files":len(chunks_by_file),"unchanged_files":len(file_paths)-len(changed),"removed_files":len(removed)})
+        return stats
+
+    def stream_directory(self, dir_path: str) -> dict:
+        """
+        Same result as sync_directory, but files are streamed through load -> split ->
+        embed -> write in bounded batches, so memory stays flat on large folders and
+        the first batches are queryable while ingestion is still running
+
+        Args:
+            dir_path: location of the csv files
+
+        Returns:
+            stats(dict): see StreamingIngestionPipeline.run
+        """
+        if not self.vector_store:
+            self.vector_store = get_vector_store()
+        self.failed_files = {}
+        pipeline = StreamingIngestionPipeline(
+            processor=self,
+            vector_store=self.vector_store,
+            manifest=self.get_manifest(),
+            batch_size=self.configs.get("stream_batch_size",256),
+            max_pending_batches=self.configs.get("stream_max_pending_batches",2)
+        )
+        return pipeline.run(dir_path=dir_path)
+
+    def stage_directory(self, dir_path: str) -> str:
+        """
+        Load and split the changed files of a folder into the artifact store instead of
+        writing them, the vector store node writes them from the returned handle (see
+        VectorStore.ingest_artifact). Only the handle travels through the graph state
+        and the LLM messages
+
+        Args:
+            dir_path: location of the csv files
+
+        Returns:
+            handle(str): artifact handle
+        """
+        if not self.vector_store:
+            self.vector_store = get_vector_store()
+        self.failed_files = {}
+        pipeline = StreamingIngestionPipeline(
+            processor=self,
+            vector_store=self.vector_store,
+            manifest=self.get_manifest(),
+            batch_size=self.configs.get("stream_batch_size",256),
+        )
+        return pipeline.stage(dir_path=dir_path,artifacts=get_artifact_store())
+
+    def reindex_directory(self, dir_path: str) -> dict:
+        """
+        Re-embed a whole folder without emptying the store first: the chunks are built
+        into a shadow collection and swapped in once complete (see VectorStore.reindex),
+        queries keep seeing the previous documents until then. Files are loaded lazily
+        and streamed into the shadow batch by batch, so memory stays flat on large
+        folders. The manifest is rewritten only if the swap happened
+
+        Args:
+            dir_path: location of the csv files
+
+        Returns:
+            stats(dict): see VectorStore.reindex, plus the number of files
+        """
+        if not self.vector_store:
+            self.vector_store = get_vector_store()
+        self.failed_files = {}
+        file_paths = [f'{dir_path}/{file}' for file in self.get_filenames_from_folder(dir_path=dir_path)]
+        workers = self.configs.get("workers",1)
+        if workers > 1:
+            results = self.iter_loaded_files(file_paths=file_paths,workers=workers,split=True)
+        else:
+            results = (self.load_file(file_path,split=True) for file_path in file_paths)
+        chunk_hashes = {}
+
+        def iter_chunks() -> Iterator[Document]:
+            # rows repeated across files are merged by bulk_upsert (see collect_chunks, add_sources)
+            for result in results:
+                for doc in deduplicate_documents(result["documents"]):
+                    chunk_hashes.setdefault(result["file_path"],set()).add(hash_text(doc.page_content))
+                    yield doc
+
+        stats = self.vector_store.reindex(chunks=iter_chunks())
+        if stats["swapped"]:
+            manifest = self.get_manifest()
+            manifest.clear()
+            # files that failed to load are left out, so the next sync retries them
+            for file_path in file_paths:
+                if file_path not in self.failed_files:
+                    manifest.update_file(file_path=file_path,content_hash=hash_file(file_path),chunk_hashes=chunk_hashes.get(file_path,set()))
+        stats["files"] = len(file_paths) - len(self.failed_files)
+        logger.info(f'reindex {dir_path}: {stats}')
+        return stats
+
     def query_llm(self, input_prompt:str=None):
         """Simulates querying the LLM with a role-specific prompt."""
         system=f"You are a: {self.name}. Your role: {self.role}. Your task: {self.function}."
@@ -210,23 +559,37 @@ class DocumentProcessor(BaseModel):
         logger.warning(f'state={state}')
         if state not in self.content_loaded_tracker:
             self.setup()
-            documents = self.load_all_files(dir_path=state)
-            processed_documents = self.process_documents(documents)
-            #logger.warning(f'processed documents={processed_documents}')
+            # only new or changed chunks are embedded, the manifest remembers the rest
+            if self.configs.get("handoff","direct") == "artifact" and not self.configs.get("full_reindex",False):
+                handle = self.stage_directory(dir_path=state)
+                self.content_loaded_tracker.append(state)
+                return {
+                    "messages":f"""goto vector_store.
+                    The documents are staged as {handle}, the vector_store node writes them.
+                    Send ONLY an empty JSON array [] to the vector_store_tool.
+                    DO NOT PERFORM ANALYSIS in the vector_store_node.
+                    """,
+                    "next":self.next,
+                    "documents":handle,
+                    "query":None,
+                    "dir_path":None
+                    }
+            if self.configs.get("full_reindex",False):
+                stats = self.reindex_directory(dir_path=state)
+            elif self.configs.get("streaming",False):
+                stats = self.stream_directory(dir_path=state)
+            else:
+                stats = self.sync_directory(dir_path=state)
             # memoize documents loaded this session
             self.content_loaded_tracker.append(state)
-            #return {"documents": processed_documents}
-            #processed_documents = ",  ".join(processed_documents)
-            #return f"send to vector_store as a JSON object with keys : 'Year', 'Average expenditure', 'Percent change','metadata'.Do not perform any aggregations:{processed_documents}"
-            #return f"send to Vector_store: {processed_documents}. DO NOT PERFORM ANALYSIS"
-            #f"send documents to vector_store as a JSON list of dictionaries with keys : 'content','metadata'.Do NOT perform any analyis whatsoever.Documents:{processed_documents}",
             return {
                 "messages":f"""goto vector_store.
-                Send the processed documents as ONLY ONE big JSON array with keys : 'content','metadata':{processed_documents}.
+                The documents are already saved in the vector store ({stats}).
+                Send ONLY an empty JSON array [] to the vector_store_tool.
                 DO NOT PERFORM ANALYSIS in the vector_store_node.
                 """,
                 "next":self.next,
-                "documents":processed_documents,
+                "documents":[],
                 "query":None,
                 "dir_path":None
                 }
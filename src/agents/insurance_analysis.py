@@ -1,19 +1,16 @@
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 from langchain_anthropic import ChatAnthropic
-from langchain.agents import AgentExecutor, create_openai_tools_agent
 from langchain.tools import Tool
 from langchain.chains.qa_with_sources.retrieval import RetrievalQAWithSourcesChain
 from langgraph.checkpoint.memory import MemorySaver
 from langgraph.prebuilt import create_react_agent
+from langgraph.graph.state import CompiledStateGraph
 from typing import Annotated
-from langchain_core.tools import tool
+from langchain_core.tools import tool, StructuredTool
 from langchain_experimental.utilities import PythonREPL
 from langchain_experimental.tools import PythonREPLTool
-from langchain_core.messages import HumanMessage, SystemMessage, ToolMessage
-from langchain_core.tools import create_retriever_tool
-from langchain.chains.combine_documents import create_stuff_documents_chain
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
 from langchain.chains import RetrievalQA
-import psycopg
 from datetime import time
 import logging
 import os
@@ -26,8 +23,13 @@ load_dotenv()
 
 # project import
 from src.agents.vector_store import VectorStore
+from src.utils.store_registry import get_vector_store
 from src.utils.prompt import Prompt
 from src.utils.utils import get_project_filepath, save_dict_to_json_file, load_config_params_for_node
+from src.utils.answer_cache import get_answer_cache
+from src.utils.embedding_cache import get_model_name
+from src.utils.event_log import get_event_log
+from src.utils.message_history import get_content_text
 
 
 # setup loggers
@@ -47,7 +49,7 @@ class InsuranceAnalysisAgent:
             
         """
         self.name = "analysis"
-        self.vector_store = VectorStore()
+        self.vector_store = get_vector_store()
         self.vector_store.init_store()
         self.model_name = "claude-3-sonnet-20240229"
         self.llm = ChatAnthropic(model_name=self.model_name,api_key=os.getenv('ANTHROPIC_API_KEY'))
@@ -83,7 +85,7 @@ class InsuranceAnalysisAgent:
             Initialized RetrievalQAWithSourcesChain
         """
         #: Implement retrieval chain creation
-        retriever = self.vector_store.vector_store.as_retriever()
+        retriever = self.vector_store.as_retriever()
         chain = RetrievalQAWithSourcesChain.from_llm(llm=self.llm, retriever=retriever)
         return chain
 
@@ -95,22 +97,54 @@ class InsuranceAnalysisAgent:
             List of Tool objects
         """
         tools = [
-            Tool(
+            StructuredTool.from_function(
+                func=self.search_documents,
+                coroutine=self.asearch_documents,
                 name="search_documents",
-                func=self.vector_store.similarity_search,
-                description="Analyze insurance documents for trends, anomalies, patterns"
+                description=(
+                    "Analyze insurance documents for trends, anomalies, patterns. "
+                    "Set start_year/end_year or source_file to only search those rows"
+                )
             ),
           
             PythonREPLTool()
         ]
         return tools
 
-    def _create_agent(self) -> AgentExecutor:
+    def search_documents(self, query: str, start_year: Optional[int] = None, end_year: Optional[int] = None, source_file: Optional[str] = None) -> list:
+        """
+        Search the insurance documents, filtered in the database before ranking
+
+        Args:
+            query: what to look for
+            start_year: only rows from this year on
+            end_year: only rows up to this year
+            source_file: only rows from this csv file
+
+        Returns:
+            List of (document, score) tuples
+        """
+        filter = {"start_year":start_year,"end_year":end_year,"source_file":source_file}
+        # hybrid (BM25 + vector) retrieval finds exact years and amounts with a much smaller k
+        if (load_config_params_for_node("retrieval") or {}).get("mode","vector") == "hybrid":
+            return self.vector_store.hybrid_search(query,filter=filter)
+        return self.vector_store.similarity_search(query,filter=filter)
+
+    async def asearch_documents(self, query: str, start_year: Optional[int] = None, end_year: Optional[int] = None, source_file: Optional[str] = None) -> list:
+        """
+        Async search_documents, used when the agent is invoked with ainvoke
+        """
+        filter = {"start_year":start_year,"end_year":end_year,"source_file":source_file}
+        if (load_config_params_for_node("retrieval") or {}).get("mode","vector") == "hybrid":
+            return await self.vector_store.ahybrid_search(query,filter=filter)
+        return await self.vector_store.asimilarity_search(query,filter=filter)
+
+    def _create_agent(self) -> CompiledStateGraph:
         """
         Create the agent executor
 
         Returns:
-            Initialized AgentExecutor
+            Initialized react agent graph
         """
         # Create the agent
         # model = ChatAnthropic(model_name=self.model_name)
@@ -139,9 +173,30 @@ class InsuranceAnalysisAgent:
             Analysis results
         """
         #logger.info(f"Analyzing trends for query: {query}")
+        savepath = f'{get_project_filepath()}/data/output/analysis_node_output.json'
+        # the frontend follows the run through the event log instead of waiting for savepath
+        events = get_event_log()
+        events.start_run(query=str(query))
+        # a repeated (or reworded) question on unchanged data is answered from the cache
+        cache,cache_key,cached = get_answer_cache(),None,None
+        if cache is not None:
+            try:
+                cache_key = self.get_answer_cache_key(query)
+                cached = cache.get(*cache_key)
+            except Exception as e:
+                logger.error(f'answer cache error:{e}')
+            if cached is not None:
+                logger.info(f'answer cache hit ({cached["similarity"]:.3f}) for: {cached["query"]}')
+                # JSON turned the message numbers into strings
+                messages = {int(counter):message for counter,message in cached["answer"].items()}
+                save_dict_to_json_file(dct=messages,dir_path=savepath)
+                for counter,message in messages.items():
+                    events.append("answer",text=f"{get_content_text(AIMessage(content=message))}\n\n",counter=counter)
+                events.append("run_end",cached=True)
+                return messages
         # Use the agent
         config = {"configurable": {"thread_id": self.thread_id}}
-        messages,counter = {},0
+        messages,counter,streamed = {},0,False
 
         # for query_add in self.queries:
         #     query = f'{query_add}::{query}'
@@ -151,16 +206,49 @@ class InsuranceAnalysisAgent:
         #             messages[counter] = message
         #             print(f'{type(message)=}...{message=}\n\n')
         #             counter += 1
-        for chunk in self.agent.stream({"messages":query}, config):
-            if 'agent' in chunk:
+        # 'messages' yields the LLM tokens as they are generated, 'updates' the finished steps
+        for mode,chunk in self.agent.stream({"messages":query}, config, stream_mode=["messages","updates"]):
+            if mode == "messages":
+                token,metadata = chunk
+                text = get_content_text(token)
+                if text and metadata.get("langgraph_node") == "agent":
+                    events.append("token",text=text,counter=counter)
+                    streamed = True
+            elif 'agent' in chunk:
                 message = chunk['agent']['messages'][0].content
                 messages[counter] = message
-                print(f'{type(message)=}...{message=}\n\n')
-                counter += 1
-                    
-        savepath = f'{get_project_filepath()}/data/output/analysis_node_output.json'
+                # the text already went out token by token unless the model doesn't stream
+                text = "" if streamed else get_content_text(chunk['agent']['messages'][0])
+                events.append("step",text=f"{text}\n\n",counter=counter)
+                counter,streamed = counter + 1,False
+            elif 'tools' in chunk:
+                for tool_message in chunk['tools']['messages']:
+                    text = get_content_text(tool_message)
+                    events.append("tool",text=f"[{tool_message.name}] {text[:500]}\n\n",name=tool_message.name)
+
         save_dict_to_json_file(dct=messages,dir_path=savepath)
+        events.append("run_end",cached=False)
+        if cache_key is not None and messages:
+            cache.put(*cache_key[:3],query=query,embedding=cache_key[3],answer=messages)
         return messages
+
+    def get_answer_cache_key(self, query: str) -> tuple:
+        """
+        Answer cache lookup key of a query: collection, collection version, embedding
+        model and query embedding (from the query embedding caches when possible)
+
+        Args:
+            query: Analysis query
+
+        Returns:
+            key(tuple): arguments of AnswerCache.get
+        """
+        return (
+            self.vector_store.collection_name,
+            self.vector_store.get_collection_version(),
+            get_model_name(self.vector_store.embeddings),
+            self.vector_store.embed_queries([query])[0],
+        )
         
     def run(self, state: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -0,0 +1,596 @@
+import os
+import json
+import shutil
+import threading
+import itertools
+import asyncio
+from datetime import datetime
+from typing import List, Dict, Any, Iterable, Iterator, Union
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from loguru import logger
+from dotenv import load_dotenv
+load_dotenv()
+
+# project imports
+from src.agents.vector_store import VectorStore, get_manifest_path
+from src.utils.utils import get_project_filepath, load_config_params_for_node
+from src.utils.manifest import get_ingest_manifest, hash_text
+from src.utils.document_counter import get_document_counter
+from src.utils.local_embeddings import get_embeddings
+from src.utils.query_cache import get_query_cache
+from src.utils.metadata_filters import clean_filter, get_sources, matches_filter, merge_sources
+from src.utils.quantization import QuantizedMatrix, normalize, truncate_embeddings
+
+
+class LocalRetriever(BaseRetriever):
+    """
+    Retriever over a LocalVectorStore (the PGVector backend uses PGVector.as_retriever)
+    """
+    store:Any
+    k:int = 4
+
+    def _get_relevant_documents(self, query: str, *, run_manager=None) -> List[Document]:
+        return [document for document,_ in self.store.similarity_search(query,k=self.k)]
+
+
+class LocalVectorStore(VectorStore):
+    """
+    In-process vector store with the VectorStore interface, for single-node
+    deployments and tests without Postgres.
+
+    Normalized embeddings live in one contiguous matrix memory-mapped from the
+    collection folder ('embeddings.f32' or a quantized format, see QuantizedMatrix),
+    documents in an append-only 'documents.jsonl' (the last record of an id wins,
+    deletes are tombstones). A query is one matrix-vector product plus
+    argpartition for the top k.
+    """
+    def __init__(self, path: str = None):
+        """
+        Args:
+            path: folder of the index files, defaults to the 'local' vector_store config
+        """
+        self.collection_name:str = "insurance_docs"
+        self.embeddings = get_embeddings()
+        self.configs = load_config_params_for_node("vector_store") or {}
+        local_configs = self.configs.get("local",{})
+        self.path = path or f'{get_project_filepath()}/{local_configs.get("path","data/vector_index")}'
+        self.compact_ratio:float = local_configs.get("compact_ratio",0.5)
+        self._init_lock = threading.RLock()
+        self.counter = get_document_counter(ttl=self.configs.get("count_cache_ttl",300))
+        self.query_cache = get_query_cache(self.configs)
+        self.lexical_index = None
+        self.vector_store = None
+        self.matrix:QuantizedMatrix = None
+        self.dimensions:int = None
+        self.quantization:str = None
+        self.ids:List[str] = []
+        self.rows:Dict[str,int] = {}
+        self.documents:List[Document] = []
+        self.alive:np.ndarray = np.zeros(0,dtype=bool)
+        self._id_namespace:str = None
+
+    @property
+    def collection_path(self) -> str:
+        return f'{self.path}/{self.collection_name}'
+
+    def init_store(self) -> None:
+        """
+        Load the persisted index of the collection, once (the agents call it at startup)
+        """
+        with self._init_lock:
+            if self.vector_store is not None:
+                return
+            try:
+                os.makedirs(self.collection_path,exist_ok=True)
+                documents_path = f'{self.collection_path}/documents.jsonl'
+                if os.path.exists(documents_path):
+                    with open(documents_path) as f:
+                        for line in f:
+                            record = json.loads(line)
+                            self._apply_record(record)
+                meta_path = f'{self.collection_path}/meta.json'
+                if os.path.exists(meta_path):
+                    with open(meta_path) as f:
+                        meta = json.load(f)
+                    # collections written before quantization are float32
+                    self.dimensions,self.quantization = meta["dimensions"],meta.get("quantization","float32")
+                self._open_matrix()
+                self.vector_store = self
+                logger.info(f'local store initialized: {int(self.alive.sum())} documents')
+            except (IOError,ValueError) as e:
+                logger.error(f'Error: problem loading local vector store:{e}')
+
+    def _apply_record(self, record: dict) -> None:
+        """
+        Replay one documents.jsonl record into the in-memory tables
+        """
+        row = record["row"]
+        if row >= len(self.documents):
+            grow = row + 1 - len(self.documents)
+            self.documents.extend([None] * grow)
+            self.ids.extend([None] * grow)
+            self.alive = np.concatenate([self.alive,np.zeros(grow,dtype=bool)])
+        if record.get("deleted"):
+            self.alive[row] = False
+            self.rows.pop(record["id"],None)
+            self.documents[row] = None
+            return
+        self.ids[row] = record["id"]
+        self.rows[record["id"]] = row
+        self.documents[row] = Document(id=record["id"],page_content=record["document"],metadata=record.get("metadata") or {})
+        self.alive[row] = True
+
+    def _open_matrix(self) -> None:
+        """
+        (Re)map the embeddings files after they grew
+        """
+        if self.dimensions is None:
+            self.matrix = None
+            return
+        if self.matrix is None:
+            self.matrix = QuantizedMatrix(
+                path=self.collection_path,
+                dimensions=self.dimensions,
+                quantization=self.quantization
+            )
+        self.matrix.open(len(self.documents))
+
+    def write_meta(self) -> None:
+        """
+        Persist the dimensions and storage format of the collection
+        """
+        with open(f'{self.collection_path}/meta.json.tmp','w') as f:
+            json.dump({"dimensions":self.dimensions,"quantization":self.quantization},f)
+        os.replace(f'{self.collection_path}/meta.json.tmp',f'{self.collection_path}/meta.json')
+
+    def _write(self, documents: List[Document], ids: List[str], embeddings: List[List[float]]) -> int:
+        """
+        Append new rows and overwrite existing ids in place
+
+        Returns:
+            added(int): number of new ids
+        """
+        vectors = normalize(embeddings)
+        with self._init_lock:
+            if self.dimensions is None:
+                self.dimensions = vectors.shape[1]
+                self.quantization = self.quantization or self.configs.get("quantization",{}).get("type","float32")
+                self.write_meta()
+                self._open_matrix()
+            if vectors.shape[1] != self.dimensions:
+                raise ValueError(f'embedding dimensions {vectors.shape[1]} != index dimensions {self.dimensions}')
+            records,new_vectors,new_rows,updates = [],[],{},{}
+            for document,id,vector in zip(documents,ids,vectors):
+                if id in self.rows:
+                    row = self.rows[id]
+                    updates[row] = vector
+                elif id in new_rows:
+                    row = new_rows[id]
+                    new_vectors[row - len(self.documents)] = vector
+                else:
+                    row = new_rows[id] = len(self.documents) + len(new_vectors)
+                    new_vectors.append(vector)
+                records.append({"id":id,"row":row,"document":document.page_content,"metadata":document.metadata})
+            if updates:
+                self.matrix.update(list(updates),np.stack(list(updates.values())))
+            if new_vectors:
+                self.matrix.append(np.stack(new_vectors))
+            with open(f'{self.collection_path}/documents.jsonl','a') as f:
+                for record in records:
+                    f.write(json.dumps(record) + "\n")
+            for record in records:
+                self._apply_record(record)
+            self._open_matrix()
+        self.update_lexical_index("add",zip(ids,documents))
+        return len(new_vectors)
+
+    def clear_store(self):
+        """
+        clear all documents from the local vector store
+        """
+        try:
+            with self._init_lock:
+                # the lexical index lives in the collection folder too
+                if self.lexical_index is not None:
+                    self.lexical_index.close()
+                    self.lexical_index = None
+                shutil.rmtree(self.collection_path,ignore_errors=True)
+                self.vector_store = None
+                self.matrix,self.dimensions,self.quantization = None,None,None
+                self.ids,self.rows,self.documents = [],{},[]
+                self.alive = np.zeros(0,dtype=bool)
+                self.init_store()
+            # the manifest must not claim files are stored once the vectors are gone
+            get_ingest_manifest(get_manifest_path()).clear()
+            self.counter.set(self.collection_name,0)
+            logger.info(f'Vector Store Cleared!')
+        except IOError as e:
+            logger.error(f'Clear vector store error:{e}')
+
+    def count_documents(self) -> int:
+        """
+        Number of documents in this collection
+        """
+        self.init_store()
+        return int(self.alive.sum())
+
+    def load_document_count(self) -> int:
+        return self.count_documents()
+
+    def get_existing_ids(self, ids: List[str]) -> set:
+        """
+        Subset of ids already stored in this collection
+        """
+        self.init_store()
+        return {id for id in ids if id in self.rows}
+
+    def add_documents(self, documents: List[Document], ids: List[str] = None) -> List[str]:
+        """
+        Add documents to the local vector store
+
+        Args:
+            documents: List of documents to add
+            ids: Optional ids of the documents, existing ids are overwritten
+
+        Returns:
+            ids(list): ids of the documents
+        """
+        logger.info(f"Adding {len(documents)} documents to vector store")
+        self.init_store()
+        if not documents:
+            return []
+        ids = list(ids) if ids else [self.make_document_id(hash_text(document.page_content)) for document in documents]
+        embeddings = self.embeddings.embed_documents([document.page_content for document in documents])
+        added = self._write(documents,ids,embeddings)
+        self.counter.increment(self.collection_name,added)
+        return ids
+
+    def delete_documents(self, ids: List[str]) -> None:
+        """
+        Delete documents from the local vector store by id
+
+        Args:
+            ids: ids of the documents to delete
+        """
+        if not ids:
+            return
+        self.init_store()
+        with self._init_lock:
+            records = [{"id":id,"row":self.rows[id],"deleted":True} for id in set(ids) if id in self.rows]
+            with open(f'{self.collection_path}/documents.jsonl','a') as f:
+                for record in records:
+                    f.write(json.dumps(record) + "\n")
+            for record in records:
+                self._apply_record(record)
+            if len(self.documents) and 1 - self.alive.mean() > self.compact_ratio:
+                self.compact()
+        self.counter.increment(self.collection_name,-len(records))
+        self.update_lexical_index("remove",ids)
+        logger.info(f"Deleted {len(records)} documents from vector store")
+
+    def add_sources(self, sources: Dict[str,List[str]]) -> int:
+        """
+        Merge more files into the 'sources'/'source_files' metadata of stored chunks
+        (see VectorStore.add_sources), written as metadata-only records
+
+        Args:
+            sources: paths of the files, by document id
+
+        Returns:
+            updated(int): number of documents whose metadata changed
+        """
+        self.init_store()
+        with self._init_lock:
+            records = []
+            for id,files in sources.items():
+                if id not in self.rows or not files:
+                    continue
+                document = self.documents[self.rows[id]]
+                merged = merge_sources(document.metadata,files)
+                if merged is not document.metadata:
+                    records.append({"id":id,"row":self.rows[id],"document":document.page_content,"metadata":merged})
+            if records:
+                with open(f'{self.collection_path}/documents.jsonl','a') as f:
+                    for record in records:
+                        f.write(json.dumps(record) + "\n")
+                for record in records:
+                    self._apply_record(record)
+        if records:
+            self.update_lexical_index("update_metadata",[(record["id"],record["metadata"]) for record in records])
+        return len(records)
+
+    def get_lexical_index_path(self) -> str:
+        """
+        The BM25 index is kept next to the embeddings of the collection
+        """
+        return f'{self.collection_path}/bm25.sqlite'
+
+    def iter_documents(self, batch_size: int = 1000) -> Iterator[tuple]:
+        """
+        Every document of the collection
+
+        Yields:
+            (id, document)
+        """
+        self.init_store()
+        for row in np.flatnonzero(self.alive):
+            yield self.ids[row],self.documents[row]
+
+    def compact(self) -> None:
+        """
+        Rewrite the index files without deleted rows
+        """
+        with self._init_lock:
+            rows = np.flatnonzero(self.alive)
+            if self.matrix is not None:
+                self.matrix.compact(rows)
+            records = [
+                {"id":self.ids[row],"row":i,"document":self.documents[row].page_content,"metadata":self.documents[row].metadata}
+                for i,row in enumerate(rows)
+            ]
+            with open(f'{self.collection_path}/documents.jsonl','w') as f:
+                for record in records:
+                    f.write(json.dumps(record) + "\n")
+            self.ids,self.rows,self.documents = [],{},[]
+            self.alive = np.zeros(0,dtype=bool)
+            for record in records:
+                self._apply_record(record)
+            self._open_matrix()
+            logger.info(f'compacted local vector store to {len(records)} documents')
+
+    def bulk_upsert(self, chunks: Iterable[Union[Document,dict]], batch_size: int = None) -> Dict[str,int]:
+        """
+        Bulk ingestion with one embedding call per batch, chunks already stored are skipped
+
+        Args:
+            chunks: Documents or dicts with keys 'content','metadata', can be a generator
+            batch_size: chunks per embedding call
+
+        Returns:
+            counts(dict): number of 'inserted' and 'skipped' chunks
+        """
+        self.init_store()
+        batch_size = batch_size or self.configs.get("bulk_batch_size",500)
+        counts = {"inserted":0,"skipped":0}
+        chunks = iter(chunks)
+        while batch := list(itertools.islice(chunks,batch_size)):
+            documents = self.collect_chunks(batch)
+            new_ids = [id for id in documents if id not in self.rows]
+            self.add_sources({id:get_sources(documents[id].metadata) for id in documents if id in self.rows})
+            inserted = 0
+            if new_ids:
+                embeddings = self.embeddings.embed_documents([documents[id].page_content for id in new_ids])
+                inserted = self._write([documents[id] for id in new_ids],new_ids,embeddings)
+            counts["inserted"] += inserted
+            self.counter.increment(self.collection_name,inserted)
+            counts["skipped"] += len(batch) - inserted
+            logger.info(f"bulk upsert batch: {inserted} inserted, {len(batch) - inserted} skipped")
+        return counts
+
+    def get_collection_version(self) -> str:
+        """
+        Version of the data in this collection, see get_data_version
+        """
+        return self.get_data_version()
+
+    def get_data_version(self) -> str:
+        """
+        Version of the rows of this collection: every write and delete appends to
+        documents.jsonl, so its size and modification time change
+        """
+        self.init_store()
+        path = f'{self.collection_path}/documents.jsonl'
+        stat = os.stat(path) if os.path.exists(path) else None
+        return hash_text(f'{self.collection_path}|{stat.st_size if stat else 0}|{stat.st_mtime_ns if stat else 0}')
+
+    def update_lexical_index(self, operation: str, *args, written: tuple = None) -> None:
+        """
+        Apply a write to the BM25 index, if hybrid retrieval is on. The store has one
+        writer, under its lock, so the index takes the version of the files after the write
+        """
+        lexical_index = self.get_lexical_index()
+        if lexical_index is not None:
+            getattr(lexical_index,operation)(*args)
+            lexical_index.set_version(self.get_data_version())
+
+    def get_id_namespace(self) -> str:
+        """
+        Ids are only unique within a folder, a shadow keeps the ids of the live collection
+        """
+        return self._id_namespace or self.collection_name
+
+    def create_shadow(self) -> "LocalVectorStore":
+        """
+        Empty collection folder next to this one that a reindex is built into
+
+        Returns:
+            shadow(LocalVectorStore): store of the new folder, sharing the embeddings
+        """
+        shadow = LocalVectorStore(path=self.path)
+        shadow.collection_name = f'{self.collection_name}__shadow_{datetime.now().strftime("%Y%m%d%H%M%S%f")}'
+        shadow._id_namespace = self.collection_name
+        shadow.embeddings = self.embeddings
+        shadow.init_store()
+        return shadow
+
+    def drop_collection(self) -> None:
+        """
+        Delete the folder of this collection
+        """
+        with self._init_lock:
+            if self.lexical_index is not None:
+                self.lexical_index.close()
+                self.lexical_index = None
+            self.matrix = None
+            shutil.rmtree(self.collection_path,ignore_errors=True)
+        self.counter.invalidate(self.collection_name)
+        logger.info(f'dropped collection {self.collection_name}')
+
+    def swap_in(self, shadow: "LocalVectorStore") -> None:
+        """
+        Make a shadow folder the live collection: the folders are renamed and the
+        shadow's in-memory tables taken over under the store lock, so searches see
+        either the old or the new documents. The old folder is deleted afterwards
+
+        Args:
+            shadow: store returned by create_shadow
+        """
+        retired_path = f'{self.collection_path}__retired_{datetime.now().strftime("%Y%m%d%H%M%S%f")}'
+        with self._init_lock, shadow._init_lock:
+            for store in (self,shadow):
+                if store.lexical_index is not None:
+                    store.lexical_index.close()
+                    store.lexical_index = None
+            if os.path.exists(self.collection_path):
+                os.replace(self.collection_path,retired_path)
+            os.replace(shadow.collection_path,self.collection_path)
+            # the memory maps follow the renamed files, new rows go to the new path
+            self.matrix,self.dimensions,self.quantization = shadow.matrix,shadow.dimensions,shadow.quantization
+            if self.matrix is not None:
+                self.matrix.path = self.collection_path
+            self.ids,self.rows,self.documents,self.alive = shadow.ids,shadow.rows,shadow.documents,shadow.alive
+            self.vector_store = self
+        logger.info(f'swapped {shadow.collection_name} in as {self.collection_name}')
+        shutil.rmtree(retired_path,ignore_errors=True)
+
+    def iter_embeddings(self, batch_size: int = 1000) -> Iterator[tuple]:
+        """
+        Every stored embedding of the collection, decoded to float32
+
+        Yields:
+            (id, embedding as a float32 array)
+        """
+        self.init_store()
+        rows = np.flatnonzero(self.alive)
+        for start in range(0,len(rows),batch_size):
+            batch = rows[start:start+batch_size]
+            for row,embedding in zip(batch,self.matrix.to_float32(batch)):
+                yield self.ids[row],embedding
+
+    def migrate_embeddings(self, dimensions: int = None, quantization: str = None, batch_size: int = 1000) -> Dict[str,Any]:
+        """
+        Rewrite the embeddings in a new storage format without re-embedding: shortened
+        to their first dimensions (Matryoshka, renormalized) and/or encoded with
+        another quantization. The new files are written next to the old ones and
+        moved in place before the old ones are deleted, so an interrupted migration
+        never leaves the collection without its embeddings files. Queries must be
+        embedded with the same dimensions afterwards
+
+        Args:
+            dimensions: dimensions to keep, None to keep the current ones
+            quantization: one of QUANTIZATIONS, None to keep the current one
+            batch_size: unused, the matrix is rewritten in one pass
+
+        Returns:
+            stats(dict): number of 'updated' vectors, new 'dimensions' and 'quantization'
+        """
+        self.init_store()
+        with self._init_lock:
+            if self.matrix is None:
+                # the first write creates the files in this format
+                self.quantization = quantization or self.quantization
+                return {"updated":0,"dimensions":None,"quantization":self.quantization or self.configs.get("quantization",{}).get("type","float32")}
+            vectors = truncate_embeddings(self.matrix.to_float32(),dimensions)
+            old_paths = self.matrix.file_paths
+            target = QuantizedMatrix(
+                path=f'{self.collection_path}/migrate',
+                dimensions=vectors.shape[1],
+                quantization=quantization or self.quantization
+            )
+            os.makedirs(target.path,exist_ok=True)
+            target.append(vectors)
+            self.matrix = None
+            new_paths = []
+            for path in target.file_paths:
+                new_paths.append(f'{self.collection_path}/{os.path.basename(path)}')
+                os.replace(path,new_paths[-1])
+            os.rmdir(target.path)
+            self.dimensions,self.quantization = target.dimensions,target.quantization
+            self.write_meta()
+            for path in old_paths:
+                if path not in new_paths:
+                    os.remove(path)
+            self._open_matrix()
+        self.query_cache.clear()
+        logger.info(f'migrated {len(vectors)} embeddings to {self.dimensions} dimensions, {self.quantization}')
+        return {"updated":len(vectors),"dimensions":self.dimensions,"quantization":self.quantization}
+
+    def ensure_index(self) -> None:
+        """
+        Exact search over the in-memory matrix, there is no ANN index to maintain
+        """
+        return None
+
+    def similarity_search_by_vectors(self, embeddings: List[List[float]], k: int = 500, filter: dict = None, **kwargs) -> List[List[tuple]]:
+        """
+        Cosine top-k of several query embeddings: one scan of the (quantized) matrix
+        and an argpartition per query, exact for float32
+
+        Args:
+            embeddings: query embeddings
+            k: Number of results per query
+            filter: metadata filter applied before the ranking (see metadata_filters)
+            kwargs: ANN search parameters of the PGVector backend, ignored
+
+        Returns:
+            results(list): for each embedding, a list of (document, distance) tuples, distance is the cosine distance
+        """
+        self.init_store()
+        queries = normalize(embeddings)
+        with self._init_lock:
+            if self.matrix is None or not self.alive.any():
+                return [[] for _ in embeddings]
+            candidates = self.alive.copy()
+            if clean_filter(filter):
+                for row in np.flatnonzero(candidates):
+                    candidates[row] = matches_filter(self.documents[row].metadata,filter)
+            if not candidates.any():
+                return [[] for _ in embeddings]
+            return [
+                [(self.documents[row],float(1 - similarity)) for row,similarity in zip(rows,similarities)]
+                for rows,similarities in self.matrix.search(queries,k=k,candidates=candidates)
+            ]
+
+    async def ainit_store(self) -> None:
+        """
+        Async API: the local store has no async driver, the blocking work (file and
+        matrix I/O, numpy scans) runs in a worker thread so the event loop stays free
+        """
+        await asyncio.to_thread(self.init_store)
+
+    async def aadd_documents(self, documents: List[Document], ids: List[str] = None) -> List[str]:
+        """
+        Async add_documents, the embeddings request is awaited and the write runs in a thread
+        """
+        logger.info(f"Adding {len(documents)} documents to vector store")
+        await self.ainit_store()
+        if not documents:
+            return []
+        ids = list(ids) if ids else [self.make_document_id(hash_text(document.page_content)) for document in documents]
+        embeddings = await self.embeddings.aembed_documents([document.page_content for document in documents])
+        added = await asyncio.to_thread(self._write,documents,ids,embeddings)
+        self.counter.increment(self.collection_name,added)
+        return ids
+
+    async def aget_document_count(self, exact: bool = False) -> int:
+        return await asyncio.to_thread(self.get_document_count,exact)
+
+    async def aclear_store(self) -> None:
+        await asyncio.to_thread(self.clear_store)
+
+    async def asimilarity_search_by_vectors(self, embeddings: List[List[float]], k: int = 500, filter: dict = None, **kwargs) -> List[List[tuple]]:
+        return await asyncio.to_thread(self.similarity_search_by_vectors,embeddings,k,filter)
+
+    def as_retriever(self, **kwargs) -> BaseRetriever:
+        """
+        Retriever over this store
+
+        Args:
+            kwargs: search_kwargs={'k':..} as for langchain vector stores
+
+        Returns:
+            retriever(LocalRetriever)
+        """
+        return LocalRetriever(store=self,**kwargs.get("search_kwargs",{}))
@@ -1,14 +1,17 @@
-from typing import Literal, Any
+from typing import Literal, Any, Optional
 from typing_extensions import TypedDict
-from langchain_anthropic import ChatAnthropic
 from langgraph.graph import MessagesState, END
 from langgraph.types import Command
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+from langchain_core.messages import HumanMessage
+from loguru import logger
+import threading
 import os
 from dotenv import load_dotenv 
 load_dotenv()
 
 from src.utils.agent_state import AgentState
+from src.utils.utils import load_config_params_for_node
 
 # Our team supervisor is an LLM node. It just picks the next agent to process
 # and decides when the work is completed
@@ -18,6 +21,15 @@ class Router(TypedDict):
     next: Literal["document_processor","vector_store", "analysis","FINISH"]
 
 
+def create_llm() -> Any:
+    """
+    Chat model of the supervisor (and of the worker agents), imported on first use
+    so importing the graph doesn't load the anthropic client
+    """
+    from langchain_anthropic import ChatAnthropic
+    return ChatAnthropic(api_key=os.getenv('ANTHROPIC_API_KEY'), model="claude-3-5-sonnet-latest")
+
+
 class Supervisor(BaseModel):
     members:list = ["document_processor","vector_store","analysis"]
     system_prompt:list = (
@@ -27,17 +39,95 @@ class Supervisor(BaseModel):
         " task and respond with their results and status. When finished,"
         " respond with FINISH."
     )
-    llm:Any = ChatAnthropic(api_key=os.getenv('ANTHROPIC_API_KEY'), model="claude-3-5-sonnet-latest")
+    llm:Any = Field(default_factory=create_llm)
+    router:Any = None
+
+# the pipeline order: the worker that just answered decides the next one
+NEXT_WORKER = {
+    "document_processor":"vector_store",
+    "vector_store":"analysis",
+    "analysis":"FINISH",
+}
+# routing decisions taken by the rules and by the LLM since startup
+_lock = threading.Lock()
+_supervisor:Supervisor = None
+routing_stats = {"rules":0,"llm":0}
+
+
+def get_supervisor() -> Supervisor:
+    """
+    Supervisor shared by every routing call, with its structured-output runnable
+    built once
+
+    Returns:
+        supervisor(Supervisor)
+    """
+    global _supervisor
+    with _lock:
+        if _supervisor is None:
+            _supervisor = Supervisor()
+            _supervisor.router = _supervisor.llm.with_structured_output(Router)
+        return _supervisor
+
+def route_from_state(state: AgentState) -> Optional[str]:
+    """
+    Next worker when it follows from the state, without asking the LLM: an answer
+    or an error means FINISH, documents go to vector_store, a worker's reply goes to the next
+    worker of the pipeline, and the user request starts with document_processor
+    when there is a dir_path or with analysis when there is only a query
+
+    Args:
+        state: Current state
+
+    Returns:
+        next(str): a member or 'FINISH', None when the LLM has to decide
+    """
+    if state.get("answer") or state.get("error"):
+        return "FINISH"
+    if state.get("documents"):
+        return "vector_store"
+    messages = state.get("messages") or []
+    if not messages:
+        return None
+    last = messages[-1]
+    if getattr(last,"name",None) in NEXT_WORKER:
+        return NEXT_WORKER[last.name]
+    if len(messages) == 1 and isinstance(last,HumanMessage):
+        if state.get("dir_path"):
+            return "document_processor"
+        if state.get("query"):
+            return "analysis"
+    return None
+
+def get_routing_stats() -> dict:
+    """
+    Routing decisions since startup, 'rules' is the number of LLM calls saved
+    """
+    with _lock:
+        return dict(routing_stats)
 
 def supervisor_node(state: AgentState) -> Command:
-    supervisor = Supervisor()
-    messages = [
-        {"role": "system", "content": supervisor.system_prompt,"documents":None},
-    ] + state["messages"]
-    response = supervisor.llm.with_structured_output(Router).invoke(messages)
-    goto = response["next"]
+    configs = load_config_params_for_node("supervisor") or {}
+    goto = route_from_state(state) if configs.get("rule_routing",True) else None
+    if state.get("error"):
+        # a worker gave up, the LLM would only route it back
+        goto = "FINISH"
+        logger.error(f'finishing on error: {state["error"]}')
+    elif goto is not None:
+        with _lock:
+            routing_stats["rules"] += 1
+        logger.info(f'rule routing to {goto}, {routing_stats["rules"]} LLM routing calls saved')
+    else:
+        supervisor = get_supervisor()
+        messages = [
+            {"role": "system", "content": supervisor.system_prompt,"documents":None},
+        ] + state["messages"]
+        response = supervisor.router.invoke(messages)
+        goto = response["next"]
+        with _lock:
+            routing_stats["llm"] += 1
+        logger.info(f'LLM routing to {goto}')
     if goto == "FINISH":
         goto = END
 
     return Command(goto=goto)
-
@@ -1,18 +1,42 @@
 import os
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Iterator, Union
+import itertools
+import asyncio
+import numpy as np
 from langchain_core.documents import Document
 from langchain_postgres.vectorstores import PGVector
 from loguru import logger
-from langchain_openai import OpenAIEmbeddings
 from langchain_community.vectorstores.pgvector import DistanceStrategy
-from datetime import time
+from datetime import time, datetime
+from time import monotonic
+from concurrent.futures import ThreadPoolExecutor
 import ast
+import uuid
+import threading
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from sqlalchemy import select, delete, text
+import json
+from sqlalchemy.dialects.postgresql import insert
 from dotenv import load_dotenv
 load_dotenv()
 
 # project imports
-from src.utils.utils import get_project_filepath
+from src.utils.utils import get_project_filepath, load_config_params_for_node
+from src.utils.manifest import get_ingest_manifest, hash_text
+from src.utils.store_registry import get_engine, get_async_engine
+from src.utils.document_counter import get_document_counter
+from src.utils.local_embeddings import get_embeddings
+from src.utils.query_cache import get_query_cache
+from src.utils.bm25 import BM25Index, reciprocal_rank_fusion
+from src.utils.artifact_store import get_artifact_store, is_artifact_handle
+from src.utils.streaming_pipeline import StreamingIngestionPipeline
+from src.utils.metadata_filters import build_sql_filter, get_sources, merge_sources
+from src.utils.quantization import truncate_embeddings
+from src.utils.vector_index import (
+    build_create_index_sql, build_maintenance_work_mem_sql, choose_index_strategy, get_index_prefix, get_ivfflat_lists, get_index_expression,
+    parse_index_definition, parse_version, EMBEDDING_TABLE, INDEX_QUANTIZATIONS, INDEX_QUANTIZATION_MIN_VERSION
+)
 
 # setup loggers
 logger.add(
@@ -22,6 +46,36 @@ logger.add(
     level="DEBUG"
     )
 
+# lookups shared by the sync and async paths
+INDEX_QUERY = "SELECT indexname, indexdef FROM pg_indexes WHERE tablename = :table AND indexname LIKE :prefix"
+COLLECTION_QUERY = "SELECT uuid, cmetadata->>'id_namespace' FROM langchain_pg_collection WHERE name = :name"
+# validity of indexes on the shared embedding table, by name
+INDEX_VALID_QUERY = "SELECT c.relname, i.indisvalid FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid WHERE c.relname = ANY(:names)"
+# write counter of a collection, kept in its metadata so it moves with it on a rename
+DATA_VERSION_QUERY = "SELECT uuid, coalesce((cmetadata->>'write_version')::bigint, 0) FROM langchain_pg_collection WHERE name = :name"
+WRITE_VERSION_QUERY = (
+    "UPDATE langchain_pg_collection SET cmetadata = jsonb_set(coalesce(nullif(cmetadata::jsonb, 'null'), '{}'), '{write_version}', "
+    "to_jsonb(coalesce((cmetadata->>'write_version')::bigint, 0) + 1))::json WHERE name = :name "
+    "RETURNING uuid, (cmetadata->>'write_version')::bigint"
+)
+
+def get_manifest_path() -> str:
+    """
+    Location of the ingestion manifest (sqlite) from the config file
+
+    Returns:
+        path(str): absolute path of the manifest
+    """
+    configs = load_config_params_for_node("manifest") or {}
+    return f'{get_project_filepath()}/{configs.get("path","data/manifest/ingest_manifest.sqlite")}'
+
+def format_data_version(collection_id: Any, write_version: int) -> str:
+    """
+    Data version of a collection (see VectorStore.get_data_version)
+    """
+    return f'{collection_id}/{write_version}'
+
+
 class VectorStore:
     def __init__(self):
         """Initialize the vector store with PGVector connection"""
@@ -31,7 +85,21 @@ class VectorStore:
 
         self.collection_name:str = "insurance_docs"
         self.vector_store:PGVector = None
-        self.embeddings = OpenAIEmbeddings()
+        self.embeddings = get_embeddings()
+        self.configs = load_config_params_for_node("vector_store") or {}
+        self._init_lock = threading.Lock()
+        self.counter = get_document_counter(ttl=self.configs.get("count_cache_ttl",300))
+        self.query_cache = get_query_cache(self.configs)
+        self.lexical_index:BM25Index = None
+        self.collection_metadata:dict = None
+        self._pgvector_version:tuple = None
+        # collection id, id namespace and index description looked up by every search
+        # and write, cached for 'metadata_cache_ttl' seconds (a reindex in another
+        # process changes them)
+        self._metadata:Dict[str,tuple] = {}
+        # async API: a second PGVector in async mode on the shared async engine
+        self.async_vector_store:PGVector = None
+        self._async_engine:AsyncEngine = None
 
        
     def init_store(self) -> None:
@@ -43,73 +111,1486 @@ class VectorStore:
             metadatas: List of metadatas associated with the texts.
         """
         try:
-            if self.vector_store is None:
-                # Initialize PGVector store
-                self.vector_store = PGVector(
-                    embeddings=self.embeddings,
-                    collection_name=self.collection_name,
-                    connection=self.connection_string,
-                    use_jsonb=True,
-                )
-            
-                logger.info(f'store initialized')
+            with self._init_lock:
+                if self.vector_store is None:
+                    # Initialize PGVector store on the shared, pooled engine
+                    self.vector_store = PGVector(
+                        embeddings=self.embeddings,
+                        collection_name=self.collection_name,
+                        connection=get_engine(self.connection_string),
+                        collection_metadata=self.collection_metadata,
+                        use_jsonb=True,
+                    )
+                    self.create_metadata_indexes()
+                    logger.info(f'store initialized')
         except IOError as e:
             logger.error(f'Error: problem writing embeddings to postgres vector store:{e}')
     
+    def create_metadata_indexes(self) -> None:
+        """
+        Expression indexes on the typed year metadata used by the search filters
+        (the other filters use the GIN index langchain_postgres creates on cmetadata).
+        The table is shared by every collection, so a missing index is built once,
+        CONCURRENTLY outside a transaction, and doesn't block writers; an existing
+        index is only looked up in the catalog, an invalid one (interrupted build) is rebuilt
+        """
+        names = {f'ix_cmetadata_{key}':key for key in ("year_min","year_max")}
+        try:
+            engine = self.vector_store.session_maker.bind
+            with engine.connect() as connection:
+                valid = dict(connection.execute(text(INDEX_VALID_QUERY),{"names":list(names)}).all())
+            missing = [name for name in names if not valid.get(name)]
+            if not missing:
+                return
+            with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+                for name in missing:
+                    if name in valid:
+                        connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+                    connection.execute(text(
+                        f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {EMBEDDING_TABLE} (((cmetadata->>'{names[name]}')::int))"
+                    ))
+                    logger.info(f'created metadata index {name}')
+        except Exception as e:
+            logger.error(f'metadata index error:{e}')
+
     def clear_store(self):
         """
         clear all documents from existing vector store
         """
         try:
             self.init_store()
+            # the index is partial on the collection uuid, which changes on recreate
+            self.drop_index()
             self.vector_store.delete_collection()
+            # recreate the (empty) collection so the shared store can keep adding documents
+            self.vector_store.create_collection()
+            self.invalidate_metadata()
+            # the manifest must not claim files are stored once the vectors are gone
+            get_ingest_manifest(get_manifest_path()).clear()
+            self.counter.set(self.collection_name,0)
+            self.update_lexical_index("clear",written=(self.get_collection_id(),0))
             logger.info(f'Vector Store Cleared!')
         except IOError as e:
             logger.error(f'Clear vector store error:{e}')
 
-    def get_document_count(self) -> int:
+    def get_document_count(self, exact: bool = False) -> int:
         """
-        Count documents in vector store
+        Count documents in vector store. The count is cached per collection and kept
+        current by add/delete/clear, so repeated calls (e.g. the frontend timer) don't
+        touch the database
+
+        Args:
+            exact: bypass the cache and run COUNT(*)
 
         Returns:
             count: # number of document in vector store
         """
+        if exact:
+            count = self.count_documents()
+            self.counter.set(self.collection_name,count)
+            return count
+        return self.counter.get(self.collection_name,loader=self.load_document_count)
+
+    def count_documents(self) -> int:
+        """
+        Exact number of documents in this collection (COUNT(*))
+
+        Returns:
+            count(int)
+        """
         self.init_store()
+        EmbeddingStore = self.vector_store.EmbeddingStore
         with Session(self.vector_store.session_maker.bind) as session:
-            count = session.query(self.vector_store.EmbeddingStore).count()
+            collection = self.vector_store.get_collection(session)
+            if collection is None:
+                return 0
+            count = session.query(EmbeddingStore).filter(EmbeddingStore.collection_id == collection.uuid).count()
         return count
+
+    def estimate_document_count(self) -> int:
+        """
+        Planner estimate of the number of documents in this collection, from the table
+        statistics (EXPLAIN), without scanning the table
+
+        Returns:
+            count(int)
+        """
+        self.init_store()
+        with Session(self.vector_store.session_maker.bind) as session:
+            collection = self.vector_store.get_collection(session)
+            if collection is None:
+                return 0
+            plan = session.execute(
+                text("EXPLAIN (FORMAT JSON) SELECT 1 FROM langchain_pg_embedding WHERE collection_id = :collection_id"),
+                {"collection_id":collection.uuid}
+            ).scalar()
+        if isinstance(plan,str):
+            plan = json.loads(plan)
+        return int(plan[0]["Plan"]["Plan Rows"])
+
+    def load_document_count(self) -> int:
+        """
+        Count used to fill the cache: the planner estimate for very large collections,
+        COUNT(*) otherwise
+
+        Returns:
+            count(int)
+        """
+        threshold = self.configs.get("count_estimate_threshold",100000)
+        if threshold:
+            estimate = self.estimate_document_count()
+            if estimate >= threshold:
+                return estimate
+        return self.count_documents()
+
+    def get_existing_ids(self, ids: List[str]) -> set:
+        """
+        Subset of ids already stored in this collection
+
+        Args:
+            ids: document ids
+
+        Returns:
+            existing(set)
+        """
+        self.init_store()
+        EmbeddingStore = self.vector_store.EmbeddingStore
+        with Session(self.vector_store.session_maker.bind) as session:
+            collection = self.vector_store.get_collection(session)
+            if collection is None:
+                return set()
+            return set(session.scalars(
+                select(EmbeddingStore.id).where(
+                    EmbeddingStore.collection_id == collection.uuid,
+                    EmbeddingStore.id.in_(list(ids))
+                )
+            ))
         
-    def add_documents(self, documents: List[Document]) -> None:
+    def add_documents(self, documents: List[Document], ids: List[str] = None) -> None:
         """
-        Add documents to existing vector store
+        Add documents to existing vector store. They are embedded first, then written
+        in one transaction with the write counter of the collection (see begin_write)
 
         Args:
             documents: List of documents to add
+            ids: Optional ids of the documents, existing ids are overwritten
         """
         logger.info(f"Adding {len(documents)} documents to vector store")
         # Adding embeddings with metadata
         self.init_store()
-        # add documents
-        documents_added = self.vector_store.add_documents(documents)
-        return documents_added
+        if not documents:
+            return []
+        ids = [id or document.id or str(uuid.uuid4()) for id,document in zip(ids or [None] * len(documents),documents)]
+        # add documents, existing ids are overwritten and don't change the count
+        existing = self.get_existing_ids(ids)
+        embeddings = self.embeddings.embed_documents([document.page_content for document in documents])
+        with Session(self.vector_store.session_maker.bind) as session, session.begin():
+            written = self.begin_write(session)
+            session.execute(self.build_upsert(self.vector_store,written[0],documents,ids,embeddings))
+        self.counter.increment(self.collection_name,len(set(ids) - existing))
+        self.update_lexical_index("add",zip(ids,documents),written=written)
+        return ids
+
+    def begin_write(self, session: Session) -> tuple:
+        """
+        First statement of a write transaction: bumps the write counter of this
+        collection (see get_data_version), which also locks the collection row until
+        the commit, and resolves the collection by name
+
+        Args:
+            session: session of the write transaction
+
+        Returns:
+            (collection_id, write_version)
+        """
+        row = session.execute(text(WRITE_VERSION_QUERY),{"name":self.collection_name}).first()
+        if row is None:
+            raise ValueError(f"collection {self.collection_name} doesn't exist")
+        return str(row[0]),row[1]
+
+    def build_upsert(self, store: PGVector, collection_id: str, documents: List[Document], ids: List[str], embeddings: List[List[float]]) -> Any:
+        """
+        INSERT of documents that overwrites existing ids, shared by the sync and async paths
+        """
+        EmbeddingStore = store.EmbeddingStore
+        statement = insert(EmbeddingStore).values([
+            {
+                "id":id,
+                "collection_id":collection_id,
+                "embedding":embedding,
+                "document":document.page_content,
+                "cmetadata":document.metadata or {},
+            }
+            for document,id,embedding in zip(documents,ids,embeddings)
+        ])
+        return statement.on_conflict_do_update(
+            index_elements=["id"],
+            set_={
+                "embedding":statement.excluded.embedding,
+                "document":statement.excluded.document,
+                "cmetadata":statement.excluded.cmetadata,
+            }
+        )
+
+    def delete_documents(self, ids: List[str]) -> None:
+        """
+        Delete documents from the vector store by id
+
+        Args:
+            ids: ids of the documents to delete
+        """
+        if ids:
+            self.init_store()
+            EmbeddingStore = self.vector_store.EmbeddingStore
+            with Session(self.vector_store.session_maker.bind) as session, session.begin():
+                try:
+                    written = self.begin_write(session)
+                except ValueError:
+                    logger.warning(f"collection {self.collection_name} doesn't exist, nothing to delete")
+                    return
+                result = session.execute(
+                    delete(EmbeddingStore).where(
+                        EmbeddingStore.collection_id == written[0],
+                        EmbeddingStore.id.in_(list(ids))
+                    )
+                )
+            self.counter.increment(self.collection_name,-result.rowcount)
+            self.update_lexical_index("remove",ids,written=written)
+            logger.info(f"Deleted {result.rowcount} documents from vector store")
+
+    def add_sources(self, sources: Dict[str,List[str]]) -> int:
+        """
+        Record that stored chunks were also found in other files. A chunk is stored once
+        (its id comes from its content) and skipped when another file produces it again,
+        so its 'sources'/'source_files' metadata is merged here instead, and the
+        source_file filter finds it from every file
+
+        Args:
+            sources: paths of the files, by document id
+
+        Returns:
+            updated(int): number of documents whose metadata changed
+        """
+        sources = {id:files for id,files in sources.items() if files}
+        if not sources:
+            return 0
+        self.init_store()
+        EmbeddingStore = self.vector_store.EmbeddingStore
+        updates = {}
+        with Session(self.vector_store.session_maker.bind) as session, session.begin():
+            written = self.begin_write(session)
+            # rows are locked until the update, concurrent merges don't lose files
+            rows = session.execute(
+                select(EmbeddingStore.id,EmbeddingStore.cmetadata)
+                .where(EmbeddingStore.collection_id == written[0],EmbeddingStore.id.in_(list(sources)))
+                .with_for_update()
+            ).all()
+            for id,metadata in rows:
+                merged = merge_sources(metadata or {},sources[id])
+                if merged is not metadata:
+                    updates[id] = merged
+            if updates:
+                session.execute(
+                    text(
+                        f"UPDATE {EMBEDDING_TABLE} AS t SET cmetadata = v.cmetadata "
+                        f"FROM jsonb_to_recordset(CAST(:rows AS jsonb)) AS v(id text, cmetadata jsonb) "
+                        f"WHERE t.id = v.id"
+                    ),
+                    {"rows":json.dumps([{"id":id,"cmetadata":metadata} for id,metadata in updates.items()])}
+                )
+        if updates:
+            self.update_lexical_index("update_metadata",updates.items(),written=written)
+        logger.info(f'merged sources of {len(updates)} documents')
+        return len(updates)
+
+    def make_document_id(self, content_hash: str) -> str:
+        """
+        Deterministic id of a chunk in this collection, so re-ingesting the same
+        content overwrites instead of duplicating it
+
+        Args:
+            content_hash: sha256 of the chunk content
+
+        Returns:
+            id(str): uuid5 string
+        """
+        return str(uuid.uuid5(uuid.NAMESPACE_URL,f'{self.get_id_namespace()}/{content_hash}'))
+
+    def get_collection_version(self) -> str:
+        """
+        Version of the data in this collection, to invalidate what was derived from it
+        (e.g. the answer cache). It changes with the rows (see get_data_version) and
+        when the ingestion manifest changes
+
+        Returns:
+            version(str): sha256
+        """
+        return hash_text(f'{self.get_data_version()}|{get_ingest_manifest(get_manifest_path()).get_fingerprint()}')
+
+    def get_data_version(self) -> str:
+        """
+        Version of the rows of this collection: its uuid, new when the collection is
+        recreated or swapped in, and its write counter, bumped in the transaction of
+        every write whichever process made it (see begin_write). One lookup of the
+        collection row by name, not a scan of its rows
+
+        Returns:
+            version(str): 'uuid/write counter'
+        """
+        self.init_store()
+        with Session(self.vector_store.session_maker.bind) as session:
+            row = session.execute(text(DATA_VERSION_QUERY),{"name":self.collection_name}).first()
+        return format_data_version(*row) if row is not None else format_data_version(None,0)
+
+    def get_id_namespace(self) -> str:
+        """
+        Namespace of the document ids of this collection. Ids are unique across
+        collections, so a collection built by reindex gets its own namespace, stored
+        in the collection metadata so it moves with the collection when it is renamed.
+        Cached with the collection id (see lookup_collection), so both change together
+        when another process swaps a collection in
+
+        Returns:
+            namespace(str): 'id_namespace' of the collection metadata, the collection name otherwise
+        """
+        return self.lookup_collection()[1] or self.collection_name
             
-    def similarity_search(self, query: str, k: int = 500) -> List[Document]:
+    def bulk_upsert(self, chunks: Iterable[Union[Document,dict]], batch_size: int = None) -> Dict[str,int]:
+        """
+        Bulk ingestion: chunks are embedded with one API call per batch and written
+        with one multi-row INSERT per batch in a single transaction. Ids are derived
+        from the content, so chunks already in the collection are skipped (not
+        re-embedded) and repeated runs are idempotent
+
+        Args:
+            chunks: Documents or dicts with keys 'content','metadata', can be a generator
+            batch_size: chunks per embedding call and transaction
+
+        Returns:
+            counts(dict): number of 'inserted' and 'skipped' chunks
+        """
+        self.init_store()
+        batch_size = batch_size or self.configs.get("bulk_batch_size",500)
+        counts = {"inserted":0,"skipped":0}
+        EmbeddingStore = self.vector_store.EmbeddingStore
+        if self.get_collection_id() is None:
+            raise ValueError(f"collection {self.collection_name} doesn't exist")
+        chunks = iter(chunks)
+        while batch := list(itertools.islice(chunks,batch_size)):
+            documents = self.collect_chunks(batch)
+            existing = self.get_existing_ids(list(documents))
+            # chunks stored from other files only gain this file in their metadata
+            self.add_sources({id:get_sources(documents[id].metadata) for id in existing})
+            new_ids = [id for id in documents if id not in existing]
+            inserted = 0
+            if new_ids:
+                # embed outside of the transaction so no connection is held during the API call
+                embeddings = self.embeddings.embed_documents([documents[id].page_content for id in new_ids])
+                with Session(self.vector_store.session_maker.bind) as session, session.begin():
+                    written = self.begin_write(session)
+                    rows = [
+                        {
+                            "id":id,
+                            "collection_id":written[0],
+                            "embedding":embedding,
+                            "document":documents[id].page_content,
+                            "cmetadata":documents[id].metadata,
+                        }
+                        for id,embedding in zip(new_ids,embeddings)
+                    ]
+                    result = session.execute(
+                        insert(EmbeddingStore).values(rows)
+                        .on_conflict_do_nothing(index_elements=["id"])
+                        .returning(EmbeddingStore.id)
+                    )
+                    inserted = len(result.all())
+                self.update_lexical_index("add",[(id,documents[id]) for id in new_ids],written=written)
+            counts["inserted"] += inserted
+            self.counter.increment(self.collection_name,inserted)
+            counts["skipped"] += len(batch) - inserted
+            logger.info(f"bulk upsert batch: {inserted} inserted, {len(batch) - inserted} skipped")
+        return counts
+
+    def collect_chunks(self, batch: List[Union[Document,dict]]) -> Dict[str,Document]:
+        """
+        Documents of a bulk_upsert batch by id, a chunk repeated in the batch is kept
+        once with the files of every occurrence
+        """
+        documents = {}
+        for chunk in batch:
+            if isinstance(chunk,dict):
+                chunk = Document(page_content=chunk['content'],metadata=chunk.get('metadata') or {})
+            id = self.make_document_id(hash_text(chunk.page_content))
+            if id in documents:
+                merged = merge_sources(documents[id].metadata,get_sources(chunk.metadata))
+                documents[id] = Document(page_content=documents[id].page_content,metadata=merged)
+            else:
+                documents[id] = chunk
+        return documents
+
+    def get_cached_metadata(self, key: str) -> tuple:
+        """
+        Cached collection id and id namespace ('collection') or index description ('index')
+
+        Returns:
+            (found, value): found is False when missing or older than the ttl
+        """
+        cached = self._metadata.get(key)
+        if cached is not None and monotonic() - cached[1] < self.configs.get("metadata_cache_ttl",60):
+            return True,cached[0]
+        return False,None
+
+    def set_cached_metadata(self, key: str, value: Any) -> None:
+        self._metadata[key] = (value,monotonic())
+
+    def invalidate_metadata(self) -> None:
+        """
+        Forget the cached collection id, id namespace and index, after the collection or its index changed
+        """
+        self._metadata = {}
+
+    def lookup_collection(self) -> tuple:
+        """
+        uuid and id namespace of this collection, looked up together by name and cached together
+
+        Returns:
+            (collection_id, id_namespace): (None, None) if the collection doesn't exist
+        """
+        self.init_store()
+        found,collection = self.get_cached_metadata("collection")
+        if found:
+            return collection
+        with Session(self.vector_store.session_maker.bind) as session:
+            row = session.execute(text(COLLECTION_QUERY),{"name":self.collection_name}).first()
+        return self.cache_collection(row)
+
+    def cache_collection(self, row: tuple) -> tuple:
+        """
+        Cache the COLLECTION_QUERY row of this collection, if it exists
+        """
+        if row is None:
+            return None,None
+        collection = (str(row[0]),row[1])
+        self.set_cached_metadata("collection",collection)
+        return collection
+
+    def get_collection_id(self) -> str:
+        """
+        uuid of this collection, None if it doesn't exist
+        """
+        return self.lookup_collection()[0]
+
+    def get_embedding_dimensions(self) -> int:
+        """
+        Dimensions of the stored embeddings (the 'vector' column is untyped), None if empty
+        """
+        collection_id = self.get_collection_id()
+        if collection_id is None:
+            return None
+        with Session(self.vector_store.session_maker.bind) as session:
+            return session.execute(
+                text(f"SELECT vector_dims(embedding) FROM {EMBEDDING_TABLE} WHERE collection_id = :collection_id LIMIT 1"),
+                {"collection_id":collection_id}
+            ).scalar()
+
+    def get_index(self) -> Dict[str,Any]:
+        """
+        ANN index of this collection
+
+        Returns:
+            index(dict): 'name','strategy','dimensions','quantization','collection_id' and 'definition', None if there is no index
+        """
+        self.init_store()
+        found,index = self.get_cached_metadata("index")
+        if found:
+            return index
+        collection_id = self.get_collection_id()
+        if collection_id is None:
+            return None
+        with Session(self.vector_store.session_maker.bind) as session:
+            row = session.execute(text(INDEX_QUERY),{"table":EMBEDDING_TABLE,"prefix":f'{get_index_prefix(collection_id)}%'}).first()
+        index = self.describe_index(row,collection_id)
+        self.set_cached_metadata("index",index)
+        return index
+
+    def describe_index(self, row: tuple, collection_id: str) -> Dict[str,Any]:
+        """
+        Index description from its pg_indexes row (see get_index), None if there is no row
+        """
+        if row is None:
+            return None
+        name,definition = row
+        dimensions,quantization = parse_index_definition(definition)
+        return {
+            "name":name,
+            "strategy":name.rsplit("_",1)[1],
+            "dimensions":dimensions,
+            "quantization":quantization,
+            "collection_id":collection_id,
+            "definition":definition
+        }
+
+    def get_pgvector_version(self) -> tuple:
+        """
+        Installed version of the pgvector extension, e.g. (0, 7, 4)
+        """
+        if self._pgvector_version is None:
+            self.init_store()
+            with Session(self.vector_store.session_maker.bind) as session:
+                version = session.execute(text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")).scalar()
+            self._pgvector_version = parse_version(version)
+        return self._pgvector_version
+
+    def get_index_quantization(self) -> str:
+        """
+        Quantization of the ANN index from the 'quantization' config: 'float16'
+        (halfvec) and 'binary' (bit, reranked with the full vectors) need pgvector
+        0.7, 'int8' has no pgvector type and only applies to the local backend.
+        Unsupported values fall back to float32. Only the index is quantized, the
+        rows keep their float32 vectors, so the table doesn't get smaller
+
+        Returns:
+            quantization(str): key of INDEX_QUANTIZATIONS
+        """
+        quantization = self.configs.get("quantization",{}).get("type","float32")
+        if quantization not in INDEX_QUANTIZATIONS:
+            logger.warning(f'{quantization} quantization is not available with pgvector, indexing float32')
+            return "float32"
+        if self.get_pgvector_version() < INDEX_QUANTIZATION_MIN_VERSION[quantization]:
+            logger.warning(f'{quantization} quantization needs pgvector >= {INDEX_QUANTIZATION_MIN_VERSION[quantization]}, indexing float32')
+            return "float32"
+        return quantization
+
+    def create_index(self, strategy: str = None, **params) -> Dict[str,Any]:
+        """
+        Create the ANN index of this collection: a partial expression index on
+        embedding::vector(dims), since the collections share one table
+
+        Args:
+            strategy: 'hnsw' or 'ivfflat', chosen from the collection size if None
+            params: m, ef_construction (hnsw) or lists (ivfflat), default to the 'index' config
+
+        Returns:
+            index(dict): see get_index, None if the collection is too small for an index
+        """
+        configs = {**self.configs.get("index",{}),**params}
+        # validated before the (long) build starts
+        work_mem_sql = build_maintenance_work_mem_sql(configs["maintenance_work_mem"]) if configs.get("maintenance_work_mem") else None
+        count = self.get_document_count(exact=True)
+        strategy = strategy or choose_index_strategy(count,configs)
+        dimensions = self.get_embedding_dimensions()
+        if strategy is None or dimensions is None:
+            logger.info(f'no vector index needed for {count} documents')
+            return None
+        sql = build_create_index_sql(
+            collection_id=self.get_collection_id(),
+            dimensions=dimensions,
+            strategy=strategy,
+            m=configs.get("m",16),
+            ef_construction=configs.get("ef_construction",64),
+            lists=configs.get("lists") or get_ivfflat_lists(count),
+            quantization=self.get_index_quantization(),
+        )
+        start = datetime.now()
+        with Session(self.vector_store.session_maker.bind) as session, session.begin():
+            if work_mem_sql:
+                session.execute(text(work_mem_sql))
+            session.execute(text(sql))
+        logger.info(f'created {strategy} index on {count} documents in {(datetime.now() - start).total_seconds()}s')
+        self.invalidate_metadata()
+        return self.get_index()
+
+    def drop_index(self) -> None:
+        """
+        Drop the ANN index of this collection, if any
+        """
+        index = self.get_index()
+        if index is not None:
+            with Session(self.vector_store.session_maker.bind) as session, session.begin():
+                session.execute(text(f'DROP INDEX IF EXISTS {index["name"]}'))
+            self.invalidate_metadata()
+            logger.info(f'dropped index {index["name"]}')
+
+    def rebuild_index(self, strategy: str = None, **params) -> Dict[str,Any]:
+        """
+        Drop and recreate the ANN index, e.g. after a large load (ivfflat lists are
+        trained on the data present at build time) or to change its parameters
+
+        Args:
+            strategy: see create_index
+            params: see create_index
+
+        Returns:
+            index(dict): see get_index
+        """
+        self.drop_index()
+        return self.create_index(strategy=strategy,**params)
+
+    def ensure_index(self) -> Dict[str,Any]:
+        """
+        Create the index once the collection is large enough for the configured
+        strategy, and rebuild it when the strategy chosen for the current size, the
+        embedding dimensions or the quantization changed. Called after ingestion
+
+        Returns:
+            index(dict): see get_index
+        """
+        try:
+            index = self.get_index()
+            strategy = choose_index_strategy(self.get_document_count(exact=True),self.configs.get("index",{}))
+            changed = index is not None and (
+                index["strategy"] != strategy
+                or index["dimensions"] != self.get_embedding_dimensions()
+                or index["quantization"] != self.get_index_quantization()
+            )
+            if changed:
+                if strategy is None:
+                    return index
+                return self.rebuild_index(strategy=strategy)
+            if index is None and strategy is not None:
+                return self.create_index(strategy=strategy)
+            return index
+        except Exception as e:
+            logger.error(f'vector index error:{e}')
+
+    def iter_embeddings(self, batch_size: int = 1000) -> Iterator[tuple]:
+        """
+        Every stored embedding of the collection, streamed from the database
+
+        Args:
+            batch_size: rows fetched per round-trip
+
+        Yields:
+            (id, embedding as a float32 array)
+        """
+        collection_id = self.get_collection_id()
+        if collection_id is None:
+            return
+        EmbeddingStore = self.vector_store.EmbeddingStore
+        with Session(self.vector_store.session_maker.bind) as session:
+            rows = session.execute(
+                select(EmbeddingStore.id,EmbeddingStore.embedding)
+                .where(EmbeddingStore.collection_id == collection_id)
+                .execution_options(yield_per=batch_size)
+            )
+            for id,embedding in rows:
+                yield id,np.asarray(embedding,dtype=np.float32)
+
+    def migrate_embeddings(self, dimensions: int = None, quantization: str = None, batch_size: int = 1000) -> Dict[str,Any]:
+        """
+        Move the collection to a new storage format without re-embedding: the rows are
+        copied into a shadow collection with their vectors shortened to the first
+        dimensions (Matryoshka, renormalized), the shadow gets its ANN index with the
+        quantization and is swapped in like a reindex (see swap_in). Searches use the
+        live collection until the swap; if anything fails, or the live collection is
+        written during the copy, it is left untouched and the shadow is dropped.
+        Queries must be embedded with the same dimensions afterwards ('dimensions' of
+        the embeddings config) and 'quantization' must be set in the config too, or
+        the next ensure_index rebuilds the index with the configured one
+
+        Args:
+            dimensions: dimensions to keep, None to keep the current ones
+            quantization: index quantization (see get_index_quantization), None to keep the configured one
+            batch_size: rows copied per transaction
+
+        Returns:
+            stats(dict): number of 'updated' vectors, new 'dimensions' and 'quantization'
+        """
+        self.init_store()
+        version = self.get_data_version()
+        collection_id = self.get_collection_id()
+        shadow = self.create_shadow()
+        if quantization:
+            shadow.configs = {**shadow.configs,"quantization":{**shadow.configs.get("quantization",{}),"type":quantization}}
+        EmbeddingStore = self.vector_store.EmbeddingStore
+        updated = 0
+        try:
+            with Session(self.vector_store.session_maker.bind) as session:
+                rows = session.execute(
+                    select(EmbeddingStore.document,EmbeddingStore.cmetadata,EmbeddingStore.embedding)
+                    .where(EmbeddingStore.collection_id == collection_id)
+                    .execution_options(yield_per=batch_size)
+                )
+                while batch := list(itertools.islice(rows,batch_size)):
+                    embeddings = np.stack([np.asarray(embedding,dtype=np.float32) for _,_,embedding in batch])
+                    if dimensions and embeddings.shape[1] > dimensions:
+                        embeddings = truncate_embeddings(embeddings,dimensions)
+                    # ids are unique across collections, the shadow derives its own
+                    documents = {
+                        shadow.make_document_id(hash_text(document)):(Document(page_content=document,metadata=metadata or {}),embedding)
+                        for (document,metadata,_),embedding in zip(batch,embeddings)
+                    }
+                    with Session(shadow.vector_store.session_maker.bind) as write_session, write_session.begin():
+                        written = shadow.begin_write(write_session)
+                        write_session.execute(
+                            insert(EmbeddingStore).values([
+                                {
+                                    "id":id,
+                                    "collection_id":written[0],
+                                    "embedding":embedding.tolist(),
+                                    "document":document.page_content,
+                                    "cmetadata":document.metadata,
+                                }
+                                for id,(document,embedding) in documents.items()
+                            ]).on_conflict_do_nothing(index_elements=["id"])
+                        )
+                    shadow.update_lexical_index("add",[(id,document) for id,(document,_) in documents.items()],written=written)
+                    updated += len(batch)
+                    logger.info(f'migrated {updated} embeddings to {dimensions or embeddings.shape[1]} dimensions')
+            index = shadow.ensure_index()
+            stats = {
+                "updated":updated,
+                "dimensions":shadow.get_embedding_dimensions(),
+                "quantization":index["quantization"] if index else shadow.get_index_quantization()
+            }
+            if self.get_data_version() != version:
+                raise ValueError(f'{self.collection_name} was written during the migration')
+            self.swap_in(shadow)
+            shadow = None
+            self.counter.invalidate(self.collection_name)
+        except Exception as e:
+            logger.error(f'migration error, the live collection is unchanged:{e}')
+            if shadow is not None:
+                try:
+                    shadow.drop_collection()
+                except Exception as e:
+                    logger.error(f'could not drop {shadow.collection_name}:{e}')
+            raise
+        self.query_cache.clear()
+        return stats
+
+    def create_shadow(self) -> "VectorStore":
+        """
+        Empty collection next to this one that a reindex is built into, with its own
+        id namespace since ids are unique across collections
+
+        Returns:
+            shadow(VectorStore): store of the new collection, sharing the embeddings
+        """
+        shadow_name = f'{self.collection_name}__shadow_{datetime.now().strftime("%Y%m%d%H%M%S%f")}'
+        shadow = type(self)()
+        shadow.collection_name = shadow_name
+        shadow.collection_metadata = {"id_namespace":shadow_name}
+        shadow.embeddings = self.embeddings
+        shadow.init_store()
+        return shadow
+
+    def drop_collection(self) -> None:
+        """
+        Drop this collection with its ANN index and lexical index, e.g. a failed shadow
+        or the collection retired by a reindex
+        """
+        self.init_store()
+        self.drop_index()
+        self.vector_store.delete_collection()
+        self.invalidate_metadata()
+        self.counter.invalidate(self.collection_name)
+        if self.lexical_index is not None:
+            self.lexical_index.close()
+            self.lexical_index = None
+        for suffix in ("","-wal","-shm"):
+            if os.path.exists(f'{self.get_lexical_index_path()}{suffix}'):
+                os.remove(f'{self.get_lexical_index_path()}{suffix}')
+        logger.info(f'dropped collection {self.collection_name}')
+
+    def replace_lexical_index(self, shadow: "VectorStore") -> None:
+        """
+        Move the lexical index of a shadow onto the path of this collection
+        """
+        for store in (self,shadow):
+            if store.lexical_index is not None:
+                store.lexical_index.close()
+                store.lexical_index = None
+        source,target = shadow.get_lexical_index_path(),self.get_lexical_index_path()
+        for suffix in ("-wal","-shm",""):
+            if os.path.exists(f'{target}{suffix}') and (suffix or not os.path.exists(source)):
+                os.remove(f'{target}{suffix}')
+        if os.path.exists(source):
+            os.replace(source,target)
+
+    def swap_in(self, shadow: "VectorStore") -> None:
+        """
+        Make a shadow collection the live one: both collections are renamed in one
+        transaction, so readers (which look the collection up by name) see either the
+        old or the new documents, never a partial set. The old collection is dropped
+        afterwards
+
+        Args:
+            shadow: store returned by create_shadow
+        """
+        retired_name = f'{self.collection_name}__retired_{datetime.now().strftime("%Y%m%d%H%M%S%f")}'
+        with Session(self.vector_store.session_maker.bind) as session, session.begin():
+            rename = text("UPDATE langchain_pg_collection SET name = :new WHERE name = :old")
+            session.execute(rename,{"old":self.collection_name,"new":retired_name})
+            session.execute(rename,{"old":shadow.collection_name,"new":self.collection_name})
+        logger.info(f'swapped {shadow.collection_name} in as {self.collection_name}')
+        self.invalidate_metadata()
+        try:
+            self.replace_lexical_index(shadow)
+            retired = type(self)()
+            retired.collection_name = retired_name
+            retired.drop_collection()
+        except Exception as e:
+            logger.error(f'cleanup after swap error, {retired_name} may need to be dropped:{e}')
+
+    def reindex(self, chunks: Iterable[Union[Document,dict]], batch_size: int = None, min_ratio: float = None) -> Dict[str,Any]:
+        """
+        Blue/green re-indexing: every chunk is embedded into a shadow collection while
+        the live one keeps serving queries, the shadow is checked by count and swapped
+        in atomically, then the old collection is dropped. If anything fails the live
+        collection is untouched and the shadow is dropped
+
+        Args:
+            chunks: Documents or dicts with keys 'content','metadata', can be a generator
+            batch_size: see bulk_upsert
+            min_ratio: smallest accepted shadow size relative to the live collection,
+                defaults to the 'reindex' config (guards against swapping in a partial load)
+
+        Returns:
+            stats(dict): 'swapped', 'inserted' and the 'previous' and new 'count' of documents
+        """
+        self.init_store()
+        min_ratio = self.configs.get("reindex",{}).get("min_ratio",0.5) if min_ratio is None else min_ratio
+        previous = self.get_document_count(exact=True)
+        stats = {"swapped":False,"inserted":0,"previous":previous,"count":previous}
+        shadow = None
+        try:
+            start = datetime.now()
+            shadow = self.create_shadow()
+            stats["inserted"] = shadow.bulk_upsert(chunks=chunks,batch_size=batch_size)["inserted"]
+            count = shadow.count_documents()
+            if count == 0 or count != stats["inserted"] or count < min_ratio * previous:
+                raise ValueError(f'shadow has {count} documents, {stats["inserted"]} inserted, {previous} live (min ratio {min_ratio})')
+            shadow.ensure_index()
+            self.swap_in(shadow)
+            shadow = None
+            self.counter.set(self.collection_name,count)
+            stats.update({"swapped":True,"count":count})
+            logger.info(f'reindexed {count} documents in {(datetime.now() - start).total_seconds()}s')
+        except Exception as e:
+            logger.error(f'reindex error, the live collection is unchanged:{e}')
+            if shadow is not None:
+                try:
+                    shadow.drop_collection()
+                except Exception as e:
+                    logger.error(f'could not drop {shadow.collection_name}:{e}')
+        return stats
+
+    def embed_queries(self, queries: List[str]) -> List[List[float]]:
+        """
+        Query embeddings, from the query cache when possible, the others with one
+        embeddings request
+
+        Args:
+            queries: search queries
+
+        Returns:
+            embeddings(list): one per query
         """
-        Perform similarity search
+        model = getattr(self.embeddings,"model",type(self.embeddings).__name__)
+        embeddings = [self.query_cache.get(model,query) for query in queries]
+        missing = list(dict.fromkeys(query for query,embedding in zip(queries,embeddings) if embedding is None))
+        if missing:
+            new = dict(zip(missing,self.embeddings.embed_documents(missing)))
+            for query,embedding in new.items():
+                self.query_cache.put(model,query,embedding)
+            embeddings = [new[query] if embedding is None else embedding for query,embedding in zip(queries,embeddings)]
+        return embeddings
+
+    def similarity_search(self, query: str, k: int = 500, ef_search: int = None, probes: int = None, filter: dict = None) -> List[Document]:
+        """
+        Perform similarity search. When the collection has an ANN index the query uses
+        it, with the search width (hnsw.ef_search / ivfflat.probes) set for this query only
 
         Args:
             query: Search query
             k: Number of results to return
+            ef_search: HNSW candidate list size, defaults to the 'index' config (at least k)
+            probes: IVFFlat lists to probe, defaults to the 'index' config
+            filter: metadata filter applied before the ranking, keys 'start_year',
+                'end_year', 'source_file' or any metadata key for equality
+
+        Returns:
+            List of (document, distance) tuples
+        """
+        logger.warning(f"Performing similarity search for: {query} filter={filter}")
+        return self.similarity_search_many([query],k=k,ef_search=ef_search,probes=probes,filter=filter)[0]
+
+    def similarity_search_many(self, queries: List[str], k: int = 500, ef_search: int = None, probes: int = None, filter: dict = None) -> List[List[tuple]]:
+        """
+        Similarity search for several queries: one embeddings request for the queries
+        not in the query cache and one database round-trip for all of them
+
+        Args:
+            queries: Search queries
+            k: Number of results per query
+            ef_search: see similarity_search
+            probes: see similarity_search
+            filter: see similarity_search
 
         Returns:
-            List of similar documents
+            results(list): for each query, a list of (document, distance) tuples
         """
-        logger.warning(f"Performing similarity search for: {query}")
+        if not queries:
+            return []
         self.init_store()
-       
-        similar_docs = self.vector_store.similarity_search_with_score(query=query, k=k)
-        return similar_docs
-    
+        return self.similarity_search_by_vectors(self.embed_queries(queries),k=k,ef_search=ef_search,probes=probes,filter=filter)
+
+    def similarity_search_by_vectors(self, embeddings: List[List[float]], k: int = 500, ef_search: int = None, probes: int = None, filter: dict = None) -> List[List[tuple]]:
+        """
+        Nearest documents (cosine distance) of several query embeddings in one
+        statement: a LATERAL top-k per query, which uses the ANN index if there is one.
+        With a metadata filter the rows are selected first (year and GIN indexes) and
+        ranked exactly, an ANN index would filter after the scan and could return
+        fewer than k rows
+
+        Args:
+            embeddings: query embeddings
+            k: Number of results per query
+            ef_search: see similarity_search
+            probes: see similarity_search
+            filter: see similarity_search
+
+        Returns:
+            results(list): for each embedding, a list of (document, distance) tuples
+        """
+        index = self.get_index()
+        collection_id = index["collection_id"] if index else self.get_collection_id()
+        if collection_id is None:
+            return [[] for _ in embeddings]
+        statements = self.build_search_statements(embeddings,k,ef_search,probes,filter,index,collection_id)
+        with Session(self.vector_store.session_maker.bind) as session, session.begin():
+            for sql,params in statements[:-1]:
+                session.execute(text(sql),params)
+            rows = session.execute(text(statements[-1][0]),statements[-1][1]).all()
+        if not rows and self.collection_moved(collection_id):
+            # swapped by a reindex in another process, search the collection the name points to now
+            return self.similarity_search_by_vectors(embeddings,k=k,ef_search=ef_search,probes=probes,filter=filter)
+        return self.collect_search_results(rows,len(embeddings))
+
+    def collection_moved(self, collection_id: str) -> bool:
+        """
+        Whether the name of this collection points to another collection than the
+        cached id, e.g. after a reindex in another process retired it. Checked when a
+        search found nothing, the cached metadata is refreshed
+
+        Args:
+            collection_id: uuid the search used
+
+        Returns:
+            moved(bool)
+        """
+        self.invalidate_metadata()
+        return self.get_collection_id() != collection_id
+
+    def build_search_statements(self, embeddings: List[List[float]], k: int, ef_search: int, probes: int, filter: dict, index: Dict[str,Any], collection_id: str) -> List[tuple]:
+        """
+        Statements of a similarity search, shared by the sync and async paths: the
+        per-transaction search width settings, then the LATERAL top-k query
+
+        Args:
+            embeddings: query embeddings
+            k: Number of results per query
+            ef_search: see similarity_search
+            probes: see similarity_search
+            filter: see similarity_search
+            index: ANN index of the collection (see get_index), None for an exact scan
+            collection_id: uuid of the collection
+
+        Returns:
+            statements(list): (sql, params), to run in order in one transaction
+        """
+        condition,filter_params = build_sql_filter(filter)
+        if filter_params:
+            index = None
+        # the index is on an expression of the embedding, the query must use the same one
+        quantization = index["quantization"] if index else "float32"
+        column = get_index_expression(index["dimensions"],quantization) if index else 'embedding'
+        vector_type = f'vector({index["dimensions"]})' if index else 'vector'
+        query = f'CAST(q.embedding AS {vector_type})'
+        # binary: shortlist by hamming distance on the bit index, rerank with the full vectors
+        candidates = k * self.configs.get("quantization",{}).get("rerank_factor",4) if quantization == "binary" else k
+        if quantization == "float16":
+            query = f'CAST(q.embedding AS halfvec({index["dimensions"]}))'
+        if quantization == "binary":
+            nearest = (
+                f"SELECT id, document, cmetadata, embedding::{vector_type} <=> {query} AS distance FROM ("
+                f"SELECT id, document, cmetadata, embedding FROM {EMBEDDING_TABLE} "
+                f"WHERE collection_id = :collection_id AND {condition} "
+                f"ORDER BY {column} <~> binary_quantize({query})::bit({index['dimensions']}) LIMIT :candidates"
+                f") c ORDER BY distance LIMIT :k"
+            )
+        else:
+            nearest = (
+                f"SELECT id, document, cmetadata, {column} <=> {query} AS distance "
+                f"FROM {EMBEDDING_TABLE} WHERE collection_id = :collection_id AND {condition} "
+                f"ORDER BY {column} <=> {query} LIMIT :k"
+            )
+        configs = self.configs.get("index",{})
+        statements = []
+        if index and index["strategy"] == "hnsw":
+            # hnsw returns at most ef_search rows, pgvector caps it at 1000
+            ef_search = min(max(ef_search or configs.get("ef_search",100),candidates),1000)
+            statements.append((f'SET LOCAL hnsw.ef_search = {int(ef_search)}',{}))
+        elif index:
+            statements.append((f'SET LOCAL ivfflat.probes = {int(probes or configs.get("probes",10))}',{}))
+        statements.append((
+            f"SELECT q.position, e.id, e.document, e.cmetadata, e.distance "
+            f"FROM unnest(CAST(:positions AS int[]), CAST(:embeddings AS text[])) AS q(position, embedding) "
+            f"CROSS JOIN LATERAL ({nearest}) e ORDER BY q.position, e.distance",
+            {
+                "positions":list(range(len(embeddings))),
+                "embeddings":[str(list(embedding)) for embedding in embeddings],
+                "collection_id":collection_id,
+                "k":k,
+                "candidates":candidates,
+                **filter_params
+            }
+        ))
+        return statements
+
+    def collect_search_results(self, rows: List[tuple], count: int) -> List[List[tuple]]:
+        """
+        Group the rows of a search query by query position
+
+        Returns:
+            results(list): for each query, a list of (document, distance) tuples
+        """
+        results = [[] for _ in range(count)]
+        for position,id,document,metadata,distance in rows:
+            results[position].append((Document(id=id,page_content=document,metadata=metadata or {}),distance))
+        return results
+
+    def iter_documents(self, batch_size: int = 1000) -> Iterator[tuple]:
+        """
+        Every document of the collection, streamed from the database
+
+        Args:
+            batch_size: rows fetched per round-trip
+
+        Yields:
+            (id, document)
+        """
+        collection_id = self.get_collection_id()
+        if collection_id is None:
+            return
+        with Session(self.vector_store.session_maker.bind) as session:
+            rows = session.execute(
+                text(f"SELECT id, document, cmetadata FROM {EMBEDDING_TABLE} WHERE collection_id = :collection_id")
+                .execution_options(yield_per=batch_size),
+                {"collection_id":collection_id}
+            )
+            for id,document,metadata in rows:
+                yield id,Document(id=id,page_content=document,metadata=metadata or {})
+
+    def get_lexical_index_path(self) -> str:
+        """
+        Location of the BM25 index of the collection
+        """
+        configs = load_config_params_for_node("retrieval") or {}
+        return f'{get_project_filepath()}/{configs.get("bm25_path","data/bm25")}/{self.collection_name}.sqlite'
+
+    def get_lexical_index(self) -> BM25Index:
+        """
+        BM25 index of the collection, kept current on every write when the 'retrieval'
+        config mode is 'hybrid', None otherwise
+        """
+        configs = load_config_params_for_node("retrieval") or {}
+        if configs.get("mode","vector") != "hybrid":
+            return None
+        if self.lexical_index is None:
+            with self._init_lock:
+                if self.lexical_index is None:
+                    self.lexical_index = BM25Index(
+                        db_path=self.get_lexical_index_path(),
+                        k1=configs.get("k1",1.5),
+                        b=configs.get("b",0.75)
+                    )
+        return self.lexical_index
+
+    def update_lexical_index(self, operation: str, *args, written: tuple = None) -> None:
+        """
+        Apply a write to the BM25 index, if hybrid retrieval is on. Called after the
+        rows were written, with the version of the write transaction: the index takes
+        it only when it was at the version just before, so a write it didn't see
+        (another process, a concurrent thread) leaves it stale until the next hybrid
+        search rebuilds it
+
+        Args:
+            operation: BM25Index method, 'add', 'remove', 'update_metadata' or 'clear'
+            args: arguments of the method
+            written: (collection_id, write_version) returned by begin_write, 'clear' takes it as is
+        """
+        lexical_index = self.get_lexical_index()
+        if lexical_index is not None:
+            getattr(lexical_index,operation)(*args)
+            if written is not None:
+                collection_id,write_version = written
+                previous = lexical_index.get_version()
+                # the first write of a collection finds a new index, never synced
+                in_sequence = previous == format_data_version(collection_id,write_version - 1) or (previous is None and write_version == 1)
+                if operation == "clear" or in_sequence:
+                    lexical_index.set_version(format_data_version(collection_id,write_version))
+
+    def is_lexical_index_stale(self) -> bool:
+        """
+        Whether the BM25 index missed writes to the collection: ingested before hybrid
+        retrieval was on, written by a process without it, or interrupted
+        """
+        lexical_index = self.get_lexical_index()
+        return lexical_index is not None and lexical_index.get_version() != self.get_data_version()
+
+    def rebuild_lexical_index(self) -> int:
+        """
+        Rebuild the BM25 index from the documents in the collection, e.g. for a
+        collection ingested before hybrid retrieval was enabled
+
+        Returns:
+            count(int): number of indexed documents
+        """
+        lexical_index = self.get_lexical_index()
+        if lexical_index is None:
+            return 0
+        # read first: a write made during the rebuild leaves the index stale
+        version = self.get_data_version()
+        lexical_index.clear()
+        batch = []
+        for item in self.iter_documents():
+            batch.append(item)
+            if len(batch) >= 1000:
+                lexical_index.add(batch)
+                batch = []
+        lexical_index.add(batch)
+        lexical_index.set_version(version)
+        logger.info(f'rebuilt lexical index: {lexical_index.size()} documents')
+        return lexical_index.size()
+
+    def hybrid_search(self, query: str, k: int = None, filter: dict = None) -> List[tuple]:
+        """
+        Hybrid retrieval: BM25 over the chunk text and vector similarity run in
+        parallel, and the two rankings are merged with reciprocal rank fusion. Exact
+        tokens (years, amounts) are found lexically, paraphrases by the vectors
+
+        Args:
+            query: Search query
+            k: Number of results to return, defaults to the 'retrieval' config
+            filter: metadata filter applied to both searches, see similarity_search
+
+        Returns:
+            List of (document, fused score) tuples, best first
+        """
+        logger.warning(f"Performing hybrid search for: {query}")
+        configs = load_config_params_for_node("retrieval") or {}
+        k = k or configs.get("k",20)
+        candidates = max(configs.get("candidates",50),k)
+        lexical_index = self.get_lexical_index()
+        if lexical_index is None:
+            return self.similarity_search(query,k=k,filter=filter)
+        if self.is_lexical_index_stale():
+            self.rebuild_lexical_index()
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            lexical = executor.submit(lexical_index.search,query,candidates,filter)
+            semantic = executor.submit(self.similarity_search_many,[query],candidates,filter=filter)
+            results = [lexical.result(),semantic.result()[0]]
+        return reciprocal_rank_fusion(results,k=configs.get("rrf_k",60))[:k]
+
+    async def ainit_store(self) -> PGVector:
+        """
+        Async counterpart of init_store: PGVector in async mode on the shared async
+        engine of the running event loop (psycopg async driver). A store is built per
+        engine, so a new event loop gets a new one; only the first creates the
+        extension, the others just look the collection up
+
+        Returns:
+            store(PGVector)
+        """
+        engine = get_async_engine(self.connection_string)
+        if self._async_engine is not engine:
+            store = PGVector(
+                embeddings=self.embeddings,
+                collection_name=self.collection_name,
+                connection=engine,
+                collection_metadata=self.collection_metadata,
+                use_jsonb=True,
+                create_extension=self.async_vector_store is None,
+                async_mode=True,
+            )
+            await store.acreate_collection()
+            self.async_vector_store,self._async_engine = store,engine
+            logger.info(f'async store initialized on the engine of the current event loop')
+        return self.async_vector_store
+
+    async def aget_collection_id(self) -> str:
+        """
+        Async get_collection_id
+        """
+        await self.ainit_store()
+        found,collection = self.get_cached_metadata("collection")
+        if found:
+            return collection[0]
+        async with AsyncSession(self._async_engine) as session:
+            row = (await session.execute(text(COLLECTION_QUERY),{"name":self.collection_name})).first()
+        return self.cache_collection(row)[0]
+
+    async def aget_index(self) -> Dict[str,Any]:
+        """
+        Async get_index
+        """
+        await self.ainit_store()
+        found,index = self.get_cached_metadata("index")
+        if found:
+            return index
+        collection_id = await self.aget_collection_id()
+        if collection_id is None:
+            return None
+        async with AsyncSession(self._async_engine) as session:
+            row = (await session.execute(text(INDEX_QUERY),{"table":EMBEDDING_TABLE,"prefix":f'{get_index_prefix(collection_id)}%'})).first()
+        index = self.describe_index(row,collection_id)
+        self.set_cached_metadata("index",index)
+        return index
+
+    async def adrop_index(self) -> None:
+        """
+        Async drop_index
+        """
+        index = await self.aget_index()
+        if index is not None:
+            async with AsyncSession(self._async_engine) as session, session.begin():
+                await session.execute(text(f'DROP INDEX IF EXISTS {index["name"]}'))
+            self.invalidate_metadata()
+            logger.info(f'dropped index {index["name"]}')
+
+    async def aget_existing_ids(self, ids: List[str]) -> set:
+        """
+        Async get_existing_ids
+        """
+        collection_id = await self.aget_collection_id()
+        async with AsyncSession(self._async_engine) as session:
+            rows = await session.execute(
+                text(f"SELECT id FROM {EMBEDDING_TABLE} WHERE collection_id = :collection_id AND id = ANY(:ids)"),
+                {"collection_id":collection_id,"ids":list(ids)}
+            )
+            return set(rows.scalars())
+
+    async def aadd_documents(self, documents: List[Document], ids: List[str] = None) -> List[str]:
+        """
+        Async add_documents: the chunks are embedded with the async embeddings client
+        and written on the async engine, the event loop is free while they are
+
+        Args:
+            documents: List of documents to add
+            ids: Optional ids of the documents, existing ids are overwritten
+
+        Returns:
+            ids(list): ids of the added documents
+        """
+        logger.info(f"Adding {len(documents)} documents to vector store")
+        store = await self.ainit_store()
+        if not documents:
+            return []
+        ids = [id or document.id or str(uuid.uuid4()) for id,document in zip(ids or [None] * len(documents),documents)]
+        existing = await self.aget_existing_ids(ids)
+        embeddings = await self.embeddings.aembed_documents([document.page_content for document in documents])
+        async with AsyncSession(self._async_engine) as session, session.begin():
+            row = (await session.execute(text(WRITE_VERSION_QUERY),{"name":self.collection_name})).first()
+            if row is None:
+                raise ValueError(f"collection {self.collection_name} doesn't exist")
+            written = (str(row[0]),row[1])
+            await session.execute(self.build_upsert(store,written[0],documents,ids,embeddings))
+        self.counter.increment(self.collection_name,len(set(ids) - existing))
+        # sqlite is blocking, keep it off the loop
+        await asyncio.to_thread(self.update_lexical_index,"add",list(zip(ids,documents)),written=written)
+        return ids
+
+    async def acount_documents(self) -> int:
+        """
+        Async count_documents
+        """
+        collection_id = await self.aget_collection_id()
+        if collection_id is None:
+            return 0
+        async with AsyncSession(self._async_engine) as session:
+            return (await session.execute(
+                text(f"SELECT count(*) FROM {EMBEDDING_TABLE} WHERE collection_id = :collection_id"),
+                {"collection_id":collection_id}
+            )).scalar()
+
+    async def aestimate_document_count(self) -> int:
+        """
+        Async estimate_document_count
+        """
+        collection_id = await self.aget_collection_id()
+        if collection_id is None:
+            return 0
+        async with AsyncSession(self._async_engine) as session:
+            plan = (await session.execute(
+                text(f"EXPLAIN (FORMAT JSON) SELECT 1 FROM {EMBEDDING_TABLE} WHERE collection_id = :collection_id"),
+                {"collection_id":collection_id}
+            )).scalar()
+        if isinstance(plan,str):
+            plan = json.loads(plan)
+        return int(plan[0]["Plan"]["Plan Rows"])
+
+    async def aload_document_count(self) -> int:
+        """
+        Async load_document_count
+        """
+        threshold = self.configs.get("count_estimate_threshold",100000)
+        if threshold:
+            estimate = await self.aestimate_document_count()
+            if estimate >= threshold:
+                return estimate
+        return await self.acount_documents()
+
+    async def aget_document_count(self, exact: bool = False) -> int:
+        """
+        Async get_document_count, shares the count cache with the sync API
+
+        Args:
+            exact: bypass the cache and run COUNT(*)
+
+        Returns:
+            count: # number of document in vector store
+        """
+        if exact:
+            count = await self.acount_documents()
+            self.counter.set(self.collection_name,count)
+            return count
+        return await self.counter.aget(self.collection_name,loader=self.aload_document_count)
+
+    async def aclear_store(self) -> None:
+        """
+        Async clear_store
+        """
+        try:
+            store = await self.ainit_store()
+            await self.adrop_index()
+            await store.adelete_collection()
+            await store.acreate_collection()
+            self.invalidate_metadata()
+            await asyncio.to_thread(get_ingest_manifest(get_manifest_path()).clear)
+            self.counter.set(self.collection_name,0)
+            written = (await self.aget_collection_id(),0)
+            await asyncio.to_thread(self.update_lexical_index,"clear",written=written)
+            logger.info(f'Vector Store Cleared!')
+        except IOError as e:
+            logger.error(f'Clear vector store error:{e}')
+
+    async def aembed_queries(self, queries: List[str]) -> List[List[float]]:
+        """
+        Async embed_queries, shares the query cache with the sync API
+        """
+        model = getattr(self.embeddings,"model",type(self.embeddings).__name__)
+        embeddings = [self.query_cache.get(model,query) for query in queries]
+        missing = list(dict.fromkeys(query for query,embedding in zip(queries,embeddings) if embedding is None))
+        if missing:
+            new = dict(zip(missing,await self.embeddings.aembed_documents(missing)))
+            for query,embedding in new.items():
+                self.query_cache.put(model,query,embedding)
+            embeddings = [new[query] if embedding is None else embedding for query,embedding in zip(queries,embeddings)]
+        return embeddings
+
+    async def asimilarity_search(self, query: str, k: int = 500, ef_search: int = None, probes: int = None, filter: dict = None) -> List[tuple]:
+        """
+        Async similarity_search: many searches can wait on the embeddings API and the
+        database concurrently on one event loop
+
+        Args:
+            see similarity_search
+
+        Returns:
+            List of (document, distance) tuples
+        """
+        logger.warning(f"Performing async similarity search for: {query} filter={filter}")
+        return (await self.asimilarity_search_many([query],k=k,ef_search=ef_search,probes=probes,filter=filter))[0]
+
+    async def asimilarity_search_many(self, queries: List[str], k: int = 500, ef_search: int = None, probes: int = None, filter: dict = None) -> List[List[tuple]]:
+        """
+        Async similarity_search_many
+        """
+        if not queries:
+            return []
+        embeddings = await self.aembed_queries(queries)
+        return await self.asimilarity_search_by_vectors(embeddings,k=k,ef_search=ef_search,probes=probes,filter=filter)
+
+    async def asimilarity_search_by_vectors(self, embeddings: List[List[float]], k: int = 500, ef_search: int = None, probes: int = None, filter: dict = None) -> List[List[tuple]]:
+        """
+        Async similarity_search_by_vectors, same statements on the async engine
+        """
+        index = await self.aget_index()
+        collection_id = index["collection_id"] if index else await self.aget_collection_id()
+        if collection_id is None:
+            return [[] for _ in embeddings]
+        statements = self.build_search_statements(embeddings,k,ef_search,probes,filter,index,collection_id)
+        async with AsyncSession(self._async_engine) as session, session.begin():
+            for sql,params in statements[:-1]:
+                await session.execute(text(sql),params)
+            rows = (await session.execute(text(statements[-1][0]),statements[-1][1])).all()
+        if not rows:
+            # see collection_moved
+            self.invalidate_metadata()
+            if await self.aget_collection_id() != collection_id:
+                return await self.asimilarity_search_by_vectors(embeddings,k=k,ef_search=ef_search,probes=probes,filter=filter)
+        return self.collect_search_results(rows,len(embeddings))
+
+    async def ahybrid_search(self, query: str, k: int = None, filter: dict = None) -> List[tuple]:
+        """
+        Async hybrid_search: the BM25 search runs in a thread while the vector search
+        awaits the embeddings API and the database
+
+        Args:
+            see hybrid_search
+
+        Returns:
+            List of (document, fused score) tuples, best first
+        """
+        logger.warning(f"Performing async hybrid search for: {query}")
+        configs = load_config_params_for_node("retrieval") or {}
+        k = k or configs.get("k",20)
+        candidates = max(configs.get("candidates",50),k)
+        lexical_index = self.get_lexical_index()
+        if lexical_index is None:
+            return await self.asimilarity_search(query,k=k,filter=filter)
+        if await asyncio.to_thread(self.is_lexical_index_stale):
+            await asyncio.to_thread(self.rebuild_lexical_index)
+        lexical,semantic = await asyncio.gather(
+            asyncio.to_thread(lexical_index.search,query,candidates,filter),
+            self.asimilarity_search_many([query],candidates,filter=filter)
+        )
+        return reciprocal_rank_fusion([lexical,semantic[0]],k=configs.get("rrf_k",60))[:k]
+
+    def ingest_artifact(self, handle: str) -> Dict[str,Any]:
+        """
+        Write the chunks a node staged in the artifact store (see
+        DocumentProcessor.stage_directory), streamed batch by batch, and record the
+        files in the ingestion manifest
+
+        Args:
+            handle: artifact handle
+
+        Returns:
+            stats(dict): see StreamingIngestionPipeline.run
+        """
+        pipeline = StreamingIngestionPipeline(
+            processor=None,
+            vector_store=self,
+            manifest=get_ingest_manifest(get_manifest_path()),
+        )
+        return pipeline.write_artifact(handle=handle,artifacts=get_artifact_store())
+
+    def as_retriever(self, **kwargs):
+        """
+        Retriever over this collection
+
+        Args:
+            kwargs: arguments of langchain's VectorStore.as_retriever
+
+        Returns:
+            retriever(VectorStoreRetriever)
+        """
+        self.init_store()
+        return self.vector_store.as_retriever(**kwargs)
+
     def convert_item_to_document(self,item):
         content,metadata=item['content'],item['metadata']
         #logger.info(f'content={content}, metadata={metadata}')
@@ -130,22 +1611,29 @@ class VectorStore:
             Updated state
         """
         logger.info(f'++++{type(state)} ---  state={state}')
+        if is_artifact_handle(state):
+            if not get_artifact_store().exists(state.strip()):
+                # the node already wrote it from the graph state
+                logger.info(f'Vector store artifact {state.strip()} already written')
+            else:
+                try:
+                    stats = self.ingest_artifact(state.strip())
+                    logger.info(f'Vector store artifact ingest:{stats}')
+                except Exception as e:
+                    logger.error(f'Vector store Error:{e}')
+            # nothing left to upsert, only the index check below
+            state = "[]"
         if isinstance(state,str):
             state = ast.literal_eval(state)
             logger.warning(f'{type(state)}****state:{state}')
             if isinstance(state,list):
-                inserted_counter = 0
-                documents = []
-                for item in state:
-                    try:
-                        content,metadata=item['content'],item['metadata']
-                        #logger.info(f'content={content}, metadata={metadata}')
-                        # save documents
-                        documents.append(Document(page_content=content,metadata=metadata))
-                        documents_added = self.add_documents(documents=documents)
-                        inserted_counter += len(documents)
-                    except Exception as e:
-                        logger.error(f'Vector store Error:{e}')
+                try:
+                    counts = self.bulk_upsert(chunks=state)
+                    logger.info(f'Vector store upsert:{counts}')
+                    # keep queries sub-linear as the collection grows
+                    self.ensure_index()
+                except Exception as e:
+                    logger.error(f'Vector store Error:{e}')
             return {
                 "messages":"""Goto analysis node: 
                 You are a data analyst.Perform in depth analyis after retrieving the data using the analysis tool.
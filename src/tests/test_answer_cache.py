@@ -0,0 +1,18 @@
+from src.utils.answer_cache import AnswerCache
+
+
+def test_similar_questions_hit_until_the_collection_changes(tmp_path):
+    cache = AnswerCache(db_path=str(tmp_path / "answers.sqlite"),similarity_threshold=0.95)
+    cache.put("insurance_docs","v1","model",query="trend in auto insurance costs",embedding=[1.0,0.0,0.1],answer={"0":"costs rose"})
+
+    hit = cache.get("insurance_docs","v1","model",[1.0,0.02,0.1])
+    assert hit["answer"] == {"0":"costs rose"} and hit["similarity"] > 0.95
+    assert cache.get("insurance_docs","v1","model",[0.0,1.0,0.0]) is None
+    # re-ingested data: a new version misses, and caching it drops the old answers
+    assert cache.get("insurance_docs","v2","model",[1.0,0.0,0.1]) is None
+    cache.put("insurance_docs","v2","model",query="another question",embedding=[0.0,1.0,0.0],answer={"0":"..."})
+    assert cache.size() == 1
+
+    # answers persist across processes
+    reopened = AnswerCache(db_path=str(tmp_path / "answers.sqlite"))
+    assert reopened.get("insurance_docs","v2","model",[0.0,1.0,0.0])["query"] == "another question"
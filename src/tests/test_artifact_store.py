@@ -0,0 +1,20 @@
+import os
+
+from src.utils.artifact_store import ArtifactStore, find_artifact_handle, is_artifact_handle
+
+
+def test_artifacts_spill_to_disk_and_stream_back(tmp_path):
+    store = ArtifactStore(path=str(tmp_path),max_memory_bytes=1000)
+    small = store.put([{"row":i} for i in range(3)],metadata={"dir_path":"data/csv"})
+    large = store.put({"content":"x" * 100,"row":i} for i in range(50))
+
+    assert store.get_metadata(small) == {"dir_path":"data/csv","records":3}
+    assert [record["row"] for record in store.iter(small)] == [0,1,2]
+    # the large artifact went over the budget and was moved to a file
+    assert os.path.exists(store.get_file_path(large)) and store.get_nbytes() < 1000
+    assert [record["row"] for record in store.iter(large)] == list(range(50))
+
+    store.delete(large)
+    assert not os.path.exists(store.get_file_path(large))
+    assert is_artifact_handle(f" {small}\n") and not is_artifact_handle("[]")
+    assert find_artifact_handle(f"{{'messages': 'Send ONLY {small} to the tool'}}") == small
@@ -0,0 +1,34 @@
+from langchain_core.documents import Document
+
+from src.utils.bm25 import BM25Index, reciprocal_rank_fusion
+
+
+def test_exact_year_lookup(tmp_path):
+    index = BM25Index(f'{tmp_path}/bm25.sqlite')
+    index.add(
+        (str(year),Document(page_content=f"Year: {year}, Average expenditure: {800 + year % 100}, Percent change: 1.2",metadata={"year":year}))
+        for year in range(1995,2020)
+    )
+    document,_ = index.search("what was the average expenditure in 2009",k=5)[0]
+    assert document.metadata == {"year":2009}
+
+    index.remove(["2009"])
+    assert index.size() == 24
+    assert all(document.id != "2009" for document,_ in index.search("2009"))
+
+
+def test_reciprocal_rank_fusion_rewards_agreement():
+    a,b,c = (Document(id=id,page_content=id) for id in "abc")
+    fused = reciprocal_rank_fusion([[(a,9.0),(b,5.0)],[(b,0.1),(c,0.2)]],k=60)
+    assert [document.id for document,_ in fused] == ["b","a","c"]
+
+
+def test_version_is_kept_until_cleared(tmp_path):
+    index = BM25Index(f'{tmp_path}/bm25.sqlite')
+    assert index.get_version() is None
+    index.set_version("v1")
+    index.close()
+    index = BM25Index(f'{tmp_path}/bm25.sqlite')
+    assert index.get_version() == "v1"
+    index.clear()
+    assert index.get_version() is None
@@ -0,0 +1,61 @@
+import threading
+from types import SimpleNamespace
+
+from langchain_core.messages import AIMessage
+
+from src.utils.create_nodes import CreateNode
+
+
+class Store:
+    def __init__(self,error=None):
+        self.error = error
+        self.written = []
+
+    def ingest_artifact(self,handle):
+        if self.error:
+            raise self.error
+        self.written.append(handle)
+        return {"files":1}
+
+
+def make_node(store):
+    # the agent and the worker without an LLM
+    node = CreateNode.__new__(CreateNode)
+    node.name = "vector_store"
+    node.dct = {"vector_store":-1}
+    node.tool_function = lambda: store
+    node.tf = None
+    node._lock = threading.Lock()
+    node.agent = SimpleNamespace(invoke=lambda state: {"messages":[AIMessage(content="stored, goto analysis")]})
+    return node
+
+
+def test_vector_store_node_writes_the_handle_in_the_state():
+    handle = f'artifact:{"0" * 32}'
+    store = Store()
+    command = make_node(store).node({"messages":[],"documents":handle})
+    assert store.written == [handle] and command.update["documents"] is None
+
+    # a failed write keeps the handle for a retry
+    command = make_node(Store(error=OSError("disk full"))).node({"messages":[],"documents":handle})
+    assert "documents" not in command.update
+
+
+def test_a_failing_write_ends_the_run(monkeypatch):
+    monkeypatch.setenv("ANTHROPIC_API_KEY","sk-test")
+    from src.agents.supervisor import route_from_state, supervisor_node
+
+    handle = f'artifact:{"0" * 32}'
+    node = make_node(Store(error=OSError("database is down")))
+    state = {"messages":[],"documents":handle}
+    passes = 0
+    # supervisor and vector_store alternate as in the graph, until the supervisor finishes
+    while route_from_state(state) == "vector_store":
+        passes += 1
+        assert passes <= 3
+        state.update(node.node(state).update)
+    assert passes == 3 and state["documents"] is None and "database is down" in state["error"]
+    assert supervisor_node(state).goto == "__end__"
+    # the LLM is not asked either when rule routing is off
+    monkeypatch.setattr("src.agents.supervisor.load_config_params_for_node",lambda node: {"rule_routing":False})
+    assert supervisor_node(state).goto == "__end__"
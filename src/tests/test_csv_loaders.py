@@ -0,0 +1,40 @@
+import pytest
+
+from src.utils.csv_loaders import load_csv_file
+from src.utils.dedup import deduplicate_documents
+
+
+@pytest.fixture
+def csv_file(tmp_path):
+    file_path = tmp_path / "expenditures.csv"
+    file_path.write_text("Year,Average expenditure,Percent change\n2012,$812.40,2.2%\n2013,841.06,3.5\n2014,869.47,3.4\n")
+    return str(file_path)
+
+
+def test_load_csv_file_pandas_one_document_per_row(csv_file):
+    docs = load_csv_file(csv_file,engine="pandas")
+    assert len(docs) == 3
+    assert docs[0].page_content == "Year: 2012 | Average expenditure: $812.40 | Percent change: 2.2%"
+    assert docs[0].metadata["columns"] == ["Year","Average expenditure","Percent change"]
+    assert docs[2].metadata["row_start"] == 2
+
+
+def test_load_csv_file_row_groups(csv_file):
+    docs = load_csv_file(csv_file,engine="pandas",rows_per_document=2)
+    assert len(docs) == 2
+    assert docs[0].metadata["row_end"] == 1
+    assert docs[1].page_content.startswith("Year: 2014")
+
+
+def test_normalized_rows_are_deduplicated_across_files(tmp_path):
+    wide = tmp_path / "1998-2007.csv"
+    wide.write_text("Year,Average  expenditure,Percent  change,Year.1,Average expenditure,Percent  change.1\n1998,$703,-0.3%,2003,$830,5.6%\n")
+    long = tmp_path / "2003-2012.csv"
+    long.write_text("Year,Average expenditure,Percent change\n2003,$830.00,5.6%\n")
+
+    docs = load_csv_file(str(wide),engine="pandas",normalize=True) + load_csv_file(str(long),engine="pandas",normalize=True)
+    assert [doc.page_content for doc in docs][1] == "Year: 2003 | Average expenditure: 830 | Percent change: 5.6"
+
+    unique = deduplicate_documents(docs)
+    assert len(unique) == 2
+    assert unique[1].metadata["sources"] == [str(wide),str(long)]
@@ -0,0 +1,56 @@
+from types import SimpleNamespace
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+import src.utils.document_counter as document_counter
+from src.agents.local_vector_store import LocalVectorStore
+from src.agents.vector_store import VectorStore
+from src.utils.document_counter import DocumentCounter
+
+
+def test_cached_count_is_reloaded_after_the_ttl(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(document_counter.time,"monotonic",lambda: now[0])
+    counter = DocumentCounter(ttl=10)
+    loads = []
+    def loader():
+        loads.append(now[0])
+        return 5
+    assert counter.get("docs",loader) == 5
+    counter.increment("docs",3)
+    now[0] += 9
+    assert counter.get("docs",loader) == 8 and len(loads) == 1
+    # an increment doesn't extend the ttl, the count is reloaded from the database
+    now[0] += 1
+    assert counter.get("docs",loader) == 5 and len(loads) == 2
+    counter.increment("docs",-10)
+    assert counter.peek("docs") == 0
+    # nothing cached, nothing to adjust
+    counter.increment("other",1)
+    assert counter.peek("other") is None
+
+
+def test_writes_keep_the_count_current(tmp_path, monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY","sk-test")
+    store = LocalVectorStore(path=str(tmp_path))
+    store.embeddings = DeterministicFakeEmbedding(size=32)
+    store.counter = DocumentCounter(ttl=None)
+    assert store.get_document_count() == 0
+    store.add_documents([Document(page_content=f"row {i}") for i in range(4)],ids=list("abcd"))
+    # overwriting an id doesn't change the count
+    store.add_documents([Document(page_content="row a")],ids=["a"])
+    assert store.counter.peek(store.collection_name) == 4
+    store.delete_documents(["a","b"])
+    assert store.counter.peek(store.collection_name) == 2 == store.count_documents()
+
+
+def test_large_collections_use_the_planner_estimate():
+    store = SimpleNamespace(configs={"count_estimate_threshold":1000},estimate_document_count=lambda: 5000,count_documents=lambda: 4321)
+    assert VectorStore.load_document_count(store) == 5000
+    # under the threshold, the estimate is too coarse: COUNT(*)
+    store.estimate_document_count = lambda: 999
+    assert VectorStore.load_document_count(store) == 4321
+    store.configs = {"count_estimate_threshold":0}
+    store.estimate_document_count = None
+    assert VectorStore.load_document_count(store) == 4321
@@ -0,0 +1,133 @@
+import pytest
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+import src.agents.document_processor as document_processor
+from src.agents.document_processor import DocumentProcessor
+from src.agents.local_vector_store import LocalVectorStore
+from src.utils.csv_loaders import load_csv_file
+from src.utils.manifest import IngestManifest, hash_file, hash_text
+
+
+def make_processor(tmp_path, workers, **configs):
+    store = LocalVectorStore(path=str(tmp_path / "index"))
+    store.embeddings = DeterministicFakeEmbedding(size=32)
+    configs = {"workers":workers,"loader_engine":"pandas","chunk_size":1000,"chunk_overlap":10,"normalize_rows":True,**configs}
+    return DocumentProcessor(vector_store=store,configs=configs)
+
+def write_csv(path, years):
+    path.write_text("Year,Average expenditure\n" + "".join(f"{year},{year - 1000}\n" for year in years))
+
+def fail_on(name):
+    # patched before the pool starts, forked workers inherit it
+    def loader(file_path, **kwargs):
+        if file_path.endswith(name):
+            raise OSError(f"cannot read {name}")
+        return load_csv_file(file_path,**kwargs)
+    return loader
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_a_file_that_fails_to_load_keeps_its_chunks(tmp_path, monkeypatch, workers):
+    monkeypatch.setenv("OPENAI_API_KEY","sk-test")
+    monkeypatch.setattr(document_processor,"get_manifest_path",lambda: str(tmp_path / "manifest.sqlite"))
+    folder = tmp_path / "csv"
+    folder.mkdir()
+    write_csv(folder / "a.csv",range(2000,2005))
+    write_csv(folder / "b.csv",range(2010,2015))
+    processor = make_processor(tmp_path,workers)
+    processor.sync_directory(dir_path=str(folder))
+    assert processor.vector_store.count_documents() == 10
+    old_hash = hash_file(f"{folder}/b.csv")
+
+    # both files changed (two files go through the pool when workers > 1) but b.csv
+    # can't be read: its vectors stay and it is retried next time
+    write_csv(folder / "a.csv",range(2000,2006))
+    write_csv(folder / "b.csv",range(2010,2012))
+    monkeypatch.setattr(document_processor,"load_csv_file",fail_on("b.csv"))
+    stats = processor.sync_directory(dir_path=str(folder))
+    assert list(processor.failed_files) == [f"{folder}/b.csv"]
+    assert (stats["added"],stats["deleted"]) == (1,0)
+    assert processor.vector_store.count_documents() == 11
+    assert IngestManifest(str(tmp_path / "manifest.sqlite")).get_file_hash(f"{folder}/b.csv") == old_hash
+
+
+def test_streaming_skips_a_file_that_fails_to_load(tmp_path, monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY","sk-test")
+    monkeypatch.setattr(document_processor,"get_manifest_path",lambda: str(tmp_path / "manifest.sqlite"))
+    monkeypatch.setattr(document_processor,"load_csv_file",fail_on("b.csv"))
+    folder = tmp_path / "csv"
+    folder.mkdir()
+    write_csv(folder / "a.csv",range(2000,2005))
+    write_csv(folder / "b.csv",range(2010,2015))
+    processor = make_processor(tmp_path,1)
+    stats = processor.stream_directory(dir_path=str(folder))
+    assert stats["files"] == 1 and list(processor.failed_files) == [f"{folder}/b.csv"]
+    assert IngestManifest(str(tmp_path / "manifest.sqlite")).get_files() == [f"{folder}/a.csv"]
+
+
+def test_iter_loaded_files_yields_in_order_with_bounded_reads(tmp_path, monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY","sk-test")
+    file_paths = []
+    for i in range(5):
+        write_csv(tmp_path / f"{i}.csv",range(2000,2000 + 50 * (5 - i)))
+        file_paths.append(f"{tmp_path}/{i}.csv")
+    pulled = []
+    def lazy_paths():
+        for file_path in file_paths:
+            pulled.append(file_path)
+            yield file_path
+
+    processor = make_processor(tmp_path,2,max_files_in_flight=2)
+    results = processor.iter_loaded_files(file_paths=lazy_paths(),workers=2,split=True)
+    first = next(results)
+    # no more files are read than the in-flight cap while the consumer holds the first
+    assert first["file_path"] == file_paths[0] and len(pulled) == 2
+    assert [first["file_path"],*(result["file_path"] for result in results)] == file_paths
+
+
+def test_overlapping_files_ingested_in_separate_runs_share_their_rows(tmp_path, monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY","sk-test")
+    monkeypatch.setattr(document_processor,"get_manifest_path",lambda: str(tmp_path / "manifest.sqlite"))
+    folder = tmp_path / "csv"
+    folder.mkdir()
+    write_csv(folder / "a.csv",range(2000,2010))
+    processor = make_processor(tmp_path,1)
+    processor.sync_directory(dir_path=str(folder))
+    write_csv(folder / "b.csv",range(2005,2015))
+    processor.sync_directory(dir_path=str(folder))
+
+    store = processor.vector_store
+    assert store.count_documents() == 15
+    hits = store.similarity_search("2007",k=20,filter={"source_file":"b.csv"})
+    assert sorted(doc.metadata["year_min"] for doc,_ in hits) == list(range(2005,2015))
+
+
+def test_reindex_directory_streams_the_files_into_the_shadow(tmp_path, monkeypatch):
+    import src.agents.local_vector_store as local_vector_store
+    monkeypatch.setenv("OPENAI_API_KEY","sk-test")
+    monkeypatch.setattr(document_processor,"get_manifest_path",lambda: str(tmp_path / "manifest.sqlite"))
+    folder = tmp_path / "csv"
+    folder.mkdir()
+    write_csv(folder / "a.csv",range(2000,2005))
+    write_csv(folder / "b.csv",range(2003,2008))
+    write_csv(folder / "c.csv",range(2010,2015))
+    processor = make_processor(tmp_path,1)
+    loaded,embedded = [],[]
+    def loader(file_path, **kwargs):
+        loaded.append(file_path)
+        return load_csv_file(file_path,**kwargs)
+    monkeypatch.setattr(document_processor,"load_csv_file",loader)
+    embed_documents = DeterministicFakeEmbedding.embed_documents
+    monkeypatch.setattr(DeterministicFakeEmbedding,"embed_documents",lambda self, texts: embedded.append(len(loaded)) or embed_documents(self,texts))
+    # small shadow batches
+    monkeypatch.setattr(local_vector_store,"load_config_params_for_node",lambda node: {"bulk_batch_size":5})
+
+    stats = processor.reindex_directory(dir_path=str(folder))
+    assert stats["swapped"] and (stats["count"],stats["files"]) == (13,3)
+    # the first batch was written before the last file was read
+    assert embedded[0] < 3
+    store = processor.vector_store
+    hits = store.similarity_search("2004",k=20,filter={"source_file":"b.csv"})
+    assert sorted(doc.metadata["year_min"] for doc,_ in hits) == list(range(2003,2008))
+    assert IngestManifest(str(tmp_path / "manifest.sqlite")).get_chunks(f"{folder}/b.csv") == \
+        {hash_text(doc.page_content) for doc,_ in hits}
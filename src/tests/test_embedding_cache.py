@@ -0,0 +1,53 @@
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from src.utils.embedding_cache import CachedEmbeddings, EmbeddingCache
+
+
+class CountingEmbeddings(DeterministicFakeEmbedding):
+    texts: int = 0
+
+    def embed_documents(self, texts):
+        self.texts += len(texts)
+        return super().embed_documents(texts)
+
+
+def test_only_new_texts_are_embedded(tmp_path):
+    model = CountingEmbeddings(size=8)
+    cache = EmbeddingCache(f'{tmp_path}/cache.sqlite')
+    embeddings = CachedEmbeddings(model,cache)
+
+    first = embeddings.embed_documents(["2019 auto","2020 auto","2019 auto"])
+    assert model.texts == 2
+    # a new process reads the same cache file
+    again = CachedEmbeddings(model,EmbeddingCache(f'{tmp_path}/cache.sqlite')).embed_documents(["2020 auto","2021 auto"])
+    assert model.texts == 3
+    assert again[0] == first[1]
+    assert cache.stats["misses"] == 3
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = EmbeddingCache(f'{tmp_path}/cache.sqlite',max_entries=2)
+    cache.put_many("m",0,{"a":[1.0],"b":[2.0]})
+    cache.get_many("m",0,["a"])
+    cache.put_many("m",0,{"c":[3.0]})
+    assert cache.size() == 2
+    assert set(cache.get_many("m",0,["a","b","c"])) == {"a","c"}
+
+
+def test_eviction_keeps_the_count_without_counting_the_table(tmp_path):
+    cache = EmbeddingCache(f'{tmp_path}/cache.sqlite',max_entries=3)
+    other = EmbeddingCache(f'{tmp_path}/cache.sqlite',max_entries=3)
+    statements = []
+    cache.connection.set_trace_callback(statements.append)
+    cache.put_many("m",0,{"a":[1.0],"b":[2.0]})
+    # rewriting a cached text doesn't add an entry
+    cache.put_many("m",0,{"b":[2.0],"c":[3.0]})
+    # another process shares the file and its count
+    other.put_many("m",0,{"d":[4.0],"e":[5.0]})
+    cache.put_many("m",0,{"f":[6.0]})
+    cache.connection.set_trace_callback(None)
+    assert cache.size() == 3 and set(cache.get_many("m",0,list("abcdef"))) == {"d","e","f"}
+    assert not any("COUNT(*) FROM embeddings" in statement and "text_hash IN" not in statement for statement in statements)
+    cache.clear()
+    cache.put_many("m",0,{"a":[1.0]})
+    assert EmbeddingCache(f'{tmp_path}/cache.sqlite').size() == 1
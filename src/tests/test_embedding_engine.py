@@ -0,0 +1,43 @@
+from types import SimpleNamespace
+
+from src.utils.embedding_engine import EmbeddingEngine, pack_batches
+
+
+class ApiError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f'status {status_code}')
+        self.status_code = status_code
+
+
+class FakeClient:
+    """
+    embeddings.create that rate limits the first request, rejects the text 'bad'
+    and answers in reverse order (the API returns an index per input)
+    """
+    def __init__(self):
+        self.requests = []
+        self.embeddings = self
+
+    def create(self, input, model):
+        self.requests.append(list(input))
+        if len(self.requests) == 1:
+            raise ApiError(429)
+        if "bad" in input:
+            raise ApiError(400)
+        data = [SimpleNamespace(index=i,embedding=[float(len(text))]) for i,text in enumerate(input)]
+        return SimpleNamespace(data=data[::-1])
+
+
+def test_pack_batches_respects_token_budget():
+    assert pack_batches([3,3,3,9,1],max_tokens=6,max_inputs=10) == [[0,1],[2],[3],[4]]
+    assert pack_batches([1,1,1],max_tokens=100,max_inputs=2) == [[0,1],[2]]
+
+
+def test_results_keep_input_order_with_failure_markers():
+    client = FakeClient()
+    engine = EmbeddingEngine(client=client,max_inputs_per_request=3,concurrency=1,backoff=0.01)
+    texts = ["a","bb","bad","dddd","","eeeee"]
+    assert engine.embed(texts) == [[1.0],[2.0],None,[4.0],None,[5.0]]
+    assert engine.stats["rate_limited"] == 1
+    assert engine.stats["retries"] == 1
+    assert engine.stats["embedded"] == 4
@@ -0,0 +1,24 @@
+from src.utils.event_log import EventLog
+
+
+def test_readers_get_only_the_events_appended_since_their_offset(tmp_path):
+    log = EventLog(path=str(tmp_path / "events.jsonl"),max_bytes=200)
+    log.start_run(query="trends?")
+    log.append("token",text="Costs ")
+    events,offset,reset = log.read()
+    assert [event["type"] for event in events] == ["run_start","token"] and not reset
+
+    log.append("token",text="rose")
+    # a line still being written waits for the next read
+    with open(log.path,'a') as f:
+        f.write('{"type": "tok')
+    events,offset,reset = log.read(offset=offset)
+    assert [event["text"] for event in events] == ["rose"]
+    assert log.read(offset=offset)[0] == []
+
+    # the log is over max_bytes, the next run starts a new one
+    with open(log.path,'a') as f:
+        f.write('en"}\n')
+    log.start_run(query="again?")
+    events,offset,reset = log.read(offset=offset)
+    assert reset and [event["query"] for event in events] == ["again?"]
@@ -0,0 +1,17 @@
+import numpy as np
+
+from src.utils.local_embeddings import HashingEmbeddings
+
+
+def test_hashing_embeddings_are_deterministic_and_lexical():
+    embeddings = HashingEmbeddings(dimensions=256)
+    texts = ["Year: 2019, Average expenditure: 1050.12","Year: 2019, Average expenditure: 1050.12","State: Texas, Percent change: 3.1",""]
+    vectors = np.array(embeddings.embed_documents(texts))
+    assert vectors.shape == (4,256)
+    assert np.allclose(vectors[0],vectors[1])
+    assert np.allclose(vectors[0],HashingEmbeddings(dimensions=256).embed_query(texts[0]))
+    assert np.isclose(np.linalg.norm(vectors[0]),1)
+    assert not vectors[3].any()
+
+    query = np.array(embeddings.embed_query("average expenditure in 2019"))
+    assert query @ vectors[0] > query @ vectors[2]
@@ -0,0 +1,104 @@
+import asyncio
+import os
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from src.agents.local_vector_store import LocalVectorStore
+from src.utils.manifest import hash_text
+
+
+def make_store(path):
+    store = LocalVectorStore(path=str(path))
+    store.embeddings = DeterministicFakeEmbedding(size=32)
+    return store
+
+
+def test_search_delete_and_reload(tmp_path, monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY","sk-test")
+    store = make_store(tmp_path)
+    store.counter.invalidate()
+    documents = [Document(page_content=f"{year} average expenditure",metadata={"year":year}) for year in range(2000,2020)]
+    assert store.bulk_upsert(documents) == {"inserted":20,"skipped":0}
+    assert store.bulk_upsert(documents[:5]) == {"inserted":0,"skipped":5}
+
+    document,distance = store.similarity_search("2005 average expenditure",k=3)[0]
+    assert document.metadata == {"year":2005}
+    assert abs(distance) < 1e-5
+
+    store.delete_documents([document.id])
+    assert store.get_document_count(exact=True) == 19
+    assert all(doc.metadata["year"] != 2005 for doc,_ in store.similarity_search("2005 average expenditure",k=19))
+
+    # a new instance loads the persisted index
+    reloaded = make_store(tmp_path)
+    assert reloaded.count_documents() == 19
+    assert [doc.id for doc,_ in reloaded.similarity_search("2010 average expenditure",k=2)] == \
+        [doc.id for doc,_ in store.similarity_search("2010 average expenditure",k=2)]
+
+
+def test_similarity_search_many_matches_single_searches(tmp_path, monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY","sk-test")
+    store = make_store(tmp_path)
+    store.bulk_upsert([Document(page_content=f"{state} auto insurance") for state in ["Texas","Ohio","Maine","Utah"]])
+    queries = ["Ohio auto insurance","Utah auto insurance"]
+    many = store.similarity_search_many(queries,k=2)
+    assert [[doc.id for doc,_ in results] for results in many] == \
+        [[doc.id for doc,_ in store.similarity_search(query,k=2)] for query in queries]
+    # the single searches were answered from the query embedding cache
+    assert store.query_cache.stats["hits"] == 2
+
+
+def test_reindex_swaps_in_a_complete_shadow(tmp_path, monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY","sk-test")
+    store = make_store(tmp_path)
+    store.bulk_upsert([Document(page_content=f"{year} old rate") for year in range(2000,2010)])
+
+    # a shadow much smaller than the live collection is rejected and dropped
+    assert store.reindex([Document(page_content="2000 new rate")])["swapped"] is False
+    assert store.count_documents() == 10
+    assert sorted(os.listdir(tmp_path)) == ["insurance_docs"]
+
+    stats = store.reindex([Document(page_content=f"{year} new rate") for year in range(2000,2020)])
+    assert stats == {"swapped":True,"inserted":20,"previous":10,"count":20}
+    assert sorted(os.listdir(tmp_path)) == ["insurance_docs"]
+    assert store.similarity_search("2005 new rate",k=1)[0][0].page_content == "2005 new rate"
+    # ids are the ones incremental ingestion would produce, deletes keep working
+    store.delete_documents([store.make_document_id(hash_text("2005 new rate"))])
+    assert make_store(tmp_path).count_documents() == 19
+
+
+def test_async_api_matches_the_sync_one(tmp_path, monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY","sk-test")
+    store = make_store(tmp_path)
+    store.counter.invalidate()
+    queries = ["Ohio auto insurance","Utah auto insurance"]
+
+    async def run():
+        await store.aadd_documents([Document(page_content=f"{state} auto insurance") for state in ["Texas","Ohio","Maine","Utah"]])
+        count = await store.aget_document_count()
+        results = await asyncio.gather(*[store.asimilarity_search(query,k=2) for query in queries])
+        await store.aclear_store()
+        return count,results,await store.aget_document_count()
+
+    count,results,cleared = asyncio.run(run())
+    assert (count,cleared) == (4,0)
+    assert [hits[0][0].page_content for hits in results] == queries
+
+
+def test_hybrid_search_rebuilds_a_stale_lexical_index(tmp_path, monkeypatch):
+    import src.agents.vector_store as vector_store
+    monkeypatch.setenv("OPENAI_API_KEY","sk-test")
+    mode = {"mode":"hybrid"}
+    monkeypatch.setattr(vector_store,"load_config_params_for_node",lambda node: mode if node == "retrieval" else {})
+    store = make_store(tmp_path)
+    store.add_documents([Document(page_content=f"{year} average expenditure") for year in range(2000,2005)],ids=[str(year) for year in range(2000,2005)])
+    assert not store.is_lexical_index_stale()
+
+    # written while hybrid retrieval was off: the lexical index missed it
+    mode["mode"] = "vector"
+    store.add_documents([Document(page_content="2030 average expenditure")],ids=["2030"])
+    mode["mode"] = "hybrid"
+    assert store.is_lexical_index_stale()
+    assert store.hybrid_search("2030",k=1)[0][0].id == "2030"
+    assert store.lexical_index.size() == 6 and not store.is_lexical_index_stale()
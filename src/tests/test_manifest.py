@@ -0,0 +1,31 @@
+from src.utils.manifest import IngestManifest, get_ingest_manifest
+
+
+def test_plan_file_only_adds_new_chunks(tmp_path):
+    manifest = IngestManifest(f'{tmp_path}/manifest.sqlite')
+    assert manifest.plan_file("a.csv",{"x","y"}) == ({"x","y"},set())
+    manifest.update_file("a.csv","hash-a",{"x","y"})
+
+    to_add,to_delete = manifest.plan_file("a.csv",{"y","z"})
+    assert to_add == {"z"}
+    assert to_delete == {"x"}
+
+
+def test_shared_chunks_are_kept_until_last_reference_goes(tmp_path):
+    manifest = IngestManifest(f'{tmp_path}/manifest.sqlite')
+    manifest.update_file("a.csv","hash-a",{"x","y"})
+    # b.csv repeats a row of a.csv, it must not be embedded twice
+    assert manifest.plan_file("b.csv",{"y","z"}) == ({"z"},set())
+    manifest.update_file("b.csv","hash-b",{"y","z"})
+
+    _,to_delete = manifest.plan_file("a.csv",set())
+    assert to_delete == {"x"}
+    manifest.remove_file("a.csv")
+    assert manifest.get_files() == ["b.csv"]
+    assert manifest.get_file_hash("b.csv") == "hash-b"
+
+
+def test_manifest_is_shared_per_path(tmp_path):
+    manifest = get_ingest_manifest(f'{tmp_path}/manifest.sqlite')
+    assert get_ingest_manifest(f'{tmp_path}/manifest.sqlite') is manifest
+    assert get_ingest_manifest(f'{tmp_path}/other.sqlite') is not manifest
@@ -0,0 +1,25 @@
+from langchain_core.messages import HumanMessage
+
+from src.utils.message_history import SUMMARY_NAME, compact_messages, estimate_tokens
+
+
+def test_history_stays_within_budget_over_a_long_run():
+    request = HumanMessage(content="Process the csv files, then analyse the trends")
+    history = [request]
+    sizes = []
+    for turn in range(50):
+        reply = HumanMessage(content=f"turn {turn} " + "average expenditure 1024.5 " * 400,name="analysis")
+        history = compact_messages(history + [reply],max_tokens=2000,max_message_tokens=500,summary_tokens=200)
+        sizes.append(sum(estimate_tokens(message) for message in history))
+
+    assert max(sizes) <= 2000
+    # the user request, a rolling summary and the latest reply (cut to a stub) are kept
+    assert history[0] is request
+    assert history[1].name == SUMMARY_NAME and "turn 48" in history[-2].content + history[1].content
+    assert history[-1].content.startswith("turn 49") and "characters omitted" in history[-1].content
+    assert history[-1].name == "analysis"
+
+
+def test_short_history_is_unchanged():
+    history = [HumanMessage(content="question"),HumanMessage(content="answer",name="analysis")]
+    assert compact_messages(history) == history
@@ -0,0 +1,30 @@
+from langchain_core.documents import Document
+
+from src.utils.metadata_filters import add_filter_metadata, build_sql_filter, matches_filter, merge_sources
+
+
+def test_years_and_source_file_are_extracted():
+    document, = add_filter_metadata([Document(
+        page_content="Year: 2009 | Average expenditure: 2013.5 | Percent change: 1.2",
+        metadata={"source":"data/csv/expenditures 2000-2009.csv"}
+    )])
+    assert document.metadata["year_min"] == document.metadata["year_max"] == 2009
+    assert document.metadata["source_files"] == ["expenditures 2000-2009.csv"]
+
+    assert matches_filter(document.metadata,{"start_year":2005,"end_year":2010,"source_file":"expenditures 2000-2009.csv"})
+    assert not matches_filter(document.metadata,{"start_year":2015,"end_year":None})
+
+
+def test_sql_filter_uses_typed_year_range():
+    condition,params = build_sql_filter({"start_year":2015,"end_year":2018,"source_file":None})
+    assert condition == "(cmetadata->>'year_max')::int >= :filter_start_year AND (cmetadata->>'year_min')::int <= :filter_end_year"
+    assert params == {"filter_start_year":2015,"filter_end_year":2018}
+    assert build_sql_filter(None) == ("TRUE",{})
+
+
+def test_merge_sources_adds_the_missing_files_once():
+    metadata = {"source":"data/csv/a.csv","source_files":["a.csv"]}
+    merged = merge_sources(metadata,["data/csv/b.csv","data/csv/a.csv"])
+    assert (merged["sources"],merged["source_files"]) == (["data/csv/a.csv","data/csv/b.csv"],["a.csv","b.csv"])
+    assert merge_sources(merged,["data/csv/b.csv"]) is merged
+    assert matches_filter(merged,{"source_file":"b.csv"})
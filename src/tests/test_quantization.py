@@ -0,0 +1,73 @@
+import json
+
+import numpy as np
+import pytest
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from src.agents.local_vector_store import LocalVectorStore
+from src.utils.quantization import QuantizedMatrix, get_bytes_per_vector, normalize, truncate_embeddings
+
+
+def test_quantized_search_keeps_the_nearest_rows(tmp_path):
+    rng = np.random.default_rng(0)
+    vectors = normalize(rng.normal(size=(2000,128)))
+    queries = normalize(vectors[:20] + 0.1 * rng.normal(size=(20,128)))
+    for quantization in ("float32","float16","int8","binary"):
+        path = tmp_path / quantization
+        path.mkdir()
+        matrix = QuantizedMatrix(path=str(path),dimensions=128,quantization=quantization)
+        matrix.append(vectors)
+        matrix.open(len(vectors))
+        rows = [rows[0] for rows,_ in matrix.search(queries,k=5)]
+        assert rows == list(range(20)), quantization
+        assert matrix.get_nbytes() == len(vectors) * get_bytes_per_vector(quantization,128)
+    # 'binary' is the smallest format: the bits only
+    assert get_bytes_per_vector("binary",128) < get_bytes_per_vector("int8",128) < get_bytes_per_vector("float16",128)
+
+
+def test_truncate_embeddings_renormalizes():
+    vectors = truncate_embeddings(np.ones((3,8)),4)
+    assert vectors.shape == (3,4)
+    assert np.allclose(np.linalg.norm(vectors,axis=1),1)
+
+
+def test_local_store_migrates_without_reembedding(tmp_path, monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY","sk-test")
+    store = LocalVectorStore(path=str(tmp_path))
+    store.embeddings = DeterministicFakeEmbedding(size=64)
+    store.bulk_upsert([Document(page_content=f"{year} average expenditure") for year in range(2000,2020)])
+    size = store.matrix.get_nbytes()
+
+    assert store.migrate_embeddings(quantization="int8") == {"updated":20,"dimensions":64,"quantization":"int8"}
+    assert store.matrix.get_nbytes() < size / 3
+    assert store.similarity_search("2005 average expenditure",k=1)[0][0].page_content == "2005 average expenditure"
+    # the format is persisted with the collection
+    reloaded = LocalVectorStore(path=str(tmp_path))
+    reloaded.init_store()
+    assert (reloaded.quantization,reloaded.dimensions) == ("int8",64)
+
+
+def test_interrupted_local_migration_keeps_the_new_files(tmp_path, monkeypatch):
+    import os
+    monkeypatch.setenv("OPENAI_API_KEY","sk-test")
+    store = LocalVectorStore(path=str(tmp_path))
+    store.embeddings = DeterministicFakeEmbedding(size=64)
+    store.bulk_upsert([Document(page_content=f"{year} average expenditure") for year in range(2000,2020)])
+    configs = json.dumps(store.configs)
+
+    # the process dies once the new files are in place, before the old ones are deleted
+    def crash(path):
+        raise KeyboardInterrupt
+    with monkeypatch.context() as patch:
+        patch.setattr(os,"remove",crash)
+        with pytest.raises(KeyboardInterrupt):
+            store.migrate_embeddings(quantization="float16")
+    assert os.path.exists(tmp_path / store.collection_name / "embeddings.f32")
+    reloaded = LocalVectorStore(path=str(tmp_path))
+    reloaded.embeddings = store.embeddings
+    reloaded.init_store()
+    assert reloaded.quantization == "float16"
+    assert reloaded.similarity_search("2005 average expenditure",k=1)[0][0].page_content == "2005 average expenditure"
+    # the format is in the collection, the config is unchanged
+    assert json.dumps(store.configs) == configs
@@ -0,0 +1,22 @@
+import src.utils.store_registry as store_registry
+
+
+def test_default_and_named_collections_share_one_store(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY","sk-test")
+    monkeypatch.setattr(store_registry,"load_config_params_for_node",lambda node: {"backend":"local"})
+    store_registry.dispose_all()
+    try:
+        default = store_registry.get_vector_store()
+        assert store_registry.get_vector_store("insurance_docs") is default
+        assert store_registry.get_vector_store(None) is default
+        other = store_registry.get_vector_store("claims")
+        assert other is not default and other.collection_name == "claims"
+    finally:
+        store_registry.dispose_all()
+
+    # the named collection is registered first
+    try:
+        named = store_registry.get_vector_store("insurance_docs")
+        assert store_registry.get_vector_store() is named
+    finally:
+        store_registry.dispose_all()
@@ -0,0 +1,158 @@
+import threading
+
+import pytest
+
+from src.agents.document_processor import DocumentProcessor
+from src.utils.manifest import IngestManifest, hash_text
+from src.utils.metadata_filters import merge_sources
+from src.utils.streaming_pipeline import StreamingIngestionPipeline
+
+
+class RecordingStore:
+    """
+    Vector store stand-in that records the order of the writes
+    """
+    def __init__(self,events,fail_on_batch=None):
+        self.events = events
+        self.fail_on_batch = fail_on_batch
+        self.documents = {}
+        self.batches = 0
+
+    def make_document_id(self,chunk_hash):
+        return chunk_hash
+
+    def add_documents(self,documents,ids):
+        self.batches += 1
+        if self.batches == self.fail_on_batch:
+            raise RuntimeError("embeddings API down")
+        self.documents.update(zip(ids,documents))
+        self.events.append(("batch",set(ids)))
+
+    def add_sources(self,sources):
+        for id,files in sources.items():
+            self.documents[id].metadata = merge_sources(self.documents[id].metadata,files)
+
+    def delete_documents(self,ids):
+        for id in ids:
+            self.documents.pop(id,None)
+
+
+class RecordingManifest(IngestManifest):
+    def __init__(self,db_path,events):
+        super().__init__(db_path)
+        self.events = events
+
+    def update_file(self,file_path,content_hash,chunk_hashes):
+        self.events.append(("file",set(chunk_hashes)))
+        super().update_file(file_path,content_hash,chunk_hashes)
+
+
+def write_csv(path, years):
+    path.write_text("Year,Average expenditure\n" + "".join(f"{year},{year - 1000}\n" for year in years))
+
+def make_pipeline(tmp_path, events, batch_size=3, **store_args):
+    processor = DocumentProcessor(configs={"workers":1,"loader_engine":"pandas","chunk_size":1000,"chunk_overlap":10,"normalize_rows":True})
+    return StreamingIngestionPipeline(
+        processor=processor,
+        vector_store=RecordingStore(events,**store_args),
+        manifest=RecordingManifest(str(tmp_path / "manifest.sqlite"),events),
+        batch_size=batch_size
+    )
+
+
+def test_files_are_recorded_after_their_chunks_and_share_provenance(tmp_path):
+    folder = tmp_path / "csv"
+    folder.mkdir()
+    write_csv(folder / "a.csv",range(2000,2005))
+    write_csv(folder / "b.csv",range(2003,2010))
+    events = []
+    pipeline = make_pipeline(tmp_path,events)
+    stats = pipeline.run(dir_path=str(folder))
+    assert (stats["files"],stats["chunks"]) == (2,10)
+
+    written = set()
+    for kind,hashes in events:
+        if kind == "batch":
+            written |= hashes
+        else:
+            # a file is recorded only once all of its chunks are written
+            assert hashes <= written
+    # the rows both files contain list both, like deduplicate_documents does
+    shared = [doc for doc in pipeline.vector_store.documents.values() if doc.metadata["year_min"] in (2003,2004)]
+    assert [doc.metadata["source_files"] for doc in shared] == [["a.csv","b.csv"]] * 2
+
+    # a.csv is gone: only the chunks no other file references are deleted
+    (folder / "a.csv").unlink()
+    stats = StreamingIngestionPipeline(
+        processor=pipeline.processor,vector_store=pipeline.vector_store,manifest=pipeline.manifest,batch_size=3
+    ).run(dir_path=str(folder))
+    assert (stats["removed_files"],stats["deleted"]) == (1,3)
+    assert sorted(doc.metadata["year_min"] for doc in pipeline.vector_store.documents.values()) == list(range(2003,2010))
+
+
+def test_writer_errors_stop_the_run_before_the_manifest_is_updated(tmp_path):
+    folder = tmp_path / "csv"
+    folder.mkdir()
+    write_csv(folder / "a.csv",range(2000,2005))
+    events = []
+    pipeline = make_pipeline(tmp_path,events,fail_on_batch=2)
+    with pytest.raises(RuntimeError,match="embeddings API down"):
+        pipeline.run(dir_path=str(folder))
+    # the file is not recorded, the next run embeds it again
+    assert pipeline.manifest.get_files() == []
+    assert all(kind == "batch" for kind,_ in events)
+
+
+def test_producer_waits_for_a_slow_writer(tmp_path):
+    events = []
+    pipeline = make_pipeline(tmp_path,events)
+    pipeline.queue.maxsize = 1
+    release = threading.Event()
+    add_documents = pipeline.vector_store.add_documents
+    def slow_add_documents(documents,ids):
+        release.wait(5)
+        add_documents(documents,ids)
+    pipeline.vector_store.add_documents = slow_add_documents
+
+    produced = []
+    def items():
+        for i in range(10):
+            produced.append(i)
+            yield ("batch",[],[hash_text(str(i))])
+    writer = threading.Thread(target=pipeline.write,args=(items(),str(tmp_path)))
+    writer.start()
+    writer.join(0.5)
+    # one batch on the writer, one in the queue, one waiting to be put
+    assert len(produced) == 3
+    release.set()
+    writer.join(5)
+    assert len(produced) == 10 and pipeline.stats["batches"] == 10
+
+
+def test_staged_items_are_written_from_the_artifact(tmp_path):
+    from src.utils.artifact_store import ArtifactStore
+    folder = tmp_path / "csv"
+    folder.mkdir()
+    write_csv(folder / "a.csv",range(2000,2005))
+    write_csv(folder / "b.csv",range(2003,2010))
+    # a small budget: the artifact is spilled to a file
+    artifacts = ArtifactStore(path=str(tmp_path / "artifacts"),max_memory_bytes=500)
+    events = []
+    stager = make_pipeline(tmp_path,events)
+    handle = stager.stage(dir_path=str(folder),artifacts=artifacts)
+    # nothing is written while staging
+    assert events == [] and stager.manifest.get_files() == []
+
+    writer = StreamingIngestionPipeline(processor=None,vector_store=stager.vector_store,manifest=stager.manifest,batch_size=3)
+    stats = writer.write_artifact(handle=handle,artifacts=artifacts)
+    assert (stats["files"],stats["chunks"]) == (2,10) and not artifacts.exists(handle)
+    documents = stager.vector_store.documents
+    assert sorted(doc.metadata["year_min"] for doc in documents.values()) == list(range(2000,2010))
+    assert [doc.metadata["source_files"] for doc in documents.values() if doc.metadata["year_min"] == 2004] == [["a.csv","b.csv"]]
+
+    # b.csv changed: its dropped rows travel through the artifact as chunks to delete
+    write_csv(folder / "b.csv",range(2003,2006))
+    handle = make_pipeline(tmp_path,[]).stage(dir_path=str(folder),artifacts=artifacts)
+    stats = writer.write_artifact(handle=handle,artifacts=artifacts)
+    assert stats["deleted"] == 4
+    assert sorted(doc.metadata["year_min"] for doc in documents.values()) == list(range(2000,2006))
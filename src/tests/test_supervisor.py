@@ -0,0 +1,16 @@
+from langchain_core.messages import HumanMessage
+
+
+def test_rules_route_the_pipeline_without_the_llm(monkeypatch):
+    monkeypatch.setenv("ANTHROPIC_API_KEY","sk-test")
+    from src.agents.supervisor import route_from_state, supervisor_node
+
+    request = HumanMessage(content="Process the csv files, then answer the question")
+    assert route_from_state({"messages":[request],"dir_path":"data/csv","query":"trends"}) == "document_processor"
+    assert route_from_state({"messages":[request],"query":"trends"}) == "analysis"
+    assert route_from_state({"messages":[request,HumanMessage(content="saved",name="document_processor")]}) == "vector_store"
+    assert route_from_state({"messages":[request,HumanMessage(content="stored",name="vector_store")]}) == "analysis"
+    assert route_from_state({"messages":[request],"answer":"costs rose 3%"}) == "FINISH"
+    # nothing to go on: the LLM decides
+    assert route_from_state({"messages":[request]}) is None
+    assert supervisor_node({"messages":[request],"answer":"costs rose 3%"}).goto == "__end__"
@@ -0,0 +1,50 @@
+from types import SimpleNamespace
+
+import pytest
+
+from src.agents.vector_store import VectorStore
+from src.utils.vector_index import (
+    build_create_index_sql, build_maintenance_work_mem_sql, choose_index_strategy, get_ivfflat_lists, parse_index_definition
+)
+
+
+def test_index_strategy_follows_collection_size():
+    configs = {"strategy":"auto","min_rows":10000,"ivfflat_min_rows":5000000}
+    assert choose_index_strategy(500,configs) is None
+    assert choose_index_strategy(50000,configs) == "hnsw"
+    assert choose_index_strategy(8000000,configs) == "ivfflat"
+    assert choose_index_strategy(500,{"strategy":"ivfflat"}) == "ivfflat"
+    assert get_ivfflat_lists(50000) == 50
+    assert get_ivfflat_lists(4000000) == 2000
+
+
+def test_index_is_partial_expression_index():
+    sql = build_create_index_sql("0cc74f86-9f4e-57da-99d3-d7ccac5bd3bd",1536,"hnsw",m=24,ef_construction=128)
+    assert "USING hnsw ((embedding::vector(1536)) vector_cosine_ops)" in sql
+    assert "WITH (m = 24, ef_construction = 128)" in sql
+    assert sql.endswith("WHERE collection_id = '0cc74f86-9f4e-57da-99d3-d7ccac5bd3bd'")
+
+
+def test_quantized_index_expression():
+    sql = build_create_index_sql("0cc74f86-9f4e-57da-99d3-d7ccac5bd3bd",256,"hnsw",quantization="binary")
+    assert "USING hnsw ((binary_quantize(embedding)::bit(256)) bit_hamming_ops)" in sql
+    definition = "USING hnsw (((embedding)::halfvec(512)) halfvec_cosine_ops) WITH (m='16')"
+    assert parse_index_definition(definition) == (512,"float16")
+
+
+def test_maintenance_work_mem_must_be_a_size():
+    assert build_maintenance_work_mem_sql("2GB") == "SET LOCAL maintenance_work_mem = '2GB'"
+    assert build_maintenance_work_mem_sql(65536) == "SET LOCAL maintenance_work_mem = '65536'"
+    for value in ("1GB'; DROP TABLE langchain_pg_embedding; --","lots","2 GiB"):
+        with pytest.raises(ValueError):
+            build_maintenance_work_mem_sql(value)
+
+
+def test_quantized_index_needs_pgvector_0_7():
+    store = SimpleNamespace(configs={"quantization":{"type":"binary"}},get_pgvector_version=lambda: (0,6,2))
+    assert VectorStore.get_index_quantization(store) == "float32"
+    store.get_pgvector_version = lambda: (0,7,0)
+    assert VectorStore.get_index_quantization(store) == "binary"
+    # no pgvector type for int8
+    store.configs = {"quantization":{"type":"int8"}}
+    assert VectorStore.get_index_quantization(store) == "float32"
@@ -0,0 +1,67 @@
+from datetime import datetime
+import argparse
+
+# project imports
+from src.utils.utils import get_project_filepath, get_list_of_files_in_directory
+from src.utils.csv_loaders import CSV_ENGINES
+
+
+def benchmark_engine(engine:str,file_paths:list[str],repeats:int=5) -> dict:
+    """
+    Time one csv engine over a list of files
+
+    Args:
+        engine: name of the engine in CSV_ENGINES
+        file_paths: files to load
+        repeats: number of passes over the files
+
+    Returns:
+        stats(dict): files/sec, documents produced and total seconds
+    """
+    loader = CSV_ENGINES[engine]
+    # warm up imports so they are not counted in the timings
+    loader(file_paths[0])
+    documents = 0
+    start = datetime.now()
+    for _ in range(repeats):
+        for file_path in file_paths:
+            documents += len(loader(file_path))
+    seconds = (datetime.now() - start).total_seconds()
+    return {
+        "engine":engine,
+        "files_per_sec":round(len(file_paths)*repeats/seconds,1),
+        "documents_per_file":round(documents/(len(file_paths)*repeats),1),
+        "seconds":round(seconds,3),
+    }
+
+def run_benchmark(dir_path:str,repeats:int=5) -> list[dict]:
+    """
+    Compare every csv engine on the files of a folder
+
+    Args:
+        dir_path: folder with csv files
+        repeats: number of passes over the files
+
+    Returns:
+        results(list): stats per engine
+    """
+    files = [x for x in get_list_of_files_in_directory(dir_path=dir_path) if '.csv' in x.lower()]
+    file_paths = [f'{dir_path}/{file}' for file in files]
+    results = []
+    for engine in CSV_ENGINES:
+        try:
+            results.append(benchmark_engine(engine=engine,file_paths=file_paths,repeats=repeats))
+        except Exception as e:
+            print(f'{engine}: skipped ({e})')
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare csv loader engines')
+    parser.add_argument('--path', type=str, default=f'{get_project_filepath()}/data/csv', help='Folder with csv files')
+    parser.add_argument('--repeats', type=int, default=5, help='Passes over the folder')
+    args = parser.parse_args()
+
+    print('| engine | files/sec | documents/file | seconds |')
+    print('|---|---|---|---|')
+    for result in run_benchmark(dir_path=args.path,repeats=args.repeats):
+        print(f'| {result["engine"]} | {result["files_per_sec"]} | {result["documents_per_file"]} | {result["seconds"]} |')
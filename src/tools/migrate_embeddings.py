@@ -0,0 +1,113 @@
+from datetime import datetime
+import argparse
+import itertools
+import json
+import tempfile
+import numpy as np
+
+# project imports
+from src.utils.utils import get_project_filepath
+from src.utils.store_registry import get_vector_store
+from src.utils.local_embeddings import get_embeddings_provider
+from src.utils.quantization import QUANTIZATIONS, QuantizedMatrix, get_bytes_per_vector, truncate_embeddings
+
+
+def evaluate_format(corpus:np.ndarray,queries:np.ndarray,truth:np.ndarray,dimensions:int,quantization:str,k:int=10) -> dict:
+    """
+    Recall of one storage format against exact float32 search
+
+    Args:
+        corpus: unit-length float32 vectors
+        queries: unit-length float32 query vectors
+        truth: exact top-k rows of each query
+        dimensions: dimensions kept (Matryoshka)
+        quantization: one of QUANTIZATIONS
+        k: number of results
+
+    Returns:
+        stats(dict): recall@k, bytes per vector, compression and milliseconds per query
+    """
+    with tempfile.TemporaryDirectory() as path:
+        matrix = QuantizedMatrix(path=path,dimensions=dimensions,quantization=quantization)
+        matrix.append(truncate_embeddings(corpus,dimensions))
+        matrix.open(len(corpus))
+        queries = truncate_embeddings(queries,dimensions)
+        start = datetime.now()
+        results = matrix.search(queries,k=k)
+        seconds = (datetime.now() - start).total_seconds()
+        recall = np.mean([len(set(rows) & set(expected)) / k for (rows,_),expected in zip(results,truth)])
+        matrix.arrays = []
+    return {
+        "dimensions":dimensions,
+        "quantization":quantization,
+        "recall":round(float(recall),3),
+        "bytes_per_vector":get_bytes_per_vector(quantization,dimensions),
+        "compression":round(get_bytes_per_vector("float32",corpus.shape[1]) / get_bytes_per_vector(quantization,dimensions),1),
+        "ms_per_query":round(1000 * seconds / len(queries),2),
+    }
+
+def evaluate(vectors:np.ndarray,dimensions:list[int],quantizations:list[str],k:int=10,queries:int=100) -> list[dict]:
+    """
+    Compare storage formats on a sample of the collection: the first vectors are
+    the queries, the others the corpus, ground truth is exact float32 search
+
+    Args:
+        vectors: sample of the stored embeddings
+        dimensions: dimensions to try, values above the stored ones are skipped
+        quantizations: formats to try
+        k: number of results
+        queries: number of held-out query vectors
+
+    Returns:
+        results(list): stats per (dimensions, quantization)
+    """
+    vectors = truncate_embeddings(vectors,None)
+    queries,corpus = vectors[:queries],vectors[queries:]
+    truth = [np.argsort(-scores)[:k] for scores in (corpus @ queries.T).T]
+    return [
+        evaluate_format(corpus=corpus,queries=queries,truth=truth,dimensions=d,quantization=q,k=k)
+        for d in sorted({min(d,vectors.shape[1]) for d in dimensions},reverse=True)
+        for q in quantizations
+    ]
+
+def update_config(dimensions:int,quantization:str) -> None:
+    """
+    Embed queries with the new dimensions and store new vectors in the new format
+    """
+    filepath = f'{get_project_filepath()}/src/config/config.json'
+    with open(filepath,'r') as file:
+        configs = json.load(file)
+    if dimensions:
+        configs["embeddings"]["dimensions"] = dimensions
+    if quantization:
+        configs["vector_store"].setdefault("quantization",{})["type"] = quantization
+    with open(filepath,'w') as file:
+        file.write(json.dumps(configs,indent=4))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Measure and migrate the storage format of the stored embeddings')
+    parser.add_argument('--migrate', action='store_true', help='Rewrite the collection, only measure otherwise')
+    parser.add_argument('--dimensions', type=int, default=None, help='Keep the first dimensions (Matryoshka)')
+    parser.add_argument('--quantization', type=str, default=None, choices=QUANTIZATIONS, help='Storage format')
+    parser.add_argument('--sample', type=int, default=5000, help='Vectors used to measure recall')
+    parser.add_argument('--queries', type=int, default=100, help='Held-out query vectors')
+    parser.add_argument('--k', type=int, default=10, help='Results per query')
+    args = parser.parse_args()
+
+    store = get_vector_store()
+    sample = [embedding for _,embedding in itertools.islice(store.iter_embeddings(),args.sample)]
+    if len(sample) > args.queries:
+        print('| dimensions | quantization | recall@k | bytes/vector | compression | ms/query |')
+        print('|---|---|---|---|---|---|')
+        for result in evaluate(
+                np.stack(sample),
+                dimensions=[args.dimensions] if args.dimensions else [len(sample[0]),512,256],
+                quantizations=[args.quantization] if args.quantization else list(QUANTIZATIONS),
+                k=args.k,
+                queries=args.queries):
+            print(f'| {result["dimensions"]} | {result["quantization"]} | {result["recall"]} | {result["bytes_per_vector"]} | {result["compression"]}x | {result["ms_per_query"]} |')
+    if args.migrate:
+        if args.dimensions and get_embeddings_provider() == "hashing":
+            raise SystemExit('hashing embeddings are not Matryoshka embeddings, change hashing_dimensions and re-ingest instead')
+        print(store.migrate_embeddings(dimensions=args.dimensions,quantization=args.quantization))
+        update_config(dimensions=args.dimensions,quantization=args.quantization)
@@ -4,12 +4,18 @@ from typing import TypedDict, Annotated, List, Any
 from typing_extensions import TypedDict,Sequence
 import operator
 
+from src.utils.message_history import add_messages_bounded
+
 
 class AgentState(TypedDict):
-    messages: Annotated[List[BaseMessage], operator.add]
+    # appended like operator.add, then kept within the 'message_history' token budget
+    messages: Annotated[List[BaseMessage], add_messages_bounded]
     dir_path:str = None
     documents:Any = None
     answer:Any = None
     query:str = None
+    # failed writes of the documents handle, the run stops with 'error' at the limit
+    write_attempts:int = 0
+    error:str = None
     next: str 
     
@@ -0,0 +1,143 @@
+import os
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, List, Optional
+import numpy as np
+from loguru import logger
+
+# project imports
+from src.utils.utils import get_project_filepath, load_config_params_for_node
+
+
+class AnswerCache:
+    """
+    Disk-backed cache of analysis answers keyed by the query embedding: a question
+    whose embedding is within similarity_threshold (cosine) of a cached one gets the
+    cached answer. Entries belong to a version of the collection (see
+    VectorStore.get_collection_version), answers of older versions are never
+    returned and are dropped as soon as a newer version is cached
+    """
+    def __init__(self,db_path:str,similarity_threshold:float=0.95,max_entries:int=1000):
+        """
+        Args:
+            db_path: location of the sqlite file
+            similarity_threshold: minimum cosine similarity of a hit
+            max_entries: entries kept per collection, the oldest are evicted first
+        """
+        self.db_path = db_path
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries
+        os.makedirs(os.path.dirname(db_path),exist_ok=True)
+        self._lock = threading.Lock()
+        self.stats = {"hits":0,"misses":0,"writes":0}
+        self.connection = sqlite3.connect(db_path,check_same_thread=False)
+        with self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                """CREATE TABLE IF NOT EXISTS answers (
+                    collection TEXT NOT NULL,
+                    version TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    query TEXT NOT NULL,
+                    embedding BLOB NOT NULL,
+                    answer TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )"""
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS ix_answers_key ON answers(collection, version, model)")
+
+    def get(self,collection:str,version:str,model:str,embedding:List[float]) -> Optional[dict]:
+        """
+        Cached answer of the most similar question, if it is similar enough
+
+        Args:
+            collection: vector store collection name
+            version: current version of the collection
+            model: embedding model of the query embedding
+            embedding: query embedding
+
+        Returns:
+            entry(dict): 'query', 'answer' and 'similarity', None on a miss
+        """
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT query, embedding, answer FROM answers WHERE collection = ? AND version = ? AND model = ?",
+                (collection,version,model)
+            ).fetchall()
+        best = None
+        if rows:
+            query = np.asarray(embedding,dtype=np.float32)
+            vectors = np.stack([np.frombuffer(row[1],dtype=np.float32) for row in rows])
+            similarities = vectors @ query / np.maximum(np.linalg.norm(vectors,axis=1) * np.linalg.norm(query),1e-12)
+            i = int(np.argmax(similarities))
+            if similarities[i] >= self.similarity_threshold:
+                best = {"query":rows[i][0],"answer":json.loads(rows[i][2]),"similarity":float(similarities[i])}
+        with self._lock:
+            self.stats["hits" if best else "misses"] += 1
+        return best
+
+    def put(self,collection:str,version:str,model:str,query:str,embedding:List[float],answer:Any) -> None:
+        """
+        Cache an answer and drop the answers of other versions of the collection
+
+        Args:
+            collection: vector store collection name
+            version: version of the collection the answer was computed on
+            model: embedding model of the query embedding
+            query: question
+            embedding: query embedding
+            answer: JSON-serialisable answer
+        """
+        with self._lock, self.connection:
+            self.connection.execute("DELETE FROM answers WHERE collection = ? AND version != ?",(collection,version))
+            self.connection.execute(
+                "INSERT INTO answers (collection, version, model, query, embedding, answer, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (collection,version,model,query,np.asarray(embedding,dtype=np.float32).tobytes(),json.dumps(answer),time.time())
+            )
+            self.stats["writes"] += 1
+            if self.max_entries:
+                self.connection.execute(
+                    "DELETE FROM answers WHERE collection = ? AND rowid NOT IN "
+                    "(SELECT rowid FROM answers WHERE collection = ? ORDER BY created_at DESC LIMIT ?)",
+                    (collection,collection,self.max_entries)
+                )
+
+    def size(self) -> int:
+        """
+        Number of cached answers
+        """
+        return self.connection.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+
+    def clear(self) -> None:
+        """
+        Drop every cached answer
+        """
+        with self._lock, self.connection:
+            self.connection.execute("DELETE FROM answers")
+
+
+_caches:dict[str,AnswerCache] = {}
+_caches_lock = threading.Lock()
+
+def get_answer_cache() -> Optional[AnswerCache]:
+    """
+    Process-wide AnswerCache from the 'answer_cache' config, None if disabled
+
+    Returns:
+        cache(AnswerCache)
+    """
+    configs = load_config_params_for_node("answer_cache") or {}
+    if not configs.get("enabled",True):
+        return None
+    db_path = f'{get_project_filepath()}/{configs.get("path","data/answer_cache/answers.sqlite")}'
+    with _caches_lock:
+        if db_path not in _caches:
+            _caches[db_path] = AnswerCache(
+                db_path=db_path,
+                similarity_threshold=configs.get("similarity_threshold",0.95),
+                max_entries=configs.get("max_entries",1000)
+            )
+            logger.info(f'answer cache at {db_path}')
+        return _caches[db_path]
@@ -0,0 +1,159 @@
+import os
+import re
+import json
+import uuid
+import threading
+from typing import Any, Iterable, Iterator, Optional
+from loguru import logger
+
+from src.utils.utils import get_project_filepath, load_config_params_for_node
+
+# graph nodes pass 'artifact:<hex>' instead of the data, the LLM only repeats the handle
+HANDLE_PATTERN = re.compile(r"artifact:[0-9a-f]{32}")
+
+
+def is_artifact_handle(value:Any) -> bool:
+    return isinstance(value,str) and HANDLE_PATTERN.fullmatch(value.strip()) is not None
+
+def find_artifact_handle(text:str) -> Optional[str]:
+    """
+    First artifact handle in a text (e.g. a tool reply), None if there is none
+    """
+    match = HANDLE_PATTERN.search(text or "")
+    return match.group(0) if match else None
+
+
+class ArtifactStore:
+    """
+    Records (JSON-serialisable dicts) handed from one graph node to the next. An
+    artifact is kept in memory as JSON lines and moved to a file once the store holds
+    more than max_memory_bytes, so large folders don't stay in RAM. Records are
+    streamed back in order and the artifact is deleted once consumed
+    """
+    def __init__(self,path:str,max_memory_bytes:int=64 << 20):
+        """
+        Args:
+            path: folder of the spilled artifacts
+            max_memory_bytes: in-memory budget of all artifacts together
+        """
+        self.path = path
+        self.max_memory_bytes = max_memory_bytes
+        self._lines:dict[str,list[str]] = {}
+        self._metadata:dict[str,dict] = {}
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    def get_file_path(self,handle:str) -> str:
+        return f'{self.path}/{handle.split(":",1)[1]}.jsonl'
+
+    def _spill(self,handle:str) -> None:
+        """
+        Move the in-memory lines of an artifact to its file
+        """
+        lines = self._lines.pop(handle,[])
+        os.makedirs(self.path,exist_ok=True)
+        with open(self.get_file_path(handle),'a') as f:
+            f.writelines(lines)
+        self._nbytes -= sum(len(line) for line in lines)
+        logger.info(f'artifact {handle} spilled to disk')
+
+    def put(self,records:Iterable[dict],metadata:dict=None) -> str:
+        """
+        Store records, can be a generator
+
+        Args:
+            records: JSON-serialisable dicts
+            metadata: small dict returned by get_metadata
+
+        Returns:
+            handle(str): 'artifact:<hex>'
+        """
+        handle = f'artifact:{uuid.uuid4().hex}'
+        with self._lock:
+            self._lines[handle] = []
+            self._metadata[handle] = {**(metadata or {}),"records":0}
+        for record in records:
+            line = json.dumps(record) + "\n"
+            with self._lock:
+                self._metadata[handle]["records"] += 1
+                if handle in self._lines:
+                    self._lines[handle].append(line)
+                    self._nbytes += len(line)
+                    if self._nbytes > self.max_memory_bytes:
+                        self._spill(handle)
+                    continue
+            with open(self.get_file_path(handle),'a') as f:
+                f.write(line)
+        logger.info(f'artifact {handle}: {self._metadata[handle]}')
+        return handle
+
+    def get_metadata(self,handle:str) -> dict:
+        """
+        Metadata of an artifact and its number of records, KeyError if unknown
+        """
+        with self._lock:
+            return dict(self._metadata[handle])
+
+    def exists(self,handle:str) -> bool:
+        """
+        Whether an artifact is stored (not consumed yet)
+        """
+        with self._lock:
+            return handle in self._metadata
+
+    def iter(self,handle:str) -> Iterator[dict]:
+        """
+        Stream the records of an artifact in the order they were put
+
+        Yields:
+            record(dict)
+        """
+        with self._lock:
+            if handle not in self._metadata:
+                raise KeyError(f'unknown artifact {handle}')
+            lines = self._lines.get(handle)
+        if lines is not None:
+            for line in lines:
+                yield json.loads(line)
+            return
+        with open(self.get_file_path(handle),'r') as f:
+            for line in f:
+                yield json.loads(line)
+
+    def delete(self,handle:str) -> None:
+        """
+        Forget an artifact and remove its file
+        """
+        with self._lock:
+            self._nbytes -= sum(len(line) for line in self._lines.pop(handle,[]))
+            self._metadata.pop(handle,None)
+        if os.path.exists(self.get_file_path(handle)):
+            os.remove(self.get_file_path(handle))
+
+    def get_nbytes(self) -> int:
+        """
+        Bytes held in memory
+        """
+        with self._lock:
+            return self._nbytes
+
+
+_artifact_store = None
+_artifact_store_lock = threading.Lock()
+
+def get_artifact_store() -> ArtifactStore:
+    """
+    Process-wide ArtifactStore from the 'artifacts' config, created on first use
+
+    Returns:
+        store(ArtifactStore)
+    """
+    global _artifact_store
+    with _artifact_store_lock:
+        if _artifact_store is None:
+            configs = load_config_params_for_node("artifacts") or {}
+            _artifact_store = ArtifactStore(
+                path=f'{get_project_filepath()}/{configs.get("path","data/artifacts")}',
+                max_memory_bytes=configs.get("max_memory_mb",64) << 20
+            )
+        return _artifact_store
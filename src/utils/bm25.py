@@ -0,0 +1,228 @@
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter
+from typing import Iterable, List, Tuple
+from langchain_core.documents import Document
+from loguru import logger
+
+# project imports
+from src.utils.metadata_filters import matches_filter
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:\.[0-9]+)?")
+
+
+def tokenize(text:str) -> List[str]:
+    """
+    Lowercase word and number tokens ('2009', '1050.12'), the unit of the lexical index
+    """
+    return TOKEN_PATTERN.findall((text or "").lower())
+
+def reciprocal_rank_fusion(result_lists:List[List[Tuple[Document,float]]],k:int=60) -> List[Tuple[Document,float]]:
+    """
+    Merge ranked lists with reciprocal rank fusion: a document scores sum(1/(k + rank))
+    over the lists it appears in, so only ranks matter and BM25 scores and cosine
+    distances don't need to be comparable
+
+    Args:
+        result_lists: ranked lists of (document, score), documents are matched by id
+        k: rank offset, larger values flatten the contribution of the top ranks
+
+    Returns:
+        fused(list): (document, fused score), best first
+    """
+    scores,documents = {},{}
+    for results in result_lists:
+        for rank,(document,_) in enumerate(results,start=1):
+            key = document.id or document.page_content
+            scores[key] = scores.get(key,0.0) + 1.0 / (k + rank)
+            documents.setdefault(key,document)
+    return [(documents[key],score) for key,score in sorted(scores.items(),key=lambda item: item[1],reverse=True)]
+
+
+class BM25Index:
+    """
+    Persistent BM25 inverted index over chunk text (SQLite): postings per term and
+    the length, text and metadata of every chunk, maintained by the vector store on
+    each write so exact-token questions ('average expenditure in 2009') can be
+    answered lexically. The version of the collection rows the index matches is
+    kept with it, so a stale index (writes it missed) can be detected and rebuilt
+    """
+    def __init__(self,db_path:str,k1:float=1.5,b:float=0.75):
+        """
+        Args:
+            db_path: location of the sqlite file
+            k1: term frequency saturation
+            b: document length normalization
+        """
+        self.db_path = db_path
+        self.k1 = k1
+        self.b = b
+        os.makedirs(os.path.dirname(db_path),exist_ok=True)
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(db_path,check_same_thread=False)
+        with self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                """CREATE TABLE IF NOT EXISTS docs (
+                    doc_id TEXT PRIMARY KEY,
+                    length INTEGER NOT NULL,
+                    document TEXT NOT NULL,
+                    metadata TEXT NOT NULL
+                )"""
+            )
+            self.connection.execute(
+                """CREATE TABLE IF NOT EXISTS postings (
+                    term TEXT NOT NULL,
+                    doc_id TEXT NOT NULL,
+                    tf INTEGER NOT NULL,
+                    PRIMARY KEY (term, doc_id)
+                ) WITHOUT ROWID"""
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS ix_postings_doc ON postings(doc_id)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    def add(self,documents:Iterable[Tuple[str,Document]]) -> None:
+        """
+        Index documents, an existing id is replaced
+
+        Args:
+            documents: (id, document) pairs
+        """
+        documents = list(documents)
+        if not documents:
+            return
+        with self._lock, self.connection:
+            self._remove([id for id,_ in documents])
+            for id,document in documents:
+                terms = Counter(tokenize(document.page_content))
+                self.connection.execute(
+                    "INSERT INTO docs (doc_id, length, document, metadata) VALUES (?, ?, ?, ?)",
+                    (id,sum(terms.values()),document.page_content,json.dumps(document.metadata or {}))
+                )
+                self.connection.executemany(
+                    "INSERT INTO postings (term, doc_id, tf) VALUES (?, ?, ?)",
+                    [(term,id,tf) for term,tf in terms.items()]
+                )
+
+    def update_metadata(self,items:Iterable[Tuple[str,dict]]) -> None:
+        """
+        Replace the metadata of indexed documents, e.g. after they were found in more files
+
+        Args:
+            items: (id, metadata) pairs
+        """
+        items = list(items)
+        if items:
+            with self._lock, self.connection:
+                self.connection.executemany(
+                    "UPDATE docs SET metadata = ? WHERE doc_id = ?",
+                    [(json.dumps(metadata or {}),id) for id,metadata in items]
+                )
+
+    def _remove(self,ids:List[str]) -> None:
+        for start in range(0,len(ids),500):
+            batch = ids[start:start+500]
+            placeholders = ','.join('?'*len(batch))
+            self.connection.execute(f"DELETE FROM postings WHERE doc_id IN ({placeholders})",batch)
+            self.connection.execute(f"DELETE FROM docs WHERE doc_id IN ({placeholders})",batch)
+
+    def remove(self,ids:Iterable[str]) -> None:
+        """
+        Drop documents from the index
+        """
+        ids = list(ids)
+        if ids:
+            with self._lock, self.connection:
+                self._remove(ids)
+
+    def clear(self) -> None:
+        """
+        Drop every document
+        """
+        with self._lock, self.connection:
+            self.connection.execute("DELETE FROM postings")
+            self.connection.execute("DELETE FROM docs")
+            self.connection.execute("DELETE FROM meta WHERE key = 'version'")
+
+    def get_version(self) -> str:
+        """
+        Version of the collection rows the index was last synced with, None if unknown
+        """
+        row = self.connection.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        return row[0] if row else None
+
+    def set_version(self,version:str) -> None:
+        """
+        Record the version of the collection rows the index now matches
+        """
+        with self._lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('version', ?)",(version,))
+
+    def close(self) -> None:
+        """
+        Close the connection, e.g. before the index file is moved or deleted
+        """
+        with self._lock:
+            self.connection.close()
+
+    def size(self) -> int:
+        """
+        Number of indexed documents
+        """
+        return self.connection.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+    def search(self,query:str,k:int=20,filter:dict=None) -> List[Tuple[Document,float]]:
+        """
+        Top-k documents by BM25 score
+
+        Args:
+            query: search query
+            k: number of results
+            filter: metadata filter applied before the top k (see metadata_filters)
+
+        Returns:
+            results(list): (document, score), best first
+        """
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        with self._lock:
+            count,total_length = self.connection.execute("SELECT COUNT(*), COALESCE(SUM(length),0) FROM docs").fetchone()
+            if not count:
+                return []
+            average_length = total_length / count
+            scores = {}
+            for term in terms:
+                postings = self.connection.execute(
+                    "SELECT p.doc_id, p.tf, d.length FROM postings p JOIN docs d ON d.doc_id = p.doc_id WHERE p.term = ?",
+                    (term,)
+                ).fetchall()
+                if not postings:
+                    continue
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id,tf,length in postings:
+                    norm = tf + self.k1 * (1 - self.b + self.b * length / average_length)
+                    scores[doc_id] = scores.get(doc_id,0.0) + idf * tf * (self.k1 + 1) / norm
+            ranked = sorted(scores.items(),key=lambda item: item[1],reverse=True)
+            top,rows = [],{}
+            # fetch ranked matches until k of them pass the filter
+            for start in range(0,len(ranked),max(k,100)):
+                batch = ranked[start:start+max(k,100)]
+                for doc_id,document,metadata in self.connection.execute(
+                    f"SELECT doc_id, document, metadata FROM docs WHERE doc_id IN ({','.join('?'*len(batch))})",
+                    [doc_id for doc_id,_ in batch]
+                ).fetchall():
+                    rows[doc_id] = (document,metadata)
+                top += [(doc_id,score) for doc_id,score in batch if not filter or matches_filter(json.loads(rows[doc_id][1]),filter)]
+                if len(top) >= k:
+                    break
+            top = top[:k]
+        logger.info(f'bm25: {len(scores)} matches for {terms}')
+        return [
+            (Document(id=doc_id,page_content=rows[doc_id][0],metadata=json.loads(rows[doc_id][1])),score)
+            for doc_id,score in top
+        ]
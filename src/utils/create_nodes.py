@@ -1,25 +1,16 @@
-from langchain_core.messages import HumanMessage, SystemMessage, ToolMessage, RemoveMessage
-from langgraph.graph import StateGraph, START, END
+from langchain_core.messages import HumanMessage, ToolMessage
 from langgraph.prebuilt import create_react_agent
-from langchain_anthropic import ChatAnthropic
-from langgraph.graph import MessagesState, END
 from langgraph.types import Command
 from typing import Literal,Any
-from langchain_community.agent_toolkits.load_tools import load_tools
-from langchain_core.tools import tool
 from langchain.tools import Tool
 from loguru import logger
-from langchain_core.messages.base import message_to_dict, messages_to_dict
-from langchain.output_parsers import PydanticOutputParser, JsonOutputToolsParser
-from langchain.output_parsers.json import SimpleJsonOutputParser
-from langchain.prompts import PromptTemplate
-from langgraph.prebuilt import create_react_agent
-from langchain.chains.combine_documents import create_stuff_documents_chain
+import threading
 
 # helpers
 from src.utils.agent_state import AgentState
 from src.utils.prompt import Prompt
-from src.utils.utils import save_dict_to_json_file
+from src.utils.utils import save_dict_to_json_file, load_config_params_for_node
+from src.utils.artifact_store import find_artifact_handle, is_artifact_handle
 
 class CreateNode:
     """
@@ -27,10 +18,13 @@ class CreateNode:
     """
     def __init__(self,name:str, description:str, llm:Any,tool_function:Any,prompt:Prompt):
         self.name = name
-        self.tf = tool_function()
+        # the worker (database connections, chains) is built on the first tool call
+        self.tool_function = tool_function
+        self.tf = None
+        self._lock = threading.Lock()
         self.tools = [Tool(
             name=f"{self.name}_tool",
-            func=self.tf.run,
+            func=self.run_tool,
             description=description
         )]
         self.prompt = prompt()
@@ -42,6 +36,18 @@ class CreateNode:
         }
        
 
+    def get_tool_function(self) -> Any:
+        """
+        Worker behind the tool, created on first use
+        """
+        with self._lock:
+            if self.tf is None:
+                self.tf = self.tool_function()
+            return self.tf
+
+    def run_tool(self,tool_input:Any) -> Any:
+        return self.get_tool_function().run(tool_input)
+
     def node(self,state: AgentState) -> Command[Literal["supervisor"]]:  
         """
         Create nodes for langgraph graph construction
@@ -54,18 +60,48 @@ class CreateNode:
 
         """
         logger.warning(f'{self.name} .... state:{state}')
+        written = False
+        error = None
+        if self.name == "vector_store" and is_artifact_handle(state.get("documents")):
+            # the staged documents are written from the state, not from a handle the LLM repeats
+            try:
+                stats = self.get_tool_function().ingest_artifact(state["documents"].strip())
+                logger.info(f'vector_store: wrote {state["documents"]}:{stats}')
+                written = True
+            except Exception as e:
+                error = e
         response = self.agent.invoke(state)
         new_message = response['messages'][self.dct[self.name]].content
         logger.info(f'{self.name}...type={type(new_message)} response={new_message}')
+        update = {
+            "messages":[
+                HumanMessage(content=new_message,name=self.name)
+            ],
+        }
+        if self.name == "document_processor":
+            # the documents stay in the artifact store, the state only carries the handle
+            handles = [find_artifact_handle(message.content) for message in response['messages'] if isinstance(message,ToolMessage)]
+            update["documents"] = next((handle for handle in reversed(handles) if handle),None)
+        if self.name == "vector_store" and (written or not is_artifact_handle(state.get("documents"))):
+            update["documents"] = None
+            update["write_attempts"] = 0
+        if error is not None:
+            attempts = (state.get("write_attempts") or 0) + 1
+            max_attempts = (load_config_params_for_node("vector_store") or {}).get("max_write_attempts",3)
+            update["write_attempts"] = attempts
+            if attempts >= max_attempts:
+                # the handle is dropped so the supervisor finishes instead of routing back here
+                logger.error(f'vector_store: {state["documents"]} not written after {attempts} attempts:{error}')
+                update["documents"] = None
+                update["error"] = f'vector_store: documents not written after {attempts} attempts: {error}'
+            else:
+                logger.error(f'vector_store: {state["documents"]} not written, kept for a retry ({attempts}/{max_attempts}):{error}')
         if self.name == "analysis":
             save_dict_to_json_file({"analysis_node_response":new_message},'/tmp/analysis_node_response')
+            # the supervisor finishes once there is an answer
+            update["answer"] = new_message
         return Command(
-            update={
-                "messages":[
-                    HumanMessage(content=new_message,name=self.name)
-                ],
-                
-            },
+            update=update,
             goto='supervisor',
         )
     
\ No newline at end of file
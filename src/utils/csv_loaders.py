@@ -0,0 +1,185 @@
+import os
+import re
+from typing import Callable
+import pandas as pd
+from langchain_core.documents import Document
+from loguru import logger
+
+
+def normalize_value(value:str) -> str:
+    """
+    Canonical form of a cell: currency, thousands separators and percent signs are
+    dropped and numbers are written without trailing zeros ('$812.40' -> '812.4')
+
+    Args:
+        value: raw cell value
+
+    Returns:
+        value(str): normalized value
+    """
+    value = ' '.join(str(value).split())
+    number = value.replace('$','').replace(',','').replace('%','')
+    try:
+        return ('%f' % float(number)).rstrip('0').rstrip('.')
+    except ValueError:
+        return value
+
+def normalize_frame(df:pd.DataFrame) -> pd.DataFrame:
+    """
+    Normalize a table so rows from different files compare equal: whitespace in headers
+    is collapsed, pandas' '.1' suffixes are dropped, side-by-side blocks of the same
+    columns (Year, ..., Year.1, ...) are stacked into one long table and values are
+    normalized with normalize_value
+
+    Args:
+        df: dataframe with the csv contents as strings
+
+    Returns:
+        df(DataFrame): normalized dataframe
+    """
+    columns = [re.sub(r'\.\d+$','',' '.join(str(column).split())) for column in df.columns]
+    # a repeated column name starts a new side-by-side block
+    blocks,current,seen = [],[],set()
+    for idx,column in enumerate(columns):
+        if column in seen:
+            blocks.append(current)
+            current,seen = [],set()
+        current.append(idx)
+        seen.add(column)
+    blocks.append(current)
+    frames = []
+    for block in blocks:
+        frame = df.iloc[:,block].copy()
+        frame.columns = [columns[idx] for idx in block]
+        frames.append(frame)
+    df = pd.concat(frames,ignore_index=True).fillna('').astype(str).map(normalize_value)
+    # drop empty rows left over by uneven blocks or blank lines
+    return df[(df != '').any(axis=1)].reset_index(drop=True)
+
+def _frame_to_documents(
+        df:pd.DataFrame,
+        file_path:str,
+        engine:str,
+        rows_per_document:int=1,
+        normalize:bool=False
+    ) -> list[Document]:
+    """
+    Convert a dataframe to documents, one per row group, with column metadata
+
+    Args:
+        df: dataframe with the csv contents as strings
+        file_path: path of the source file
+        engine: name of the engine that parsed the file
+        rows_per_document: number of rows packed into each document
+        normalize: normalize the table with normalize_frame first
+
+    Returns:
+        documents(list): Document objects
+    """
+    if normalize:
+        df = normalize_frame(df)
+    rows_per_document = max(int(rows_per_document or 1),1)
+    columns = [str(column).strip() for column in df.columns]
+    rows = [
+        ' | '.join(f'{column}: {value}' for column,value in zip(columns,row))
+        for row in df.fillna('').astype(str).itertuples(index=False,name=None)
+    ]
+    documents = []
+    for start in range(0,len(rows),rows_per_document):
+        end = min(start + rows_per_document,len(rows))
+        documents.append(Document(
+            page_content='\n'.join(rows[start:end]),
+            metadata={
+                "source":file_path,
+                "filename":os.path.basename(file_path),
+                "columns":columns,
+                "row_start":start,
+                "row_end":end - 1,
+                "loader_engine":engine,
+            }
+        ))
+    return documents
+
+def load_csv_with_unstructured(file_path:str,rows_per_document:int=1,normalize:bool=False) -> list[Document]:
+    """
+    Load csv with UnstructuredCSVLoader, the whole table becomes one document
+
+    Args:
+        file_path: Path to the file
+        rows_per_document: unused, kept for a common engine signature
+        normalize: unused, kept for a common engine signature
+
+    Returns:
+        documents(list): Document objects
+    """
+    from langchain_community.document_loaders import UnstructuredCSVLoader
+    return UnstructuredCSVLoader(file_path).load()
+
+def load_csv_with_pandas(file_path:str,rows_per_document:int=1,normalize:bool=False) -> list[Document]:
+    """
+    Load csv with pandas, using the multi-threaded pyarrow parser when it is installed
+
+    Args:
+        file_path: Path to the file
+        rows_per_document: number of rows packed into each document
+        normalize: normalize the table with normalize_frame
+
+    Returns:
+        documents(list): Document objects
+    """
+    try:
+        df = pd.read_csv(file_path,engine="pyarrow",dtype=str)
+    except ImportError:
+        df = pd.read_csv(file_path,dtype=str)
+    return _frame_to_documents(df,file_path=file_path,engine="pandas",rows_per_document=rows_per_document,normalize=normalize)
+
+def load_csv_with_pyarrow(file_path:str,rows_per_document:int=1,normalize:bool=False) -> list[Document]:
+    """
+    Load csv with pyarrow.csv (multi-threaded columnar reader)
+
+    Args:
+        file_path: Path to the file
+        rows_per_document: number of rows packed into each document
+        normalize: normalize the table with normalize_frame
+
+    Returns:
+        documents(list): Document objects
+    """
+    import pyarrow as pa
+    from pyarrow import csv as pa_csv
+    table = pa_csv.read_csv(file_path,read_options=pa_csv.ReadOptions(use_threads=True))
+    table = table.cast(pa.schema([(field.name,pa.string()) for field in table.schema]))
+    return _frame_to_documents(table.to_pandas(),file_path=file_path,engine="pyarrow",rows_per_document=rows_per_document,normalize=normalize)
+
+CSV_ENGINES:dict[str,Callable[...,list[Document]]] = {
+    "unstructured":load_csv_with_unstructured,
+    "pandas":load_csv_with_pandas,
+    "pyarrow":load_csv_with_pyarrow,
+}
+
+def load_csv_file(file_path:str,engine:str="unstructured",rows_per_document:int=1,normalize:bool=False) -> list[Document]:
+    """
+    Load a csv file with the selected engine, falling back to unstructured if it fails
+
+    Args:
+        file_path: Path to the file
+        engine: one of CSV_ENGINES
+        rows_per_document: number of rows packed into each document (native engines only)
+        normalize: normalize rows so duplicates across files compare equal (native engines only)
+
+    Returns:
+        documents(list): Document objects
+    """
+    loader = CSV_ENGINES.get(engine)
+    if loader is None:
+        logger.warning(f'Unknown csv engine {engine}, using unstructured')
+        loader = load_csv_with_unstructured
+    try:
+        return loader(file_path,rows_per_document=rows_per_document,normalize=normalize)
+    except FileNotFoundError:
+        raise
+    except Exception as e:
+        if loader is load_csv_with_unstructured:
+            raise
+        logger.warning(f'{engine} engine failed on {file_path} ({e}), falling back to unstructured')
+        return load_csv_with_unstructured(file_path)
@@ -0,0 +1,37 @@
+from langchain_core.documents import Document
+from loguru import logger
+
+
+def deduplicate_documents(documents:list[Document]) -> list[Document]:
+    """
+    Collapse documents with the same content (e.g. the same normalized row found in
+    several overlapping csv files) into one. The first occurrence is kept and the
+    files it was found in are listed in metadata['sources']
+
+    Args:
+        documents: loaded documents, in load order
+
+    Returns:
+        documents(list): unique documents, in order of first occurrence
+    """
+    unique = {}
+    for doc in documents:
+        key = ' '.join(doc.page_content.split())
+        source = doc.metadata.get("source")
+        if key not in unique:
+            metadata = dict(doc.metadata)
+            metadata["sources"] = list(metadata.get("sources",[source] if source else []))
+            if "source_files" in metadata:
+                metadata["source_files"] = list(metadata["source_files"])
+            unique[key] = Document(page_content=doc.page_content,metadata=metadata)
+        else:
+            sources = unique[key].metadata["sources"]
+            for src in doc.metadata.get("sources",[source]):
+                if src and src not in sources:
+                    sources.append(src)
+            # file names used by the source_file search filter
+            if "source_files" in doc.metadata:
+                source_files = unique[key].metadata.setdefault("source_files",[])
+                source_files += [f for f in doc.metadata["source_files"] if f not in source_files]
+    logger.info(f'deduplicated {len(documents)} documents to {len(unique)}')
+    return list(unique.values())
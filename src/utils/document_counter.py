@@ -0,0 +1,105 @@
+import threading
+import time
+from typing import Awaitable, Callable, Optional
+
+
+class DocumentCounter:
+    """
+    In-process document count per collection. Writers (add/delete/clear) keep the
+    count current, readers (e.g. the frontend timer) get the cached value and only
+    hit the database when there is no value yet or it is older than the ttl, which
+    covers writes made by other processes
+    """
+    def __init__(self,ttl:float=300):
+        """
+        Args:
+            ttl: seconds after which a cached count is reloaded, None to never reload
+        """
+        self.ttl = ttl
+        self._counts:dict[str,tuple[int,float]] = {}
+        self._lock = threading.Lock()
+
+    def get(self,collection_name:str,loader:Callable[[],int]) -> int:
+        """
+        Cached count of a collection, loaded with loader() when missing or expired
+
+        Args:
+            collection_name: name of the collection
+            loader: function returning the count from the database
+
+        Returns:
+            count(int)
+        """
+        cached = self.peek(collection_name)
+        if cached is not None:
+            return cached
+        count = loader()
+        self.set(collection_name,count)
+        return count
+
+    async def aget(self,collection_name:str,loader:Callable[[],Awaitable[int]]) -> int:
+        """
+        Async get: the count is loaded with await loader() when missing or expired
+        """
+        cached = self.peek(collection_name)
+        if cached is not None:
+            return cached
+        count = await loader()
+        self.set(collection_name,count)
+        return count
+
+    def peek(self,collection_name:str) -> Optional[int]:
+        """
+        Cached count of a collection, None when missing or expired
+        """
+        with self._lock:
+            cached = self._counts.get(collection_name)
+        if cached is not None and (self.ttl is None or time.monotonic() - cached[1] < self.ttl):
+            return cached[0]
+        return None
+
+    def set(self,collection_name:str,count:int) -> None:
+        """
+        Store the count of a collection
+        """
+        with self._lock:
+            self._counts[collection_name] = (max(int(count),0),time.monotonic())
+
+    def increment(self,collection_name:str,delta:int) -> None:
+        """
+        Adjust a cached count by delta (negative for deletes), no-op if nothing is cached
+        """
+        with self._lock:
+            if collection_name in self._counts:
+                count,loaded_at = self._counts[collection_name]
+                self._counts[collection_name] = (max(count + delta,0),loaded_at)
+
+    def invalidate(self,collection_name:str=None) -> None:
+        """
+        Drop the cached count of a collection (all collections if None)
+        """
+        with self._lock:
+            if collection_name is None:
+                self._counts.clear()
+            else:
+                self._counts.pop(collection_name,None)
+
+
+_document_counter = None
+_document_counter_lock = threading.Lock()
+
+def get_document_counter(ttl:float=300) -> DocumentCounter:
+    """
+    Process-wide DocumentCounter, created on first use
+
+    Args:
+        ttl: reload interval used when the counter is created
+
+    Returns:
+        counter(DocumentCounter)
+    """
+    global _document_counter
+    with _document_counter_lock:
+        if _document_counter is None:
+            _document_counter = DocumentCounter(ttl=ttl)
+        return _document_counter
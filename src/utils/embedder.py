@@ -2,7 +2,6 @@ import openai
 import pandas as pd
 from pydantic import BaseModel
 from typing import Any
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from openai import OpenAI
 import os
 from functools import lru_cache
@@ -13,6 +12,13 @@ from langchain.embeddings.openai import OpenAIEmbeddings
 
 load_dotenv()
 
+# project imports
+from src.utils.embedding_cache import get_embedding_cache
+from src.utils.manifest import hash_text
+from src.utils.embedding_engine import EmbeddingEngine
+from src.utils.utils import load_config_params_for_node
+from src.utils.local_embeddings import get_embeddings_provider, get_local_embeddings
+
 
 class Embedder(BaseModel):
     model:str = "text-embedding-3-small"
@@ -23,6 +29,25 @@ class Embedder(BaseModel):
         'use_free_embedder':False,
     }
     openai_client:Any = None
+    local_embedder:Any = None
+    stats:dict = {}
+
+    def use_local_embedder(self) -> bool:
+        """
+        Embed locally (no API) when the use_free_embedder flag is set or the
+        'embeddings' config selects the hashing provider
+        """
+        if self.FLAGS.get('use_free_embedder') or get_embeddings_provider() == "hashing":
+            if self.local_embedder is None:
+                self.local_embedder = get_local_embeddings()
+            return True
+        return False
+
+    def get_dimensions(self) -> int:
+        """
+        Shortened (Matryoshka) embedding size from the 'embeddings' config, None for the model default
+        """
+        return (load_config_params_for_node("embeddings") or {}).get("dimensions")
 
     def initialize_openai_client(self) -> None:
         """
@@ -38,13 +63,26 @@ class Embedder(BaseModel):
         # Check for valid input
         if not text or not isinstance(text, str):
             return None
+        if self.use_local_embedder():
+            return self.local_embedder.embed_query(text)
         try:
+            cache = get_embedding_cache()
+            text_hash = hash_text(text)
+            if cache is not None:
+                cached = cache.get_many(self.model,self.get_dimensions() or 0,[text_hash])
+                if text_hash in cached:
+                    return cached[text_hash]
             # Call OpenAI API to get the embedding
+            kwargs = {"dimensions":self.get_dimensions()} if self.get_dimensions() else {}
             response = self.openai_client.embeddings.create(
                 input=text, 
                 model=self.model,
+                **kwargs
             )
-            return response.data[0].embedding
+            embedding = response.data[0].embedding
+            if cache is not None:
+                cache.put_many(self.model,self.get_dimensions() or 0,{text_hash:embedding})
+            return embedding
         except Exception as e:
             logger.error(f"Error in getting_embedding: {e}")
             
@@ -52,22 +90,40 @@ class Embedder(BaseModel):
     
     def threaded_embedder(self,documents:list[str]) -> list[list]:
         """
-        Generate embeddings using threading for speedup
+        Generate embeddings with batched, rate-limit-aware requests (EmbeddingEngine),
+        texts already in the embedding cache are not sent
         args:
-            documents(list): documents with metadata
+            documents(list): texts to embed
         return:
-            embeddings(list): list of embeddings
+            embeddings(list): list of embeddings in the order of documents, None where embedding failed
         """
+        if self.use_local_embedder():
+            texts = [doc for doc in documents if doc and isinstance(doc,str)]
+            embeddings = iter(self.local_embedder.embed_documents(texts))
+            return [next(embeddings) if doc and isinstance(doc,str) else None for doc in documents]
         self.initialize_openai_client()
-        futures,embeddings = [],[]
-        with ThreadPoolExecutor(max_workers=self.workers) as executor:
-            for doc in documents:
-                futures.append(executor.submit(self.get_embedding,doc))
-
-            for future in as_completed(futures):
-                embeddings.append(future.result())
-        
-        return embeddings
+        configs = load_config_params_for_node("embedding_engine") or {}
+        cache = get_embedding_cache()
+        text_hashes = [hash_text(doc) if doc and isinstance(doc,str) else None for doc in documents]
+        dimensions = self.get_dimensions()
+        found = cache.get_many(self.model,dimensions or 0,[h for h in text_hashes if h]) if cache is not None else {}
+        missing = list(dict.fromkeys(h for h in text_hashes if h and h not in found))
+        if missing:
+            texts = {h:doc for h,doc in zip(text_hashes,documents) if h}
+            engine = EmbeddingEngine(
+                client=self.openai_client,
+                model=self.model,
+                dimensions=dimensions,
+                concurrency=configs.get("concurrency",self.workers),
+                **{key:value for key,value in configs.items() if key != "concurrency"}
+            )
+            embeddings = engine.embed([texts[h] for h in missing])
+            new = {h:embedding for h,embedding in zip(missing,embeddings) if embedding is not None}
+            if cache is not None:
+                cache.put_many(self.model,dimensions or 0,new)
+            found.update(new)
+            self.stats = engine.stats
+        return [found.get(h) for h in text_hashes]
     
     def run(self, state: dict[str, Any]) -> dict[str, Any]:
         """
@@ -0,0 +1,251 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, List, Optional
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from loguru import logger
+
+# project imports
+from src.utils.manifest import hash_text
+from src.utils.utils import get_project_filepath, load_config_params_for_node
+
+
+class EmbeddingCache:
+    """
+    Disk-backed embedding cache keyed by (model, dimensions, sha256(text)), so an
+    identical text is embedded once per model no matter how many runs ask for it.
+    Vectors are stored as float32 blobs in SQLite. The cache is bounded to
+    max_entries, least recently used entries are evicted first. The number of
+    entries is kept in a meta row, updated in the transaction of every write, so
+    eviction doesn't count the table
+    """
+    def __init__(self,db_path:str,max_entries:int=200000):
+        """
+        Args:
+            db_path: location of the sqlite file
+            max_entries: entries kept before the least recently used are evicted, None for no bound
+        """
+        self.db_path = db_path
+        self.max_entries = max_entries
+        os.makedirs(os.path.dirname(db_path),exist_ok=True)
+        self._lock = threading.Lock()
+        self.stats = {"hits":0,"misses":0,"writes":0,"evictions":0}
+        self.connection = sqlite3.connect(db_path,check_same_thread=False)
+        with self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                """CREATE TABLE IF NOT EXISTS embeddings (
+                    model TEXT NOT NULL,
+                    dimensions INTEGER NOT NULL,
+                    text_hash TEXT NOT NULL,
+                    vector BLOB NOT NULL,
+                    last_used REAL NOT NULL,
+                    PRIMARY KEY (model, dimensions, text_hash)
+                )"""
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS ix_embeddings_last_used ON embeddings(last_used)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            # counted once, for a cache written before the count was kept
+            if self.connection.execute("SELECT 1 FROM meta WHERE key = 'count'").fetchone() is None:
+                self.connection.execute("INSERT INTO meta (key, value) SELECT 'count', COUNT(*) FROM embeddings")
+
+    def get_many(self,model:str,dimensions:int,text_hashes:List[str]) -> dict[str,List[float]]:
+        """
+        Cached vectors of the given text hashes, the hits are marked as recently used
+
+        Args:
+            model: embedding model name
+            dimensions: embedding dimensions, 0 for the model default
+            text_hashes: sha256 of the texts
+
+        Returns:
+            vectors(dict): text hash -> vector, for the hits only
+        """
+        found = {}
+        unique = list(dict.fromkeys(text_hashes))
+        with self._lock:
+            for start in range(0,len(unique),500):
+                batch = unique[start:start+500]
+                rows = self.connection.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND dimensions = ? AND text_hash IN ({','.join('?'*len(batch))})",
+                    [model,dimensions,*batch]
+                ).fetchall()
+                found.update({text_hash:np.frombuffer(vector,dtype=np.float32).tolist() for text_hash,vector in rows})
+            if found:
+                with self.connection:
+                    self.connection.executemany(
+                        "UPDATE embeddings SET last_used = ? WHERE model = ? AND dimensions = ? AND text_hash = ?",
+                        [(time.time(),model,dimensions,text_hash) for text_hash in found]
+                    )
+            hits = sum(1 for text_hash in text_hashes if text_hash in found)
+            self.stats["hits"] += hits
+            self.stats["misses"] += len(text_hashes) - hits
+        return found
+
+    def put_many(self,model:str,dimensions:int,vectors:dict[str,List[float]]) -> None:
+        """
+        Store vectors and evict the least recently used entries above max_entries
+
+        Args:
+            model: embedding model name
+            dimensions: embedding dimensions, 0 for the model default
+            vectors: text hash -> vector
+        """
+        if not vectors:
+            return
+        now = time.time()
+        text_hashes = list(vectors)
+        with self._lock, self.connection:
+            # the count stays exact when other processes write the same file
+            self.connection.execute("BEGIN IMMEDIATE")
+            existing = 0
+            for start in range(0,len(text_hashes),500):
+                batch = text_hashes[start:start+500]
+                existing += self.connection.execute(
+                    f"SELECT COUNT(*) FROM embeddings WHERE model = ? AND dimensions = ? AND text_hash IN ({','.join('?'*len(batch))})",
+                    [model,dimensions,*batch]
+                ).fetchone()[0]
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, dimensions, text_hash, vector, last_used) VALUES (?, ?, ?, ?, ?)",
+                [(model,dimensions,text_hash,np.asarray(vector,dtype=np.float32).tobytes(),now) for text_hash,vector in vectors.items()]
+            )
+            count = self.connection.execute(
+                "UPDATE meta SET value = value + ? WHERE key = 'count' RETURNING value",(len(vectors) - existing,)
+            ).fetchone()[0]
+            self.stats["writes"] += len(vectors)
+            if self.max_entries and count > self.max_entries:
+                evicted = self.connection.execute(
+                    "DELETE FROM embeddings WHERE rowid IN (SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (count - self.max_entries,)
+                ).rowcount
+                self.connection.execute("UPDATE meta SET value = value - ? WHERE key = 'count'",(evicted,))
+                self.stats["evictions"] += evicted
+
+    def size(self) -> int:
+        """
+        Number of cached vectors
+        """
+        return self.connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def hit_rate(self) -> float:
+        """
+        Share of lookups answered from the cache since start
+        """
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return self.stats["hits"] / lookups if lookups else 0.0
+
+    def clear(self) -> None:
+        """
+        Drop every cached vector
+        """
+        with self._lock, self.connection:
+            self.connection.execute("DELETE FROM embeddings")
+            self.connection.execute("UPDATE meta SET value = 0 WHERE key = 'count'")
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    langchain Embeddings wrapper: texts found in the EmbeddingCache are not sent to
+    the wrapped model, the others are embedded in one call (duplicates once) and cached
+    """
+    def __init__(self,embeddings:Embeddings,cache:EmbeddingCache,cache_queries:bool=True):
+        """
+        Args:
+            embeddings: wrapped langchain embeddings
+            cache: embedding cache
+            cache_queries: also cache embed_query results
+        """
+        self.embeddings = embeddings
+        self.cache = cache
+        self.cache_queries = cache_queries
+        self.model = get_model_name(embeddings)
+        self.dimensions = getattr(embeddings,"dimensions",None) or 0
+
+    def __getattr__(self,name:str) -> Any:
+        # expose the wrapped model's attributes (model, dimensions, ...)
+        if "embeddings" not in self.__dict__:
+            raise AttributeError(name)
+        return getattr(self.__dict__["embeddings"],name)
+
+    def embed_documents(self,texts:List[str]) -> List[List[float]]:
+        text_hashes = [hash_text(text) for text in texts]
+        found = self.cache.get_many(self.model,self.dimensions,text_hashes)
+        missing = {text_hash:text for text_hash,text in zip(text_hashes,texts) if text_hash not in found}
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            # float32 like the cached vectors, so a text embeds the same on a hit or a miss
+            new = dict(zip(missing,np.asarray(vectors,dtype=np.float32).tolist()))
+            self.cache.put_many(self.model,self.dimensions,new)
+            found.update(new)
+        logger.info(f'embedding cache: {len(texts) - len(missing)} hits, {len(missing)} embedded')
+        return [found[text_hash] for text_hash in text_hashes]
+
+    async def aembed_documents(self,texts:List[str]) -> List[List[float]]:
+        text_hashes = [hash_text(text) for text in texts]
+        found = self.cache.get_many(self.model,self.dimensions,text_hashes)
+        missing = {text_hash:text for text_hash,text in zip(text_hashes,texts) if text_hash not in found}
+        if missing:
+            # the wrapped model's async client, the event loop is not blocked on the API call
+            vectors = await self.embeddings.aembed_documents(list(missing.values()))
+            new = dict(zip(missing,np.asarray(vectors,dtype=np.float32).tolist()))
+            self.cache.put_many(self.model,self.dimensions,new)
+            found.update(new)
+        return [found[text_hash] for text_hash in text_hashes]
+
+    def embed_query(self,text:str) -> List[float]:
+        if not self.cache_queries:
+            return self.embeddings.embed_query(text)
+        text_hash = hash_text(f'query:{text}')
+        found = self.cache.get_many(self.model,self.dimensions,[text_hash])
+        if text_hash not in found:
+            found[text_hash] = np.asarray(self.embeddings.embed_query(text),dtype=np.float32).tolist()
+            self.cache.put_many(self.model,self.dimensions,{text_hash:found[text_hash]})
+        return found[text_hash]
+
+
+def get_model_name(embeddings:Any) -> str:
+    """
+    Name identifying an embedding model in the cache key
+    """
+    for attribute in ("model","model_name"):
+        if isinstance(getattr(embeddings,attribute,None),str):
+            return getattr(embeddings,attribute)
+    return f'{type(embeddings).__name__}:{getattr(embeddings,"size","")}'
+
+
+_caches:dict[str,EmbeddingCache] = {}
+_caches_lock = threading.Lock()
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """
+    Process-wide EmbeddingCache from the 'embedding_cache' config, None if disabled
+
+    Returns:
+        cache(EmbeddingCache)
+    """
+    configs = load_config_params_for_node("embedding_cache") or {}
+    if not configs.get("enabled",True):
+        return None
+    db_path = f'{get_project_filepath()}/{configs.get("path","data/embedding_cache/embeddings.sqlite")}'
+    with _caches_lock:
+        if db_path not in _caches:
+            _caches[db_path] = EmbeddingCache(db_path=db_path,max_entries=configs.get("max_entries",200000))
+        return _caches[db_path]
+
+def with_embedding_cache(embeddings:Embeddings) -> Embeddings:
+    """
+    Wrap embeddings with the process-wide cache when it is enabled
+
+    Args:
+        embeddings: langchain embeddings
+
+    Returns:
+        embeddings(Embeddings): CachedEmbeddings, or embeddings unchanged if the cache is disabled
+    """
+    cache = get_embedding_cache()
+    if cache is None or isinstance(embeddings,CachedEmbeddings):
+        return embeddings
+    configs = load_config_params_for_node("embedding_cache") or {}
+    return CachedEmbeddings(embeddings,cache,cache_queries=configs.get("cache_queries",True))
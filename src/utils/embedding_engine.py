@@ -0,0 +1,258 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Optional
+import openai
+from loguru import logger
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# status codes worth retrying: rate limit, timeouts and server errors
+RETRYABLE_STATUS = {408,409,429,500,502,503,504}
+
+
+def get_token_counter(model:str) -> Callable[[str],int]:
+    """
+    Token counter for a model: tiktoken when available, ~4 characters per token otherwise
+
+    Args:
+        model: embedding model name
+
+    Returns:
+        count(callable): text -> number of tokens
+    """
+    if tiktoken is not None:
+        try:
+            try:
+                encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                encoding = tiktoken.get_encoding("cl100k_base")
+            return lambda text: len(encoding.encode(text,disallowed_special=()))
+        except Exception as e:
+            # the encoding files are downloaded on first use
+            logger.warning(f'tiktoken encoding unavailable, estimating tokens:{e}')
+    return lambda text: len(text) // 4 + 1
+
+def pack_batches(token_counts:List[int],max_tokens:int,max_inputs:int) -> List[List[int]]:
+    """
+    Pack inputs, in order, into requests of at most max_tokens tokens and max_inputs
+    inputs. An input larger than max_tokens gets a request of its own
+
+    Args:
+        token_counts: tokens of each input
+        max_tokens: token budget of a request
+        max_inputs: inputs per request
+
+    Returns:
+        batches(list): lists of input positions
+    """
+    batches,batch,tokens = [],[],0
+    for position,count in enumerate(token_counts):
+        if batch and (tokens + count > max_tokens or len(batch) >= max_inputs):
+            batches.append(batch)
+            batch,tokens = [],0
+        batch.append(position)
+        tokens += count
+    if batch:
+        batches.append(batch)
+    return batches
+
+def get_status_code(error:Exception) -> Optional[int]:
+    """
+    HTTP status of an API error (openai errors carry status_code), None if unknown
+    """
+    status = getattr(error,"status_code",None)
+    if status is None:
+        status = getattr(getattr(error,"response",None),"status_code",None)
+    return status
+
+def get_retry_after(error:Exception) -> Optional[float]:
+    """
+    Seconds the server asked to wait (retry-after header), None if not given
+    """
+    headers = getattr(getattr(error,"response",None),"headers",None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError,ValueError):
+        return None
+
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limit: grows by about one request per window of successes,
+    halves on a rate limit, and callers block while the limit is reached
+    """
+    def __init__(self,initial:int,minimum:int=1,maximum:int=16):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = float(min(max(initial,minimum),maximum))
+        self.active = 0
+        self._condition = threading.Condition()
+
+    def acquire(self) -> None:
+        with self._condition:
+            while self.active >= int(self.limit):
+                self._condition.wait()
+            self.active += 1
+
+    def release(self,rate_limited:bool=False) -> None:
+        with self._condition:
+            self.active -= 1
+            if rate_limited:
+                self.limit = max(self.limit / 2,self.minimum)
+            else:
+                self.limit = min(self.limit + 1 / self.limit,self.maximum)
+            self._condition.notify_all()
+
+
+class EmbeddingEngine:
+    """
+    Batched, rate-limit-aware embedding of many texts with the OpenAI embeddings API.
+
+    Texts are packed into multi-input requests within a token budget, requests run
+    with an adaptive concurrency limit that halves on 429s and slowly grows back,
+    failed requests are retried with exponential backoff, and a request that keeps
+    failing for a non-retryable reason is split so one bad input only fails itself.
+    Results come back in input order, with None for the inputs that failed
+    """
+    def __init__(
+            self,
+            client:Any,
+            model:str="text-embedding-3-small",
+            dimensions:int=None,
+            max_tokens_per_request:int=8000,
+            max_inputs_per_request:int=2048,
+            concurrency:int=4,
+            max_concurrency:int=16,
+            max_retries:int=5,
+            backoff:float=1.0,
+            max_backoff:float=60.0
+        ):
+        """
+        Args:
+            client: openai.OpenAI client (anything with embeddings.create)
+            model: embedding model
+            dimensions: output dimensions for models that support shortening, None for the default
+            max_tokens_per_request: token budget of a request
+            max_inputs_per_request: inputs per request (API limit 2048)
+            concurrency: initial number of requests in flight
+            max_concurrency: upper bound of requests in flight
+            max_retries: attempts after the first one for retryable errors
+            backoff: first retry delay in seconds, doubled on each retry
+            max_backoff: longest retry delay in seconds
+        """
+        self.client = client
+        self.model = model
+        self.dimensions = dimensions
+        self.max_tokens_per_request = max_tokens_per_request
+        self.max_inputs_per_request = max_inputs_per_request
+        self.concurrency = concurrency
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.count_tokens = get_token_counter(model)
+        self.stats:dict = {}
+        self._stats_lock = threading.Lock()
+
+    def _add_stats(self,**counts) -> None:
+        with self._stats_lock:
+            for key,value in counts.items():
+                self.stats[key] = self.stats.get(key,0) + value
+
+    def _request(self,texts:List[str]) -> List[List[float]]:
+        """
+        One embeddings request
+        """
+        kwargs = {"input":texts,"model":self.model}
+        if self.dimensions:
+            kwargs["dimensions"] = self.dimensions
+        response = self.client.embeddings.create(**kwargs)
+        return [item.embedding for item in sorted(response.data,key=lambda item: item.index)]
+
+    def _embed_batch(self,texts:List[str],limiter:AdaptiveLimiter) -> List[Optional[List[float]]]:
+        """
+        Embed one packed batch with retries, split it if it keeps failing
+
+        Returns:
+            embeddings(list): one embedding or None per text
+        """
+        attempt = 0
+        while True:
+            limiter.acquire()
+            rate_limited = False
+            try:
+                embeddings = self._request(texts)
+                self._add_stats(requests=1)
+                return embeddings
+            except Exception as e:
+                status = get_status_code(e)
+                rate_limited = status == 429
+                self._add_stats(requests=1,errors=1,rate_limited=int(rate_limited))
+                retryable = status in RETRYABLE_STATUS or isinstance(e,openai.APIConnectionError)
+                if not retryable or attempt >= self.max_retries:
+                    logger.error(f'embedding request of {len(texts)} texts failed (status {status}):{e}')
+                    break
+                delay = get_retry_after(e) or min(self.backoff * 2 ** attempt,self.max_backoff)
+                logger.warning(f'embedding request failed (status {status}), retry {attempt + 1} in {delay:.1f}s')
+            finally:
+                limiter.release(rate_limited=rate_limited)
+            attempt += 1
+            self._add_stats(retries=1)
+            # jitter so throttled workers don't retry in lockstep
+            time.sleep(delay * random.uniform(0.5,1.0))
+
+        # a request that ran out of retries fails as a whole, a rejected one (e.g. an
+        # input over the model's token limit) is split to isolate the bad input
+        if retryable or len(texts) == 1:
+            return [None] * len(texts)
+        middle = len(texts) // 2
+        return self._embed_batch(texts[:middle],limiter) + self._embed_batch(texts[middle:],limiter)
+
+    def embed(self,texts:List[str]) -> List[Optional[List[float]]]:
+        """
+        Embed texts
+
+        Args:
+            texts: texts to embed
+
+        Returns:
+            embeddings(list): in input order, None for empty or failed texts. Throughput
+            is in self.stats (texts_per_sec, tokens_per_sec, requests, retries, ...)
+        """
+        start = time.monotonic()
+        self.stats = {}
+        results:List[Optional[List[float]]] = [None] * len(texts)
+        positions = [i for i,text in enumerate(texts) if text and isinstance(text,str)]
+        token_counts = [self.count_tokens(texts[i]) for i in positions]
+        batches = [
+            [positions[i] for i in batch]
+            for batch in pack_batches(token_counts,self.max_tokens_per_request,self.max_inputs_per_request)
+        ]
+        limiter = AdaptiveLimiter(initial=self.concurrency,maximum=self.max_concurrency)
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            futures = [(batch,executor.submit(self._embed_batch,[texts[i] for i in batch],limiter)) for batch in batches]
+            for batch,future in futures:
+                for position,embedding in zip(batch,future.result()):
+                    results[position] = embedding
+
+        seconds = max(time.monotonic() - start,1e-9)
+        embedded = sum(1 for embedding in results if embedding is not None)
+        tokens = sum(count for i,count in zip(positions,token_counts) if results[i] is not None)
+        self.stats.update({
+            "texts":len(texts),
+            "embedded":embedded,
+            "failed":len(texts) - embedded,
+            "tokens":tokens,
+            "batches":len(batches),
+            "seconds":round(seconds,3),
+            "texts_per_sec":round(embedded / seconds,1),
+            "tokens_per_sec":round(tokens / seconds,1),
+            "concurrency":round(limiter.limit,2),
+        })
+        logger.info(f'embedding engine:{self.stats}')
+        return results
@@ -0,0 +1,107 @@
+import os
+import json
+import threading
+import time
+import uuid
+from typing import List, Tuple
+from loguru import logger
+
+from src.utils.utils import get_project_filepath, load_config_params_for_node
+
+
+class EventLog:
+    """
+    Append-only JSONL log of the events of an analysis run (tokens, agent steps,
+    tool results), written as they happen. Readers keep the byte offset they reached
+    and only read what was appended since. Each run starts with a 'run_start' event;
+    the log is truncated at the start of a run once it is over max_bytes, readers
+    notice the file became shorter than their offset and start over
+    """
+    def __init__(self,path:str,max_bytes:int=16 << 20):
+        """
+        Args:
+            path: location of the jsonl file
+            max_bytes: size above which the next run starts a new log
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.run_id:str = None
+        os.makedirs(os.path.dirname(path),exist_ok=True)
+        self._lock = threading.Lock()
+
+    def start_run(self,query:str) -> str:
+        """
+        Record the start of a run, truncating the log first if it is too large
+
+        Args:
+            query: question of the run
+
+        Returns:
+            run_id(str)
+        """
+        with self._lock:
+            self.run_id = uuid.uuid4().hex
+            if os.path.exists(self.path) and os.path.getsize(self.path) > self.max_bytes:
+                open(self.path,'w').close()
+        self.append("run_start",text=f"Question: {query}\n\n",query=query)
+        return self.run_id
+
+    def append(self,type:str,text:str="",**fields) -> None:
+        """
+        Append one event and flush it, so readers see it right away
+
+        Args:
+            type: e.g. 'token', 'step', 'tool', 'answer', 'run_end'
+            text: what a reader displays for this event
+            fields: other JSON-serialisable attributes
+        """
+        event = {"run_id":self.run_id,"type":type,"time":time.time(),"text":text,**fields}
+        with self._lock, open(self.path,'a') as f:
+            f.write(json.dumps(event) + "\n")
+
+    def read(self,offset:int=0) -> Tuple[List[dict],int,bool]:
+        """
+        Events appended since a byte offset. A line still being written is left for
+        the next read
+
+        Args:
+            offset: where the previous read stopped
+
+        Returns:
+            (events, offset, reset): the new events, the offset to pass next time and
+            whether the log was truncated since the previous read
+        """
+        if not os.path.exists(self.path):
+            return [],0,offset > 0
+        reset = os.path.getsize(self.path) < offset
+        if reset:
+            offset = 0
+        with open(self.path,'rb') as f:
+            f.seek(offset)
+            data = f.read()
+        complete = data[:data.rfind(b"\n") + 1]
+        events = []
+        for line in complete.splitlines():
+            try:
+                events.append(json.loads(line))
+            except json.JSONDecodeError as e:
+                logger.error(f'event log: bad line at {offset}:{e}')
+        return events,offset + len(complete),reset
+
+
+_event_logs:dict[str,EventLog] = {}
+_event_logs_lock = threading.Lock()
+
+def get_event_log() -> EventLog:
+    """
+    Process-wide EventLog of the analysis from the 'event_log' config
+
+    Returns:
+        log(EventLog)
+    """
+    configs = load_config_params_for_node("event_log") or {}
+    path = f'{get_project_filepath()}/{configs.get("path","data/output/analysis_events.jsonl")}'
+    with _event_logs_lock:
+        if path not in _event_logs:
+            _event_logs[path] = EventLog(path=path,max_bytes=configs.get("max_mb",16) << 20)
+        return _event_logs[path]
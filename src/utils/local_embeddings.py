@@ -0,0 +1,130 @@
+import hashlib
+import re
+import threading
+from typing import List
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from loguru import logger
+
+# project imports
+from src.utils.utils import load_config_params_for_node
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:\.[0-9]+)?")
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Offline, deterministic embeddings by feature hashing: word unigrams, word bigrams
+    and character trigrams are hashed (signed) into a fixed number of dimensions,
+    weighted by log term frequency and L2-normalized. No model, no network, the same
+    text always gets the same vector, and a batch is accumulated with one numpy
+    scatter-add, so bulk ingestion is bound by tokenization only.
+
+    Lexical rather than semantic similarity: good enough for the tabular insurance
+    rows (years, states, amounts) and for benchmarks and CI without API access
+    """
+    def __init__(self,dimensions:int=1024,ngram_range:tuple=(3,3),bigrams:bool=True,max_cached_features:int=500000):
+        """
+        Args:
+            dimensions: size of the vectors
+            ngram_range: character n-gram sizes taken inside each word
+            bigrams: also hash consecutive word pairs
+            max_cached_features: feature hashes memoized before the memo is reset
+        """
+        self.dimensions = int(dimensions)
+        self.ngram_range = tuple(ngram_range)
+        self.bigrams = bigrams
+        self.model = f'hashing-{self.dimensions}'
+        self.max_cached_features = max_cached_features
+        self._features:dict[str,int] = {}
+        self._lock = threading.Lock()
+
+    def _hash(self,feature:str) -> int:
+        """
+        Signed bucket of a feature: index + 1, negated for half of the features
+        """
+        bucket = self._features.get(feature)
+        if bucket is None:
+            value = int.from_bytes(hashlib.blake2b(feature.encode('utf-8'),digest_size=8).digest(),"little")
+            bucket = (value % self.dimensions) + 1
+            if value >> 63:
+                bucket = -bucket
+            with self._lock:
+                if len(self._features) >= self.max_cached_features:
+                    self._features.clear()
+                self._features[feature] = bucket
+        return bucket
+
+    def get_features(self,text:str) -> List[str]:
+        """
+        Features of a text: words, word bigrams and character n-grams of each word
+
+        Args:
+            text: text to featurize
+
+        Returns:
+            features(list)
+        """
+        words = TOKEN_PATTERN.findall(text.lower())
+        features = list(words)
+        if self.bigrams:
+            features += [f'{a} {b}' for a,b in zip(words,words[1:])]
+        low,high = self.ngram_range
+        for word in words:
+            word = f'<{word}>'
+            for n in range(low,high + 1):
+                features += [f'#{word[i:i+n]}' for i in range(max(len(word) - n + 1,0))]
+        return features
+
+    def embed_documents(self,texts:List[str]) -> List[List[float]]:
+        rows,buckets = [],[]
+        for row,text in enumerate(texts):
+            hashed = [self._hash(feature) for feature in self.get_features(text or "")]
+            rows.extend([row] * len(hashed))
+            buckets.extend(hashed)
+        buckets = np.asarray(buckets,dtype=np.int64)
+        matrix = np.zeros((len(texts),self.dimensions),dtype=np.float32)
+        np.add.at(matrix,(np.asarray(rows,dtype=np.int64),np.abs(buckets) - 1),np.sign(buckets).astype(np.float32))
+        # sublinear term frequency, then unit length for cosine similarity
+        matrix = np.sign(matrix) * np.log1p(np.abs(matrix))
+        norms = np.linalg.norm(matrix,axis=1,keepdims=True)
+        norms[norms == 0] = 1
+        return (matrix / norms).tolist()
+
+    def embed_query(self,text:str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def get_embeddings_provider() -> str:
+    """
+    Embeddings provider from the 'embeddings' config: 'openai' (default) or 'hashing'
+    """
+    return (load_config_params_for_node("embeddings") or {}).get("provider","openai")
+
+def get_local_embeddings() -> HashingEmbeddings:
+    """
+    Local embedder with the settings of the 'embeddings' config
+    """
+    configs = load_config_params_for_node("embeddings") or {}
+    return HashingEmbeddings(dimensions=configs.get("hashing_dimensions",1024))
+
+def get_embeddings() -> Embeddings:
+    """
+    Embeddings used by the vector stores, selected by 'provider' in the 'embeddings'
+    config, shortened to 'dimensions' if set. API embeddings go through the embedding
+    cache, local ones are cheaper to recompute than to look up
+
+    Returns:
+        embeddings(Embeddings)
+    """
+    if get_embeddings_provider() == "hashing":
+        logger.info(f'using local hashing embeddings')
+        return get_local_embeddings()
+    from langchain_openai import OpenAIEmbeddings
+    from src.utils.embedding_cache import with_embedding_cache
+    configs = load_config_params_for_node("embeddings") or {}
+    kwargs = {"model":configs["model"]} if configs.get("model") else {}
+    # shortened (Matryoshka) embeddings, e.g. 256 instead of 1536 for text-embedding-3-*
+    if configs.get("dimensions"):
+        kwargs["dimensions"] = configs["dimensions"]
+    return with_embedding_cache(OpenAIEmbeddings(**kwargs))
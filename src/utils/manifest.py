@@ -0,0 +1,200 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from loguru import logger
+
+
+def hash_text(text:str) -> str:
+    """
+    sha256 of a string
+
+    Args:
+        text: string to hash
+
+    Returns:
+        hexdigest(str)
+    """
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def hash_file(file_path:str,block_size:int=1 << 20) -> str:
+    """
+    sha256 of a file's bytes, read in blocks
+
+    Args:
+        file_path: path of the file
+        block_size: bytes read per block
+
+    Returns:
+        hexdigest(str)
+    """
+    sha = hashlib.sha256()
+    with open(file_path,'rb') as file:
+        for block in iter(lambda: file.read(block_size),b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+class IngestManifest:
+    """
+    Persistent record of what has been ingested: each file by content hash and the
+    hashes of the chunks it produced. A chunk can be shared by several files and is
+    only considered removed once no file references it anymore
+    """
+    def __init__(self,db_path:str):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path),exist_ok=True)
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(db_path,check_same_thread=False)
+        with self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                """CREATE TABLE IF NOT EXISTS files (
+                    file_path TEXT PRIMARY KEY,
+                    content_hash TEXT NOT NULL,
+                    ingested_at TEXT NOT NULL
+                )"""
+            )
+            self.connection.execute(
+                """CREATE TABLE IF NOT EXISTS chunks (
+                    chunk_hash TEXT NOT NULL,
+                    file_path TEXT NOT NULL,
+                    PRIMARY KEY (chunk_hash, file_path)
+                )"""
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS ix_chunks_file ON chunks(file_path)")
+
+    def get_file_hash(self,file_path:str) -> str:
+        """
+        Content hash recorded for a file, None if the file was never ingested
+        """
+        row = self.connection.execute(
+            "SELECT content_hash FROM files WHERE file_path = ?",(file_path,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def get_files(self,dir_path:str=None) -> list[str]:
+        """
+        Files recorded in the manifest, optionally only those inside dir_path
+        """
+        rows = self.connection.execute("SELECT file_path FROM files").fetchall()
+        files = [row[0] for row in rows]
+        if dir_path:
+            dir_path = os.path.abspath(dir_path)
+            files = [f for f in files if os.path.dirname(os.path.abspath(f)) == dir_path]
+        return files
+
+    def get_chunks(self,file_path:str) -> set[str]:
+        """
+        Chunk hashes recorded for a file
+        """
+        rows = self.connection.execute(
+            "SELECT chunk_hash FROM chunks WHERE file_path = ?",(file_path,)
+        ).fetchall()
+        return {row[0] for row in rows}
+
+    def referenced_chunks(self,chunk_hashes:set[str]) -> set[str]:
+        """
+        Subset of chunk_hashes referenced by at least one file
+        """
+        referenced = set()
+        chunk_hashes = list(chunk_hashes)
+        for start in range(0,len(chunk_hashes),500):
+            batch = chunk_hashes[start:start+500]
+            rows = self.connection.execute(
+                f"SELECT DISTINCT chunk_hash FROM chunks WHERE chunk_hash IN ({','.join('?'*len(batch))})",
+                batch
+            ).fetchall()
+            referenced.update(row[0] for row in rows)
+        return referenced
+
+    def plan_file(self,file_path:str,chunk_hashes:set[str]) -> tuple[set[str],set[str]]:
+        """
+        Compare the new chunks of a file with the manifest without changing it
+
+        Args:
+            file_path: path of the file
+            chunk_hashes: hashes of the chunks the file produces now
+
+        Returns:
+            (to_add, to_delete): chunks not stored anywhere yet, and chunks that
+            lose their last reference once the file is updated
+        """
+        previous = self.get_chunks(file_path)
+        to_add = chunk_hashes - previous - self.referenced_chunks(chunk_hashes - previous)
+        dropped = previous - chunk_hashes
+        still_used = {
+            row[0] for row in self.connection.execute(
+                f"SELECT DISTINCT chunk_hash FROM chunks WHERE file_path != ? AND chunk_hash IN ({','.join('?'*len(dropped))})",
+                [file_path,*dropped]
+            ).fetchall()
+        } if dropped else set()
+        return to_add,dropped - still_used
+
+    def update_file(self,file_path:str,content_hash:str,chunk_hashes:set[str]) -> None:
+        """
+        Record the current content hash and chunks of a file in one transaction
+        """
+        with self._lock, self.connection:
+            self.connection.execute("DELETE FROM chunks WHERE file_path = ?",(file_path,))
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO chunks (chunk_hash, file_path) VALUES (?, ?)",
+                [(chunk_hash,file_path) for chunk_hash in chunk_hashes]
+            )
+            self.connection.execute(
+                "INSERT OR REPLACE INTO files (file_path, content_hash, ingested_at) VALUES (?, ?, ?)",
+                (file_path,content_hash,datetime.now().__str__())
+            )
+
+    def remove_file(self,file_path:str) -> None:
+        """
+        Forget a file and its chunks
+        """
+        with self._lock, self.connection:
+            self.connection.execute("DELETE FROM chunks WHERE file_path = ?",(file_path,))
+            self.connection.execute("DELETE FROM files WHERE file_path = ?",(file_path,))
+        logger.info(f'manifest: removed {file_path}')
+
+    def get_fingerprint(self) -> str:
+        """
+        Hash of the recorded files, their content hashes and ingest times: changes
+        whenever a file is ingested, updated or removed
+        """
+        rows = self.connection.execute("SELECT file_path, content_hash, ingested_at FROM files ORDER BY file_path").fetchall()
+        return hash_text("\n".join("|".join(row) for row in rows))
+
+    def clear(self) -> None:
+        """
+        Forget everything, e.g. after the vector store was emptied
+        """
+        with self._lock, self.connection:
+            self.connection.execute("DELETE FROM chunks")
+            self.connection.execute("DELETE FROM files")
+
+    def close(self) -> None:
+        """
+        Close the sqlite connection
+        """
+        with self._lock:
+            self.connection.close()
+
+
+_manifests:dict[str,IngestManifest] = {}
+_manifests_lock = threading.Lock()
+
+def get_ingest_manifest(db_path:str) -> IngestManifest:
+    """
+    Process-wide IngestManifest of a path, so callers share one sqlite connection
+    instead of opening one per call
+
+    Args:
+        db_path: location of the sqlite file
+
+    Returns:
+        manifest(IngestManifest)
+    """
+    with _manifests_lock:
+        if db_path not in _manifests:
+            _manifests[db_path] = IngestManifest(db_path)
+        return _manifests[db_path]
@@ -0,0 +1,125 @@
+from typing import List
+from langchain_core.messages import BaseMessage, HumanMessage
+from loguru import logger
+
+from src.utils.utils import load_config_params_for_node
+
+# name of the message that stands in for the dropped turns
+SUMMARY_NAME = "history_summary"
+# rough size of a message: ~4 characters per token plus the role/name framing
+CHARS_PER_TOKEN = 4
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def get_content_text(message:BaseMessage) -> str:
+    """
+    Text of a message, the text blocks of a multi-part content joined
+    """
+    if isinstance(message.content,str):
+        return message.content
+    return "\n".join(
+        block if isinstance(block,str) else str(block.get("text",""))
+        for block in message.content
+    )
+
+def estimate_tokens(message:BaseMessage) -> int:
+    """
+    Approximate token count of a message, without a tokenizer
+    """
+    return len(get_content_text(message)) // CHARS_PER_TOKEN + MESSAGE_OVERHEAD_TOKENS
+
+def stub_message(message:BaseMessage,max_tokens:int) -> BaseMessage:
+    """
+    Message cut to max_tokens: the head of a large payload (document dump, analysis
+    output) is kept with a note of what was left out
+
+    Args:
+        message: any message
+        max_tokens: size above which the content is cut
+
+    Returns:
+        message(BaseMessage): the message itself if small enough, a copy otherwise
+    """
+    text = get_content_text(message)
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return message
+    return message.model_copy(update={"content":f"{text[:max_chars]}\n[... {len(text) - max_chars} characters omitted]"})
+
+def summarize_messages(messages:List[BaseMessage],max_tokens:int) -> HumanMessage:
+    """
+    Extractive summary of dropped turns, one line per message (sender and the start
+    of its text). A previous summary is carried over, the oldest lines go first when
+    the summary is over max_tokens
+
+    Args:
+        messages: turns being dropped, oldest first
+        max_tokens: budget of the summary
+
+    Returns:
+        summary(HumanMessage): named SUMMARY_NAME
+    """
+    lines = []
+    for message in messages:
+        if message.name == SUMMARY_NAME:
+            lines.extend(get_content_text(message).splitlines()[1:])
+            continue
+        text = " ".join(get_content_text(message).split())
+        lines.append(f"- {message.name or message.type}: {text[:200]}")
+    while len(lines) > 1 and sum(len(line) + 1 for line in lines) > max_tokens * CHARS_PER_TOKEN:
+        lines.pop(0)
+    return HumanMessage(content="\n".join(["Summary of earlier steps:",*lines]),name=SUMMARY_NAME)
+
+def compact_messages(
+        messages:List[BaseMessage],
+        max_tokens:int=6000,
+        max_message_tokens:int=1500,
+        summary_tokens:int=500
+    ) -> List[BaseMessage]:
+    """
+    Keep a history within a token budget: large messages are cut to stubs, the first
+    message (the user request) and the most recent turns are kept, and the turns in
+    between are replaced by one rolling summary message
+
+    Args:
+        messages: history, oldest first
+        max_tokens: budget of the whole history
+        max_message_tokens: size above which a message is cut
+        summary_tokens: budget of the summary message
+
+    Returns:
+        messages(list): the compacted history
+    """
+    messages = [stub_message(message,max_message_tokens) for message in messages]
+    if sum(estimate_tokens(message) for message in messages) <= max_tokens or len(messages) < 3:
+        return messages
+    first,rest = messages[0],messages[1:]
+    budget = max_tokens - estimate_tokens(first) - summary_tokens - MESSAGE_OVERHEAD_TOKENS
+    recent = []
+    for message in reversed(rest):
+        if message.name == SUMMARY_NAME or (recent and estimate_tokens(message) > budget):
+            break
+        recent.insert(0,message)
+        budget -= estimate_tokens(message)
+    dropped = rest[:len(rest) - len(recent)]
+    if not dropped:
+        return messages
+    logger.info(f'message history: {len(dropped)} messages summarized, {len(recent)} kept')
+    return [first,summarize_messages(dropped,summary_tokens),*recent]
+
+def add_messages_bounded(left:List[BaseMessage],right:List[BaseMessage]) -> List[BaseMessage]:
+    """
+    Reducer of AgentState.messages: append like operator.add, then compact the
+    history to the 'message_history' config budget so every LLM call gets a prompt
+    of about the same size however long the run
+    """
+    configs = load_config_params_for_node("message_history") or {}
+    messages = list(left or []) + list(right or [])
+    if not configs.get("enabled",True):
+        return messages
+    return compact_messages(
+        messages,
+        max_tokens=configs.get("max_tokens",6000),
+        max_message_tokens=configs.get("max_message_tokens",1500),
+        summary_tokens=configs.get("summary_tokens",500),
+    )
@@ -0,0 +1,133 @@
+import json
+import os
+import re
+from typing import Iterable, List, Optional, Tuple
+from langchain_core.documents import Document
+
+# 'Year: 2009' as written by the native csv loaders, any 19xx/20xx that is not part
+# of a larger number or an amount otherwise
+YEAR_FIELD_PATTERN = re.compile(r"\byear\W{0,3}((?:19|20)\d{2})\b",re.IGNORECASE)
+YEAR_PATTERN = re.compile(r"(?<![\d.$])((?:19|20)\d{2})(?!\.?\d)")
+# metadata keys of the typed filter, everything else is matched by equality
+FILTER_KEYS = ("start_year","end_year","source_file")
+
+
+def extract_years(text:str) -> List[int]:
+    """
+    Years mentioned in a chunk, preferring explicit 'Year' fields
+
+    Args:
+        text: chunk content
+
+    Returns:
+        years(list)
+    """
+    years = YEAR_FIELD_PATTERN.findall(text) or YEAR_PATTERN.findall(text)
+    return [int(year) for year in years]
+
+def add_filter_metadata(documents:List[Document]) -> List[Document]:
+    """
+    Add the typed metadata the search filters run on: 'year_min'/'year_max' (int)
+    of the years in the chunk and 'source_files' (file names, more than one once
+    deduplicated). Called at ingest, after splitting
+
+    Args:
+        documents: chunks
+
+    Returns:
+        documents(list): the same chunks, metadata updated in place
+    """
+    for document in documents:
+        years = extract_years(document.page_content)
+        if years:
+            document.metadata["year_min"] = min(years)
+            document.metadata["year_max"] = max(years)
+        source = document.metadata.get("source")
+        if source and "source_files" not in document.metadata:
+            document.metadata["source_files"] = [os.path.basename(source)]
+    return documents
+
+def get_sources(metadata:dict) -> List[str]:
+    """
+    Files a chunk was found in: 'sources' once deduplicated, 'source' otherwise
+    """
+    return list(metadata.get("sources") or ([metadata["source"]] if metadata.get("source") else []))
+
+def merge_sources(metadata:dict,sources:Iterable[str]) -> dict:
+    """
+    Metadata of a stored chunk that was found in more files: the files are added to
+    'sources' and their names to 'source_files', so the source_file filter finds the
+    chunk from any of them
+
+    Args:
+        metadata: chunk metadata
+        sources: paths of the files
+
+    Returns:
+        metadata(dict): an updated copy, the same dict if nothing was missing
+    """
+    known = get_sources(metadata)
+    merged = known + [source for source in dict.fromkeys(sources) if source and source not in known]
+    names = list(metadata.get("source_files") or [])
+    merged_names = names + [name for name in dict.fromkeys(os.path.basename(source) for source in merged) if name not in names]
+    if merged == known and merged_names == names and "sources" in metadata:
+        return metadata
+    return {**metadata,"sources":merged,"source_files":merged_names}
+
+def clean_filter(filter:Optional[dict]) -> dict:
+    """
+    Drop unset entries, so tools can pass every argument
+    """
+    return {key:value for key,value in (filter or {}).items() if value not in (None,"")}
+
+def build_sql_filter(filter:Optional[dict],column:str="cmetadata") -> Tuple[str,dict]:
+    """
+    SQL condition for a metadata filter on the JSONB metadata column
+
+    - start_year/end_year: chunks whose year range overlaps [start_year, end_year],
+      on the (year_min, year_max) expression index
+    - source_file: chunks found in that file, with @> on the GIN index
+    - any other key: equality on that metadata key, with @> on the GIN index
+
+    Args:
+        filter: metadata filter
+        column: metadata column
+
+    Returns:
+        (condition, params): SQL to AND into a WHERE clause ('TRUE' if no filter) and its bind parameters
+    """
+    filter = clean_filter(filter)
+    conditions,params,contains = [],{},{}
+    if "start_year" in filter:
+        conditions.append(f"({column}->>'year_max')::int >= :filter_start_year")
+        params["filter_start_year"] = int(filter["start_year"])
+    if "end_year" in filter:
+        conditions.append(f"({column}->>'year_min')::int <= :filter_end_year")
+        params["filter_end_year"] = int(filter["end_year"])
+    if "source_file" in filter:
+        contains["source_files"] = [os.path.basename(filter["source_file"])]
+    contains.update({key:value for key,value in filter.items() if key not in FILTER_KEYS})
+    if contains:
+        conditions.append(f"{column} @> CAST(:filter_contains AS jsonb)")
+        params["filter_contains"] = json.dumps(contains)
+    return (" AND ".join(conditions) or "TRUE"),params
+
+def matches_filter(metadata:dict,filter:Optional[dict]) -> bool:
+    """
+    Python version of build_sql_filter, for the local backend and the lexical index
+
+    Args:
+        metadata: chunk metadata
+        filter: metadata filter
+
+    Returns:
+        match(bool)
+    """
+    filter = clean_filter(filter)
+    if "start_year" in filter and not metadata.get("year_max",-1) >= int(filter["start_year"]):
+        return False
+    if "end_year" in filter and not metadata.get("year_min",10000) <= int(filter["end_year"]):
+        return False
+    if "source_file" in filter and os.path.basename(filter["source_file"]) not in metadata.get("source_files",[]):
+        return False
+    return all(metadata.get(key) == value for key,value in filter.items() if key not in FILTER_KEYS)
@@ -0,0 +1,227 @@
+import os
+from typing import List, Tuple
+import numpy as np
+
+# storage formats of the embeddings: bytes per dimension 4, 2, 1 (+ a float32 scale
+# per vector) and 1/8 (the sign bits only, ranked by hamming distance)
+QUANTIZATIONS = ("float32","float16","int8","binary")
+# files of each format, the first one is the one scanned
+QUANTIZATION_FILES = {
+    "float32":("embeddings.f32",),
+    "float16":("embeddings.f16",),
+    "int8":("embeddings.i8","scales.f32"),
+    "binary":("embeddings.bin",),
+}
+# bits set in every 16-bit value, hamming distances are looked up two bytes at a time
+POPCOUNT = np.array([bin(i).count("1") for i in range(1 << 16)],dtype=np.uint8)
+# rows scored per block, bounds the float32 copy of a quantized block
+BLOCK_ROWS = 65536
+
+
+def normalize(vectors) -> np.ndarray:
+    """
+    Unit-length float32 rows, so the dot product is the cosine similarity
+    """
+    vectors = np.asarray(vectors,dtype=np.float32)
+    norms = np.linalg.norm(vectors,axis=-1,keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+def truncate_embeddings(vectors,dimensions:int) -> np.ndarray:
+    """
+    Matryoshka shortening: keep the first dimensions and renormalize. For models
+    trained that way (text-embedding-3-*) this is what the API returns when asked
+    for fewer dimensions
+
+    Args:
+        vectors: embeddings
+        dimensions: dimensions to keep, None to keep all
+
+    Returns:
+        vectors(np.ndarray): unit-length float32 rows
+    """
+    vectors = np.asarray(vectors,dtype=np.float32)
+    if dimensions and dimensions < vectors.shape[-1]:
+        vectors = vectors[...,:dimensions]
+    return normalize(vectors)
+
+def get_bytes_per_vector(quantization:str,dimensions:int) -> int:
+    """
+    Storage of one vector in a format
+    """
+    return {
+        "float32":4 * dimensions,
+        "float16":2 * dimensions,
+        "int8":dimensions + 4,
+        "binary":(dimensions + 7) // 8,
+    }[quantization]
+
+def quantize(vectors:np.ndarray,quantization:str) -> Tuple[np.ndarray,...]:
+    """
+    Encode unit-length vectors, one array per file of the format
+
+    Args:
+        vectors: unit-length float32 rows
+        quantization: one of QUANTIZATIONS
+
+    Returns:
+        arrays(tuple): matching QUANTIZATION_FILES[quantization]
+    """
+    if quantization == "float32":
+        return (vectors.astype(np.float32),)
+    if quantization == "float16":
+        return (vectors.astype(np.float16),)
+    if quantization == "int8":
+        # symmetric scalar quantization with a scale per vector
+        scales = np.abs(vectors).max(axis=1) / 127
+        scales[scales == 0] = 1
+        return (np.round(vectors / scales[:,None]).astype(np.int8),scales.astype(np.float32))
+    if quantization == "binary":
+        return (np.packbits(vectors > 0,axis=1),)
+    raise ValueError(f'unknown quantization {quantization}, expected one of {QUANTIZATIONS}')
+
+
+class QuantizedMatrix:
+    """
+    Embeddings of a local collection in one of QUANTIZATIONS, memory-mapped from
+    the collection folder. Rows are appended or overwritten in place, search scans
+    the compact array block by block. 'binary' keeps only the bits, so its ranking
+    is by hamming distance, with no full-precision rerank
+    """
+    def __init__(self,path:str,dimensions:int,quantization:str="float32"):
+        """
+        Args:
+            path: collection folder
+            dimensions: embedding dimensions
+            quantization: one of QUANTIZATIONS
+        """
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f'unknown quantization {quantization}, expected one of {QUANTIZATIONS}')
+        self.path = path
+        self.dimensions = dimensions
+        self.quantization = quantization
+        self.arrays:List[np.memmap] = []
+        self.rows = 0
+
+    @property
+    def file_paths(self) -> List[str]:
+        return [f'{self.path}/{name}' for name in QUANTIZATION_FILES[self.quantization]]
+
+    def _shape(self,array:np.ndarray,rows:int) -> tuple:
+        return (rows,*array.shape[1:])
+
+    def open(self,rows:int) -> "QuantizedMatrix":
+        """
+        (Re)map the files for a number of rows, e.g. after they grew
+        """
+        self.rows = rows
+        self.arrays = []
+        if rows == 0 or not all(os.path.exists(path) for path in self.file_paths):
+            self.rows = 0
+            return self
+        for path,array in zip(self.file_paths,quantize(np.zeros((1,self.dimensions),dtype=np.float32),self.quantization)):
+            self.arrays.append(np.memmap(path,dtype=array.dtype,mode="r+",shape=self._shape(array,rows)))
+        return self
+
+    def append(self,vectors:np.ndarray) -> None:
+        """
+        Append unit-length vectors, the matrix must be reopened afterwards
+        """
+        for path,array in zip(self.file_paths,quantize(vectors,self.quantization)):
+            with open(path,'ab') as f:
+                f.write(array.tobytes())
+
+    def update(self,rows:List[int],vectors:np.ndarray) -> None:
+        """
+        Overwrite existing rows
+        """
+        for mapped,array in zip(self.arrays,quantize(vectors,self.quantization)):
+            mapped[rows] = array
+            mapped.flush()
+
+    def compact(self,rows:np.ndarray) -> None:
+        """
+        Rewrite the files with only the given rows, in that order, without re-encoding
+        """
+        kept = [np.array(mapped[rows]) for mapped in self.arrays] if len(rows) and self.arrays else []
+        self.arrays = []
+        for i,path in enumerate(self.file_paths):
+            with open(path,'wb') as f:
+                if kept:
+                    f.write(kept[i].tobytes())
+        self.open(len(rows))
+
+    def to_float32(self,rows:np.ndarray=None) -> np.ndarray:
+        """
+        Decoded vectors (approximate for the quantized formats, only the signs for
+        'binary'), e.g. to migrate
+        """
+        if not self.arrays:
+            return np.zeros((0,self.dimensions),dtype=np.float32)
+        rows = np.arange(self.rows) if rows is None else rows
+        if self.quantization == "int8":
+            return self.arrays[0][rows].astype(np.float32) * self.arrays[1][rows][:,None]
+        if self.quantization == "binary":
+            signs = np.unpackbits(self.arrays[0][rows],axis=1,count=self.dimensions).astype(np.float32) * 2 - 1
+            return normalize(signs)
+        return self.arrays[0][rows].astype(np.float32)
+
+    def get_nbytes(self) -> int:
+        """
+        Size of the files
+        """
+        return sum(os.path.getsize(path) for path in self.file_paths if os.path.exists(path))
+
+    def _scores(self,queries:np.ndarray) -> np.ndarray:
+        """
+        Similarity of every row to every query, (rows, queries), cosine for the
+        numeric formats and 1 - 2 * hamming / dimensions for 'binary'
+        """
+        scores = np.empty((self.rows,len(queries)),dtype=np.float32)
+        data = self.arrays[0]
+        if self.quantization == "binary":
+            bits = np.packbits(queries > 0,axis=1)
+            # an even number of bytes is scanned as 16-bit words
+            word = np.uint16 if bits.shape[1] % 2 == 0 else np.uint8
+            bits = bits.view(word)
+            for start in range(0,self.rows,BLOCK_ROWS):
+                block = np.asarray(data[start:start+BLOCK_ROWS]).view(word)
+                for column,query in enumerate(bits):
+                    distance = POPCOUNT[np.bitwise_xor(block,query)].sum(axis=1,dtype=np.int32)
+                    scores[start:start+len(block),column] = 1 - 2 * distance / self.dimensions
+            return scores
+        for start in range(0,self.rows,BLOCK_ROWS):
+            block = np.asarray(data[start:start+BLOCK_ROWS]).astype(np.float32,copy=False) @ queries.T
+            if self.quantization == "int8":
+                block *= self.arrays[1][start:start+BLOCK_ROWS][:,None]
+            scores[start:start+len(block)] = block
+        return scores
+
+    def search(self,queries:np.ndarray,k:int,candidates:np.ndarray=None) -> List[Tuple[np.ndarray,np.ndarray]]:
+        """
+        Top-k rows of several queries
+
+        Args:
+            queries: unit-length float32 query vectors
+            k: number of results per query
+            candidates: boolean mask of the rows that may be returned, all if None
+
+        Returns:
+            results(list): per query, (rows, similarities) best first
+        """
+        if self.rows == 0:
+            return [(np.zeros(0,dtype=np.int64),np.zeros(0,dtype=np.float32)) for _ in queries]
+        scores = self._scores(queries)
+        if candidates is not None:
+            scores[~candidates[:self.rows]] = -np.inf
+        allowed = self.rows if candidates is None else int(candidates[:self.rows].sum())
+        k = min(k,allowed)
+        results = []
+        for column in scores.T:
+            if k == 0:
+                results.append((np.zeros(0,dtype=np.int64),np.zeros(0,dtype=np.float32)))
+                continue
+            top = np.argpartition(-column,k - 1)[:k]
+            order = np.argsort(-column[top])
+            results.append((top[order],column[top][order]))
+        return results
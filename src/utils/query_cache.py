@@ -0,0 +1,72 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+
+class QueryEmbeddingCache:
+    """
+    In-process LRU cache of query embeddings with a ttl. The analysis agent repeats
+    the same searches within a run, a hit saves an embeddings API round-trip.
+    Keys are normalized (case, whitespace) so near-identical queries share an entry
+    """
+    def __init__(self,max_size:int=1024,ttl:float=3600):
+        """
+        Args:
+            max_size: entries kept, the least recently used are dropped first
+            ttl: seconds an entry stays valid, None for no expiry
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.stats = {"hits":0,"misses":0}
+        self._entries:OrderedDict[tuple,tuple[Any,float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(model:str,query:str) -> tuple:
+        return (model," ".join(query.lower().split()))
+
+    def get(self,model:str,query:str) -> Optional[Any]:
+        """
+        Cached embedding of a query, None if missing or expired
+        """
+        key = self.make_key(model,query)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (self.ttl is None or time.monotonic() - entry[1] < self.ttl):
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[key]
+            self.stats["misses"] += 1
+            return None
+
+    def put(self,model:str,query:str,embedding:Any) -> None:
+        """
+        Store the embedding of a query
+        """
+        key = self.make_key(model,query)
+        with self._lock:
+            self._entries[key] = (embedding,time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+def get_query_cache(configs:dict) -> QueryEmbeddingCache:
+    """
+    Query embedding cache with the 'query_cache' settings of the vector_store config
+
+    Args:
+        configs: vector_store config
+
+    Returns:
+        cache(QueryEmbeddingCache)
+    """
+    configs = configs.get("query_cache",{})
+    return QueryEmbeddingCache(max_size=configs.get("max_size",1024),ttl=configs.get("ttl",3600))
@@ -0,0 +1,145 @@
+import asyncio
+import threading
+from typing import Any
+from loguru import logger
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+
+from src.utils.utils import load_config_params_for_node
+
+# Process-wide registry: one pooled SQLAlchemy engine per connection string and one
+# VectorStore per collection, created lazily on first use and shared by every caller
+_lock = threading.RLock()
+_engines:dict[str,Engine] = {}
+# async connections belong to the event loop that opened them: one engine per
+# connection string, replaced (and its pool released) when it is used from another loop
+_async_engines:dict[str,tuple[Any,AsyncEngine]] = {}
+_vector_stores:dict[str,Any] = {}
+# collection a VectorStore uses when no name is given, known once one was created
+_default_collection_name:str = None
+
+
+def get_pool_configs() -> dict:
+    """
+    Connection pool settings from the 'pool' entry of the vector_store config
+
+    Returns:
+        pool(dict): keyword arguments for sqlalchemy.create_engine
+    """
+    configs = (load_config_params_for_node("vector_store") or {}).get("pool",{})
+    return {
+        "pool_size":configs.get("pool_size",5),
+        "max_overflow":configs.get("max_overflow",10),
+        "pool_pre_ping":configs.get("pool_pre_ping",True),
+        "pool_recycle":configs.get("pool_recycle",1800),
+    }
+
+def get_engine(connection_string:str) -> Engine:
+    """
+    Shared, pooled engine for a connection string
+
+    Args:
+        connection_string: SQLAlchemy url of the database
+
+    Returns:
+        engine(Engine)
+    """
+    with _lock:
+        if connection_string not in _engines:
+            _engines[connection_string] = create_engine(connection_string,**get_pool_configs())
+            logger.info(f'created pooled engine:{get_pool_configs()}')
+        return _engines[connection_string]
+
+def get_async_engine(connection_string:str) -> AsyncEngine:
+    """
+    Shared, pooled async engine (psycopg async driver) for a connection string, to
+    be called from a running event loop
+
+    Args:
+        connection_string: SQLAlchemy url of the database
+
+    Returns:
+        engine(AsyncEngine)
+    """
+    loop = asyncio.get_running_loop()
+    with _lock:
+        if connection_string not in _async_engines or _async_engines[connection_string][0] is not loop:
+            if connection_string in _async_engines:
+                dispose_async_engine(*_async_engines[connection_string])
+            _async_engines[connection_string] = (loop,create_async_engine(connection_string,**get_pool_configs()))
+            logger.info(f'created pooled async engine:{get_pool_configs()}')
+        return _async_engines[connection_string][1]
+
+def dispose_async_engine(loop:asyncio.AbstractEventLoop,engine:AsyncEngine) -> None:
+    """
+    Release the pool of an async engine that is being replaced. Its connections can
+    only be closed on the loop that opened them: if that loop still runs (another
+    thread) they are closed there, otherwise the pool is dropped without closing
+    them and the sockets go with the garbage collector
+
+    Args:
+        loop: event loop the engine was created on
+        engine: engine to dispose
+    """
+    try:
+        if loop.is_running() and not loop.is_closed():
+            asyncio.run_coroutine_threadsafe(engine.dispose(),loop)
+        else:
+            engine.sync_engine.dispose(close=False)
+    except Exception as e:
+        logger.error(f'async engine dispose error:{e}')
+
+def get_vector_store_class() -> type:
+    """
+    VectorStore implementation selected by 'backend' in the vector_store config:
+    'pgvector' (default, Postgres) or 'local' (in-process NumPy index)
+
+    Returns:
+        class(type)
+    """
+    backend = (load_config_params_for_node("vector_store") or {}).get("backend","pgvector")
+    if backend == "local":
+        from src.agents.local_vector_store import LocalVectorStore
+        return LocalVectorStore
+    from src.agents.vector_store import VectorStore
+    return VectorStore
+
+def get_vector_store(collection_name:str=None) -> Any:
+    """
+    Shared VectorStore for a collection, created on first use. Stores are keyed on
+    the resolved collection name, so None and the default name share one instance
+
+    Args:
+        collection_name: name of the collection, the VectorStore default if None
+
+    Returns:
+        vector_store(VectorStore)
+    """
+    global _default_collection_name
+    with _lock:
+        name = collection_name or _default_collection_name
+        if name not in _vector_stores:
+            vector_store = get_vector_store_class()()
+            if collection_name:
+                vector_store.collection_name = collection_name
+            else:
+                _default_collection_name = vector_store.collection_name
+            name = vector_store.collection_name
+            _vector_stores.setdefault(name,vector_store)
+        return _vector_stores[name]
+
+def dispose_all() -> None:
+    """
+    Close every pooled connection and forget the shared stores (tests, shutdown)
+    """
+    global _default_collection_name
+    with _lock:
+        for engine in _engines.values():
+            engine.dispose()
+        _engines.clear()
+        for loop,engine in _async_engines.values():
+            dispose_async_engine(loop,engine)
+        _async_engines.clear()
+        _vector_stores.clear()
+        _default_collection_name = None
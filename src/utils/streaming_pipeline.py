@@ -0,0 +1,263 @@
+import os
+import queue
+import threading
+from datetime import datetime
+from typing import Any, Iterable, Iterator
+from langchain_core.documents import Document
+from loguru import logger
+
+# project imports
+from src.utils.manifest import IngestManifest, hash_file, hash_text
+from src.utils.artifact_store import ArtifactStore
+from src.utils.metadata_filters import get_sources, merge_sources
+
+
+def encode_item(item:tuple) -> dict:
+    """
+    JSON record of a work item of the pipeline, to stage it in an ArtifactStore
+    """
+    if item[0] == "batch":
+        _,documents,ids = item
+        return {"type":"batch","documents":[{"content":doc.page_content,"metadata":doc.metadata} for doc in documents],"ids":ids}
+    _,file_path,content_hash,chunk_hashes,to_delete,shared = item
+    return {
+        "type":"file","file_path":file_path,"content_hash":content_hash,
+        "chunk_hashes":sorted(chunk_hashes),"to_delete":sorted(to_delete),"shared":sorted(shared)
+    }
+
+def decode_item(record:dict) -> tuple:
+    """
+    Work item of an encode_item record
+    """
+    if record["type"] == "batch":
+        return ("batch",[Document(page_content=doc["content"],metadata=doc["metadata"]) for doc in record["documents"]],record["ids"])
+    return ("file",record["file_path"],record["content_hash"],set(record["chunk_hashes"]),set(record["to_delete"]),set(record["shared"]))
+
+
+class StreamingIngestionPipeline:
+    """
+    Load -> split -> embed -> write, one bounded batch at a time.
+
+    Files are pulled lazily and loaded (optionally in a process pool) one result at a
+    time, chunks are packed into fixed-size batches and handed to a writer thread over
+    a bounded queue. When the writer (embedding + vector store insert) falls behind,
+    the producer blocks, so peak memory is a few batches no matter how large the corpus
+    is, and every batch is queryable as soon as it is written.
+
+    The ingestion manifest is honoured: unchanged files are skipped, chunks already
+    stored (or already emitted in this run) are not embedded again, and a file is only
+    recorded in the manifest once all of its chunks have been written. Stale chunks are
+    deleted at the end, once the manifest shows no file references them anymore.
+
+    Duplicate chunks get the same provenance as with deduplicate_documents: a chunk
+    still waiting in the current batch gets the file added to its metadata, one that
+    was already written (or stored by an earlier run) gets it with
+    VectorStore.add_sources when the file is recorded.
+    """
+    _DONE = object()
+
+    def __init__(self,processor:Any,vector_store:Any,manifest:IngestManifest,batch_size:int=256,max_pending_batches:int=2):
+        """
+        Args:
+            processor: DocumentProcessor used to load and split the files
+            vector_store: VectorStore the batches are written to
+            manifest: ingestion manifest
+            batch_size: chunks per embedding/insert batch
+            max_pending_batches: batches allowed to wait for the writer
+        """
+        self.processor = processor
+        self.vector_store = vector_store
+        self.manifest = manifest
+        self.batch_size = max(int(batch_size),1)
+        self.queue = queue.Queue(maxsize=max(int(max_pending_batches),1))
+        self.error = None
+        self.stale_chunks = set()
+        self.stats = {"files":0,"skipped_files":0,"removed_files":0,"chunks":0,"batches":0,"deleted":0}
+
+    def iter_files(self,dir_path:str) -> Iterator[str]:
+        """
+        Lazily list csv files in a folder whose content changed since the last ingest
+
+        Args:
+            dir_path: location of the csv files
+
+        Yields:
+            file_path(str)
+        """
+        with os.scandir(dir_path) as entries:
+            for entry in entries:
+                if not entry.is_file() or '.csv' not in entry.name.lower():
+                    continue
+                file_path = f'{dir_path}/{entry.name}'
+                if self.manifest.get_file_hash(file_path) == hash_file(file_path):
+                    self.stats["skipped_files"] += 1
+                    continue
+                yield file_path
+
+    def iter_items(self,dir_path:str) -> Iterator[tuple]:
+        """
+        Produce the work items for the writer: ('batch', documents, ids) and, once all
+        chunks of a file are in flushed batches, ('file', file_path, hash, chunk_hashes,
+        to_delete, shared), shared being the chunks of the file stored by another file
+
+        Args:
+            dir_path: location of the csv files
+
+        Yields:
+            item(tuple)
+        """
+        workers = self.processor.configs.get("workers",1)
+        if workers > 1:
+            results = self.processor.iter_loaded_files(file_paths=self.iter_files(dir_path),workers=workers,split=True)
+        else:
+            results = (self.processor.load_file(file_path,split=True) for file_path in self.iter_files(dir_path))
+        emitted = set()
+        # position in the current batch of the chunks not flushed yet
+        pending = {}
+        documents,ids,finished_files = [],[],[]
+        for result in results:
+            file_path = result["file_path"]
+            if result["error"] or file_path in self.processor.failed_files:
+                continue
+            chunk_hashes = {hash_text(doc.page_content):doc for doc in result["documents"]}
+            previous = self.manifest.get_chunks(file_path)
+            to_add,to_delete = self.manifest.plan_file(file_path=file_path,chunk_hashes=set(chunk_hashes))
+            shared = set()
+            for chunk_hash in set(chunk_hashes) - previous - (to_add - emitted):
+                if chunk_hash in pending:
+                    position = pending[chunk_hash]
+                    documents[position] = Document(
+                        page_content=documents[position].page_content,
+                        metadata=merge_sources(documents[position].metadata,get_sources(chunk_hashes[chunk_hash].metadata))
+                    )
+                else:
+                    shared.add(chunk_hash)
+            for chunk_hash in to_add - emitted:
+                emitted.add(chunk_hash)
+                pending[chunk_hash] = len(documents)
+                documents.append(chunk_hashes[chunk_hash])
+                ids.append(self.vector_store.make_document_id(chunk_hash))
+                if len(documents) >= self.batch_size:
+                    yield ("batch",documents,ids)
+                    documents,ids,pending = [],[],{}
+                    # files finished before this batch are now fully written
+                    for finished in finished_files:
+                        yield finished
+                    finished_files = []
+            finished_files.append(("file",file_path,hash_file(file_path),set(chunk_hashes),to_delete,shared))
+        if documents:
+            yield ("batch",documents,ids)
+        for finished in finished_files:
+            yield finished
+
+    def _writer(self) -> None:
+        """
+        Consume work items until the producer is done: embed and insert batches and
+        record finished files in the manifest
+        """
+        while True:
+            item = self.queue.get()
+            try:
+                if item is self._DONE:
+                    return
+                if self.error:
+                    continue
+                if item[0] == "batch":
+                    _,documents,ids = item
+                    self.vector_store.add_documents(documents=documents,ids=ids)
+                    self.stats["chunks"] += len(documents)
+                    self.stats["batches"] += 1
+                else:
+                    _,file_path,content_hash,chunk_hashes,to_delete,shared = item
+                    self.vector_store.add_sources({self.vector_store.make_document_id(h):[file_path] for h in shared})
+                    self.manifest.update_file(file_path=file_path,content_hash=content_hash,chunk_hashes=chunk_hashes)
+                    self.stale_chunks.update(to_delete)
+                    self.stats["files"] += 1
+            except Exception as e:
+                logger.error(f'streaming ingestion writer error:{e}')
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def run(self,dir_path:str) -> dict:
+        """
+        Stream a folder into the vector store
+
+        Args:
+            dir_path: location of the csv files
+
+        Returns:
+            stats(dict): files written/skipped/removed, chunks, batches, deleted chunks and seconds
+        """
+        return self.write(self.iter_items(dir_path),dir_path=dir_path)
+
+    def stage(self,dir_path:str,artifacts:ArtifactStore) -> str:
+        """
+        Load and split a folder without writing it: the work items go to an artifact
+        and the vector store node writes them later with write_artifact
+
+        Args:
+            dir_path: location of the csv files
+            artifacts: where the items are staged
+
+        Returns:
+            handle(str): artifact handle
+        """
+        return artifacts.put((encode_item(item) for item in self.iter_items(dir_path)),metadata={"dir_path":dir_path})
+
+    def write_artifact(self,handle:str,artifacts:ArtifactStore) -> dict:
+        """
+        Write the items staged by stage, then delete the artifact
+
+        Args:
+            handle: artifact handle
+            artifacts: where the items were staged
+
+        Returns:
+            stats(dict): see run
+        """
+        dir_path = artifacts.get_metadata(handle)["dir_path"]
+        stats = self.write((decode_item(record) for record in artifacts.iter(handle)),dir_path=dir_path)
+        artifacts.delete(handle)
+        return stats
+
+    def write(self,items:Iterable[tuple],dir_path:str) -> dict:
+        """
+        Embed and write work items on the writer thread, then remove the chunks no
+        file references anymore
+
+        Args:
+            items: see iter_items
+            dir_path: location of the csv files, to find deleted files
+
+        Returns:
+            stats(dict): see run
+        """
+        start = datetime.now()
+        writer = threading.Thread(target=self._writer,name="ingestion-writer",daemon=True)
+        writer.start()
+        try:
+            for item in items:
+                # blocks while the writer is max_pending_batches behind (backpressure)
+                self.queue.put(item)
+                if self.error:
+                    break
+        finally:
+            self.queue.put(self._DONE)
+            writer.join()
+
+        if not self.error:
+            existing = {f'{dir_path}/{file}' for file in os.listdir(dir_path)}
+            for file_path in self.manifest.get_files(dir_path=dir_path):
+                if file_path not in existing:
+                    self.stale_chunks.update(self.manifest.get_chunks(file_path))
+                    self.manifest.remove_file(file_path)
+                    self.stats["removed_files"] += 1
+            to_delete = self.stale_chunks - self.manifest.referenced_chunks(self.stale_chunks)
+            self.vector_store.delete_documents(ids=[self.vector_store.make_document_id(h) for h in to_delete])
+            self.stats["deleted"] = len(to_delete)
+        self.stats["seconds"] = round((datetime.now() - start).total_seconds(),3)
+        logger.info(f'streaming ingestion:{self.stats}')
+        if self.error:
+            raise self.error
+        return self.stats
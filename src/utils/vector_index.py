@@ -0,0 +1,172 @@
+import math
+import re
+from typing import Optional, Tuple
+
+# langchain_postgres stores every collection in one table with an untyped 'vector'
+# column, so ANN indexes are expression indexes on embedding::vector(dims), partial
+# on the collection. Queries must use the same expression to be able to use them.
+EMBEDDING_TABLE = "langchain_pg_embedding"
+INDEX_STRATEGIES = ("hnsw","ivfflat")
+# quantizations the index can be built on: pgvector type and operator class. The
+# rows keep their float32 vectors, only the index is compact; 'binary' results are
+# reranked with the float32 vectors. halfvec and bit need pgvector >= 0.7.0
+INDEX_QUANTIZATIONS = {
+    "float32":("vector","vector_cosine_ops"),
+    "float16":("halfvec","halfvec_cosine_ops"),
+    "binary":("bit","bit_hamming_ops"),
+}
+INDEX_QUANTIZATION_MIN_VERSION = {"float32":(0,5,0),"float16":(0,7,0),"binary":(0,7,0)}
+INDEX_EXPRESSION_PATTERN = re.compile(r"::(vector|halfvec|bit)\((\d+)\)")
+# postgres memory setting: an integer with an optional unit, e.g. '2GB', '512 MB'
+MEMORY_SETTING_PATTERN = re.compile(r"^\d+\s*(B|kB|MB|GB|TB)?$")
+
+
+def get_index_name(collection_id:str,strategy:str) -> str:
+    """
+    Name of the ANN index of a collection (postgres names are limited to 63 chars)
+
+    Args:
+        collection_id: uuid of the collection
+        strategy: 'hnsw' or 'ivfflat'
+
+    Returns:
+        name(str)
+    """
+    return f'ix_embedding_{str(collection_id).replace("-","")[:16]}_{strategy}'
+
+def get_index_prefix(collection_id:str) -> str:
+    """
+    Common prefix of the index names of a collection
+    """
+    return f'ix_embedding_{str(collection_id).replace("-","")[:16]}_'
+
+def get_index_expression(dimensions:int,quantization:str="float32") -> str:
+    """
+    Indexed expression of the embedding column for a quantization, queries must
+    order by the same expression to use the index
+
+    Args:
+        dimensions: embedding dimensions
+        quantization: key of INDEX_QUANTIZATIONS
+
+    Returns:
+        expression(str)
+    """
+    if quantization not in INDEX_QUANTIZATIONS:
+        raise ValueError(f'unknown index quantization {quantization}, expected one of {tuple(INDEX_QUANTIZATIONS)}')
+    if quantization == "binary":
+        return f'(binary_quantize(embedding)::bit({int(dimensions)}))'
+    return f'(embedding::{INDEX_QUANTIZATIONS[quantization][0]}({int(dimensions)}))'
+
+def parse_index_definition(definition:str) -> Tuple[int,str]:
+    """
+    Dimensions and quantization of an index from its definition (pg_indexes.indexdef)
+
+    Returns:
+        (dimensions, quantization)
+    """
+    vector_type,dimensions = INDEX_EXPRESSION_PATTERN.search(definition).groups()
+    quantization = {value[0]:key for key,value in INDEX_QUANTIZATIONS.items()}[vector_type]
+    return int(dimensions),quantization
+
+def parse_version(version:str) -> tuple:
+    """
+    '0.6.2' -> (0, 6, 2)
+    """
+    return tuple(int(part) for part in re.findall(r"\d+",version or "")[:3])
+
+def build_maintenance_work_mem_sql(value:str) -> str:
+    """
+    SET LOCAL statement raising maintenance_work_mem for an index build. SET can't
+    take bind parameters, so the value is checked against MEMORY_SETTING_PATTERN
+
+    Args:
+        value: memory setting from the 'index' config, e.g. '2GB'
+
+    Returns:
+        sql(str)
+    """
+    value = str(value).strip()
+    if not MEMORY_SETTING_PATTERN.match(value):
+        raise ValueError(f"invalid maintenance_work_mem {value!r}, expected a size such as '512MB' or '2GB'")
+    return f"SET LOCAL maintenance_work_mem = '{value}'"
+
+def get_ivfflat_lists(row_count:int) -> int:
+    """
+    pgvector's rule of thumb for the number of ivfflat lists: rows/1000 up to 1M rows,
+    sqrt(rows) above
+
+    Args:
+        row_count: number of vectors in the collection
+
+    Returns:
+        lists(int)
+    """
+    if row_count <= 1000000:
+        return max(row_count // 1000,10)
+    return int(math.sqrt(row_count))
+
+def choose_index_strategy(row_count:int,configs:dict) -> Optional[str]:
+    """
+    Pick an index strategy from the collection size: no index for small collections
+    (an exact scan is cheap and exact), HNSW for most sizes, IVFFlat for very large
+    collections where HNSW build time and memory become the bottleneck
+
+    Args:
+        row_count: number of vectors in the collection
+        configs: the vector_store 'index' config
+
+    Returns:
+        strategy(str): 'hnsw', 'ivfflat' or None
+    """
+    strategy = configs.get("strategy","auto")
+    if strategy in INDEX_STRATEGIES:
+        return strategy
+    if strategy != "auto" or row_count < configs.get("min_rows",10000):
+        return None
+    if row_count >= configs.get("ivfflat_min_rows",5000000):
+        return "ivfflat"
+    return "hnsw"
+
+def build_create_index_sql(
+        collection_id:str,
+        dimensions:int,
+        strategy:str,
+        m:int=16,
+        ef_construction:int=64,
+        lists:int=100,
+        operator_class:str=None,
+        concurrently:bool=False,
+        quantization:str="float32"
+    ) -> str:
+    """
+    CREATE INDEX statement for a collection
+
+    Args:
+        collection_id: uuid of the collection
+        dimensions: embedding dimensions
+        strategy: 'hnsw' or 'ivfflat'
+        m: HNSW max connections per layer
+        ef_construction: HNSW candidate list size while building
+        lists: IVFFlat number of lists
+        operator_class: pgvector operator class, defaults to the cosine (hamming for
+            'binary') class of the quantization
+        concurrently: build without blocking writes (not allowed inside a transaction)
+        quantization: key of INDEX_QUANTIZATIONS
+
+    Returns:
+        sql(str)
+    """
+    if strategy not in INDEX_STRATEGIES:
+        raise ValueError(f'unknown index strategy {strategy}, expected one of {INDEX_STRATEGIES}')
+    if strategy == "hnsw":
+        options = f'm = {int(m)}, ef_construction = {int(ef_construction)}'
+    else:
+        options = f'lists = {int(lists)}'
+    operator_class = operator_class or INDEX_QUANTIZATIONS[quantization][1]
+    return (
+        f'CREATE INDEX {"CONCURRENTLY " if concurrently else ""}IF NOT EXISTS {get_index_name(collection_id,strategy)} '
+        f'ON {EMBEDDING_TABLE} USING {strategy} ({get_index_expression(dimensions,quantization)} {operator_class}) '
+        f'WITH ({options}) '
+        f"WHERE collection_id = '{collection_id}'"
+    )